@@ -1,6 +1,26 @@
+from stimpl.asynchronous import *
+from stimpl.batch import *
+from stimpl.codegen import *
+from stimpl.compile import *
 from stimpl.errors import *
 from stimpl.expression import *
+from stimpl.hamt import *
+from stimpl.hashcons import *
+from stimpl.hooks import *
+from stimpl.incremental import *
+from stimpl.iterative import *
+from stimpl.optimize import *
+from stimpl.output import *
+from stimpl.parallel import *
+from stimpl.parse import *
+from stimpl.profile import *
+from stimpl.rope import *
 from stimpl.runtime import *
 from stimpl.robustness import *
+from stimpl.serialize import *
+from stimpl.snapshot import *
+from stimpl.table import *
 from stimpl.test import *
-from stimpl.types import *
\ No newline at end of file
+from stimpl.typecheck import *
+from stimpl.types import *
+from stimpl.vm import *
\ No newline at end of file
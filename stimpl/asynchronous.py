@@ -0,0 +1,72 @@
+import asyncio
+from typing import Any, Optional, Tuple
+
+from stimpl.expression import Expr
+from stimpl.types import Type
+from stimpl.hooks import Hooks, current_hooks
+from stimpl.iterative import HookedMachine, Machine
+from stimpl.output import output_to
+from stimpl.rope import flattened
+from stimpl.runtime import Budget, EmptyState, State, current_budget, flattened_state
+
+"""
+Asynchronous execution
+
+`run_stimpl_async` is `run_stimpl` as a coroutine. It runs the program on
+the iterative machine of `stimpl.iterative` -- whose semantics are those
+of `evaluate`, down to the errors and the points at which they are
+raised -- `yield_every` tasks at a time, and hands control back to the
+event loop between batches. So a long-running program never blocks the
+loop for longer than one batch takes, and any number of programs can
+run side by side in one thread, each in a task of its own.
+
+Cancelling the task raises `asyncio.CancelledError` at the end of the
+batch that is running. The output sink, the hooks and the limits of a
+run belong to its task, just like those of `run_stimpl` belong to the
+thread (or task) that calls it.
+"""
+
+YIELD_EVERY = 1 << 12
+
+
+async def run_stimpl_async(program: Expr, state: Optional[State] = None, optimized: bool = False,
+                           output: Any = None, hooks: Optional[Hooks] = None,
+                           max_steps: Optional[int] = None, max_state_entries: Optional[int] = None,
+                           timeout: Optional[float] = None,
+                           yield_every: int = YIELD_EVERY) -> Tuple[Optional[Any], Type, State]:
+    """
+    Run `program` like `run_stimpl` (with the same `state`, `optimized`,
+    `output`, `hooks` and limits) and return its value, type and state,
+    letting other tasks run after every `yield_every` tasks of the
+    machine.
+    """
+    if state is None:
+        state = EmptyState()
+    if optimized:
+        from stimpl.optimize import optimize_program
+        program = optimize_program(program)
+    if hooks is None:
+        hooks = current_hooks.get()
+    budget = None
+    if max_steps is not None or max_state_entries is not None or timeout is not None:
+        budget = Budget(max_steps, max_state_entries, timeout)
+
+    budget_token = current_budget.set(budget)
+    try:
+        if output is None:
+            return await run_machine(program, state, hooks, budget, yield_every)
+        with output_to(output):
+            return await run_machine(program, state, hooks, budget, yield_every)
+    finally:
+        current_budget.reset(budget_token)
+
+
+async def run_machine(program: Expr, state: State, hooks: Optional[Hooks], budget: Optional[Budget],
+                      yield_every: int) -> Tuple[Optional[Any], Type, State]:
+    machine = HookedMachine(program, state, hooks) if hooks else Machine(program, state)
+    while not machine.run(yield_every):
+        if budget is not None:
+            budget.check_clock(machine.state)
+        await asyncio.sleep(0)
+    value, value_type, final_state = machine.result()
+    return (flattened(value), value_type, flattened_state(final_state))
@@ -0,0 +1,453 @@
+from typing import Any, Dict, List, Optional, Sequence as Seq, Tuple
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.output import CollectedOutput, printed_text
+from stimpl.runtime import EmptyState, State, run_stimpl
+from stimpl.codegen import ARITHMETIC_TYPES, ADDABLE_TYPES, ORDERED_TYPES, \
+    fail_read, fail_assign, fail_arithmetic, fail_divide_by_zero, \
+    fail_logical, fail_not, fail_relational, fail_condition, fail_unhandled
+
+"""
+Batch execution
+
+`run_stimpl_batch` runs one program against many initial states (lanes)
+at once. Lanes whose initial bindings have the same types run together:
+every variable becomes a NumPy array with one element per lane, every
+operator a single array operation over the lanes that evaluate it, and
+`If` and `While` run their branches and bodies for the lanes (the mask)
+that take them. Integers are int64 until an operation could overflow,
+when they switch to arrays of Python integers.
+
+Errors belong to the lanes that raise them: a lane that raises stops
+there, and the others carry on. The rare lane that the arrays cannot
+represent -- one whose variable would be bound to a different type than
+the same variable in other lanes -- is run on its own by the reference
+evaluator instead.
+
+The output of `Print`s is captured per lane (and not printed).
+
+NumPy is only imported when `run_stimpl_batch` is called.
+"""
+
+INT64_MAX = 2 ** 63 - 1
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError as error:
+        raise ImportError("run_stimpl_batch requires NumPy.") from error
+    return numpy
+
+
+def raised(fail, *arguments) -> InterpError:
+    """
+    The error that `fail` (one of the `stimpl.codegen` `fail_*` helpers)
+    raises, so lanes report exactly the errors the other engines raise.
+    """
+    try:
+        fail(*arguments)
+    except InterpError as error:
+        return error
+
+
+class LaneResult(object):
+    """
+    The outcome of running a program in one lane: its value, type and
+    final state or the error that it raised, and what it printed.
+    """
+
+    def __init__(self, value: Any, value_type: Optional[Type], state: Optional[State],
+                 error: Optional[InterpError], output: str) -> None:
+        self.value = value
+        self.value_type = value_type
+        self.state = state
+        self.error = error
+        self.output = output
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            return f"LaneResult(error={self.error!r})"
+        return f"LaneResult(value={self.value!r}, type={self.value_type})"
+
+
+class Column(object):
+    """
+    The values (one per lane) and the type of an expression. Only the
+    elements of the lanes that evaluated it are meaningful.
+    """
+    __slots__ = ("type", "values")
+
+    def __init__(self, column_type: Optional[Type], values: Any) -> None:
+        self.type = column_type
+        self.values = values
+
+
+class Binding(object):
+    __slots__ = ("type", "values", "bound", "assigned")
+
+    def __init__(self, binding_type: Type, values: Any, bound: Any, assigned: Any) -> None:
+        self.type = binding_type
+        self.values = values
+        self.bound = bound
+        self.assigned = assigned
+
+
+DEAD = Column(None, None)
+
+
+class Lanes(object):
+    """
+    Runs a program over lanes whose initial bindings have the same types.
+    """
+
+    def __init__(self, numpy, states: Seq[State]) -> None:
+        self.np = numpy
+        self.count = len(states)
+        self.alive = numpy.ones(self.count, dtype=bool)
+        self.ejected = numpy.zeros(self.count, dtype=bool)
+        self.errors: List[Optional[InterpError]] = [None] * self.count
+        self.outputs: List[List[str]] = [[] for _ in range(self.count)]
+        self.bindings: Dict[str, Binding] = {}
+
+        for variable_name, _, variable_type in states[0].bindings():
+            values = [state.get_value(variable_name)[0] for state in states]
+            self.bindings[variable_name] = Binding(
+                variable_type, self.array(variable_type, values),
+                numpy.ones(self.count, dtype=bool), numpy.zeros(self.count, dtype=bool))
+
+    def array(self, values_type: Type, values: List[Any]) -> Any:
+        np = self.np
+        match values_type:
+            case Integer():
+                try:
+                    return np.array(values, dtype=np.int64)
+                except OverflowError:
+                    pass
+            case FloatingPoint():
+                return np.array(values, dtype=np.float64)
+            case Boolean():
+                return np.array(values, dtype=bool)
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    def constant(self, value: Any, value_type: Type) -> Column:
+        return Column(value_type, self.array(value_type, [value] * self.count))
+
+    def fail(self, mask: Any, error: InterpError) -> Column:
+        for lane in self.np.flatnonzero(mask & self.alive):
+            self.errors[lane] = error
+        self.alive &= ~mask
+        return DEAD
+
+    def eject(self, mask: Any) -> None:
+        self.ejected |= mask & self.alive
+        self.alive &= ~mask
+
+    def scatter(self, indices: Any, values: Any) -> Any:
+        result = self.np.empty(self.count, dtype=values.dtype)
+        result[indices] = values
+        return result
+
+    def widened(self, left: Any, right: Any, combine_magnitudes) -> Tuple[Any, Any]:
+        """
+        `left` and `right` (integer operands), as arrays of Python integers
+        unless the operation is certain to fit in 64 bits.
+        """
+        if left.dtype != object and right.dtype != object:
+            if len(left) == 0:
+                return (left, right)
+
+            def magnitude(values):
+                return max(abs(int(values.min())), abs(int(values.max())))
+            if combine_magnitudes(magnitude(left), magnitude(right)) <= INT64_MAX:
+                return (left, right)
+        return (left.astype(object), right.astype(object))
+
+    """
+    Evaluation. Every method evaluates an expression in the lanes of
+    `mask` that are still alive.
+    """
+
+    def evaluate(self, expression: Expr, mask: Any) -> Column:
+        mask = mask & self.alive
+        if not mask.any():
+            return DEAD
+        np = self.np
+
+        match expression:
+            case Ren():
+                return self.constant(None, Unit())
+
+            case IntLiteral(literal=l):
+                return self.constant(l, Integer())
+
+            case FloatingPointLiteral(literal=l):
+                return self.constant(l, FloatingPoint())
+
+            case StringLiteral(literal=l):
+                return self.constant(l, String())
+
+            case BooleanLiteral(literal=l):
+                return self.constant(l, Boolean())
+
+            case Print(to_print=to_print):
+                column = self.evaluate(to_print, mask)
+                mask &= self.alive
+                if not mask.any():
+                    return DEAD
+                indices = np.flatnonzero(mask)
+                for lane, value in zip(indices, column.values[indices].tolist()):
+                    self.outputs[lane].append(printed_text(value, column.type))
+                return column
+
+            case Sequence(exprs=exprs) | Program(exprs=exprs):
+                column = self.constant(None, Unit())
+                for expr in exprs:
+                    column = self.evaluate(expr, mask)
+                return column
+
+            case Variable(variable_name=variable_name):
+                binding = self.bindings.get(variable_name)
+                if binding is None:
+                    return self.fail(mask, raised(fail_read, variable_name))
+                self.fail(mask & ~binding.bound, raised(fail_read, variable_name))
+                return Column(binding.type, binding.values)
+
+            case Assign(variable=variable, value=value):
+                return self.assign(variable.variable_name, self.evaluate(value, mask), mask)
+
+            case Add(left=left, right=right) | Subtract(left=left, right=right) | \
+                    Multiply(left=left, right=right) | Divide(left=left, right=right):
+                return self.arithmetic(expression, self.evaluate(left, mask),
+                                       self.evaluate(right, mask), mask)
+
+            case And(left=left, right=right) | Or(left=left, right=right):
+                left_column = self.evaluate(left, mask)
+                right_column = self.evaluate(right, mask)
+                mask &= self.alive
+                if not mask.any():
+                    return DEAD
+                if type(left_column.type) is not Boolean or type(right_column.type) is not Boolean:
+                    name, verb = ("And", "and") if kind(expression) is And else ("Or", "or")
+                    return self.fail(mask, raised(fail_logical, name, verb,
+                                                  left_column.type, right_column.type))
+                combine = np.logical_and if kind(expression) is And else np.logical_or
+                return Column(Boolean(), combine(left_column.values, right_column.values))
+
+            case Not(expr=expr):
+                column = self.evaluate(expr, mask)
+                mask &= self.alive
+                if not mask.any():
+                    return DEAD
+                if type(column.type) is not Boolean:
+                    return self.fail(mask, raised(fail_not))
+                return Column(Boolean(), np.logical_not(column.values))
+
+            case Lt(left=left, right=right) | Lte(left=left, right=right) | \
+                    Gt(left=left, right=right) | Gte(left=left, right=right) | \
+                    Eq(left=left, right=right) | Ne(left=left, right=right):
+                return self.relational(expression, self.evaluate(left, mask),
+                                       self.evaluate(right, mask), mask)
+
+            case If(condition=condition, true=true, false=false):
+                column = self.evaluate(condition, mask)
+                mask &= self.alive
+                if not mask.any():
+                    return DEAD
+                if type(column.type) is not Boolean:
+                    return self.fail(mask, raised(fail_condition, "If", column.type))
+                true_mask = mask & column.values
+                false_mask = mask & ~column.values
+                true_column = self.evaluate(true, true_mask)
+                false_column = self.evaluate(false, false_mask)
+                true_mask &= self.alive
+                false_mask &= self.alive
+                if not false_mask.any():
+                    return true_column
+                if not true_mask.any():
+                    return false_column
+                if true_column.type is not false_column.type:
+                    self.eject(false_mask)
+                    return true_column
+                return Column(true_column.type,
+                              np.where(true_mask, true_column.values, false_column.values))
+
+            case While(condition=condition, body=body):
+                running = mask
+                while True:
+                    column = self.evaluate(condition, running)
+                    running = running & self.alive
+                    if not running.any():
+                        break
+                    if type(column.type) is not Boolean:
+                        self.fail(running, raised(fail_condition, "While", column.type))
+                        break
+                    running = running & column.values
+                    if not running.any():
+                        break
+                    self.evaluate(body, running)
+                return self.constant(False, Boolean())
+
+            case _:
+                return self.fail(mask, raised(fail_unhandled))
+
+    def assign(self, variable_name: str, column: Column, mask: Any) -> Column:
+        mask = mask & self.alive
+        if not mask.any():
+            return DEAD
+        binding = self.bindings.get(variable_name)
+        if binding is None:
+            self.bindings[variable_name] = Binding(column.type, column.values.copy(),
+                                                   mask.copy(), mask.copy())
+            return column
+        if binding.type is not column.type:
+            self.fail(mask & binding.bound, raised(fail_assign, column.type, binding.type))
+            # The variable is unbound in the remaining lanes, but it is
+            # bound to another type in others.
+            self.eject(mask)
+            return DEAD
+
+        # Columns that were read from the binding must not change, so the
+        # binding gets a new array.
+        if binding.values.dtype != column.values.dtype:
+            values = binding.values.astype(object)
+        else:
+            values = binding.values.copy()
+        indices = self.np.flatnonzero(mask)
+        values[indices] = column.values[indices]
+        binding.values = values
+        binding.bound = binding.bound | mask
+        binding.assigned = binding.assigned | mask
+        return column
+
+    def arithmetic(self, expression: Expr, left: Column, right: Column, mask: Any) -> Column:
+        np = self.np
+        mask = mask & self.alive
+        if not mask.any():
+            return DEAD
+        expression_kind = kind(expression)
+        name, verb, preposition, allowed = {
+            Add: ("Add", "add", "to", ADDABLE_TYPES),
+            Subtract: ("Subtract", "subtract", "from", ARITHMETIC_TYPES),
+            Multiply: ("Multiply", "multiply", "by", ARITHMETIC_TYPES),
+            Divide: ("Divide", "divide", "by", ARITHMETIC_TYPES),
+        }[expression_kind]
+        if left.type is not right.type or type(left.type) not in allowed:
+            return self.fail(mask, raised(fail_arithmetic, name, verb, preposition,
+                                          left.type, right.type))
+
+        indices = np.flatnonzero(mask)
+        left_values, right_values = left.values[indices], right.values[indices]
+        if expression_kind is Divide:
+            zero = right_values == 0
+            if zero.any():
+                self.fail(self.scatter(indices, zero) & mask, raised(fail_divide_by_zero))
+                indices, left_values, right_values = \
+                    indices[~zero], left_values[~zero], right_values[~zero]
+
+        integer = type(left.type) is Integer
+        if expression_kind is Add:
+            if integer:
+                left_values, right_values = self.widened(
+                    left_values, right_values, lambda l, r: l + r)
+            result = np.add(left_values, right_values)
+        elif expression_kind is Subtract:
+            if integer:
+                left_values, right_values = self.widened(
+                    left_values, right_values, lambda l, r: l + r)
+            result = np.subtract(left_values, right_values)
+        elif expression_kind is Multiply:
+            if integer:
+                left_values, right_values = self.widened(
+                    left_values, right_values, lambda l, r: l * r)
+            result = np.multiply(left_values, right_values)
+        elif integer:
+            # Only dividing the smallest int64 by -1 overflows.
+            left_values, right_values = self.widened(
+                left_values, right_values, lambda l, r: l)
+            result = np.floor_divide(left_values, right_values)
+        else:
+            result = np.true_divide(left_values, right_values)
+        return Column(left.type, self.scatter(indices, result))
+
+    def relational(self, expression: Expr, left: Column, right: Column, mask: Any) -> Column:
+        np = self.np
+        mask = mask & self.alive
+        if not mask.any():
+            return DEAD
+        name, symbol, on_units, compare = {
+            Lt: ("Lt", "<", False, np.less),
+            Lte: ("Lte", "<=", True, np.less_equal),
+            Gt: ("Gt", ">", False, np.greater),
+            Gte: ("Gte", ">=", True, np.greater_equal),
+            Eq: ("Eq", "==", True, np.equal),
+            Ne: ("Ne", "!=", False, np.not_equal),
+        }[kind(expression)]
+        if left.type is not right.type or \
+                (type(left.type) not in ORDERED_TYPES and type(left.type) is not Unit):
+            return self.fail(mask, raised(fail_relational, name, symbol, left.type, right.type))
+        if type(left.type) is Unit:
+            return self.constant(on_units, Boolean())
+        indices = np.flatnonzero(mask)
+        result = compare(left.values[indices], right.values[indices]).astype(bool)
+        return Column(Boolean(), self.scatter(indices, result))
+
+    def results(self, column: Column, states: Seq[State]) -> List[Optional[LaneResult]]:
+        """
+        The result of every lane that ran here (None for ejected lanes).
+        """
+        results: List[Optional[LaneResult]] = []
+        for lane, state in enumerate(states):
+            output = "".join(line + "\n" for line in self.outputs[lane])
+            if self.ejected[lane]:
+                results.append(None)
+            elif self.errors[lane] is not None:
+                results.append(LaneResult(None, None, None, self.errors[lane], output))
+            else:
+                for variable_name, binding in self.bindings.items():
+                    if binding.assigned[lane]:
+                        state = state.set_value(variable_name, binding.values[lane:lane + 1].tolist()[0],
+                                                binding.type)
+                value = column.values[lane:lane + 1].tolist()[0]
+                results.append(LaneResult(value, column.type, state, None, output))
+        return results
+
+
+def run_lane(program: Expr, state: State) -> LaneResult:
+    output = CollectedOutput()
+    try:
+        value, value_type, state = run_stimpl(program, state=state, output=output)
+    except InterpError as error:
+        return LaneResult(None, None, None, error, output.text())
+    return LaneResult(value, value_type, state, None, output.text())
+
+
+def signature(state: State) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((variable_name, type(variable_type).__name__)
+                        for variable_name, _, variable_type in state.bindings()))
+
+
+def run_stimpl_batch(program: Expr, initial_states: Seq[Optional[State]]) -> List[LaneResult]:
+    """
+    Run `program` once for every state in `initial_states` (None for an
+    `EmptyState`) and return the result of every run, in order.
+    """
+    np = require_numpy()
+    states = [EmptyState() if state is None else state for state in initial_states]
+    groups: Dict[Tuple, List[int]] = {}
+    for lane, state in enumerate(states):
+        groups.setdefault(signature(state), []).append(lane)
+
+    results: List[Optional[LaneResult]] = [None] * len(states)
+    for lanes in groups.values():
+        group_states = [states[lane] for lane in lanes]
+        group = Lanes(np, group_states)
+        with np.errstate(all="ignore"):
+            column = group.evaluate(program, group.alive.copy())
+        for lane, result in zip(lanes, group.results(column, group_states)):
+            results[lane] = result if result is not None else run_lane(program, states[lane])
+    return results
@@ -0,0 +1,20 @@
+from stimpl.bench.workloads import *
+from stimpl.bench.suite import *
+
+"""
+Benchmarks
+
+    python -m stimpl.bench [--engines ENGINE ...] [--workloads NAME ...]
+                           [--repeat N] [--scale FACTOR] [--threshold FRACTION]
+                           [--baseline PATH] [--update-baseline] [--json PATH]
+
+runs every workload of `stimpl.bench.workloads` with every engine,
+prints what it measured (see `stimpl.bench.suite`) and compares it with
+the baseline (by default, `baseline.json` next to this file). It exits
+with status 1 when anything regressed by more than the threshold.
+Timings are compared relative to a calibration workload that runs in the
+same process, so the committed baseline carries over between machines
+of a kind; `--update-baseline` writes the measurements to the baseline
+instead, and is how to record one for a very different machine or
+version of Python.
+"""
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+import sys
+
+from stimpl.bench.suite import DEFAULT_THRESHOLD, ENGINES, compare, load_baseline, report, \
+    run_suite, save_baseline
+from stimpl.bench.workloads import WORKLOADS
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def main(arguments=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m stimpl.bench", description="Benchmark the STIMPL engines.")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--workloads", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the size of every workload by this factor")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="the largest change (a fraction) that is not a regression")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", help="also write the measurements to this file")
+    options = parser.parse_args(arguments)
+
+    measurements = run_suite(options.workloads, options.engines, options.repeat, options.scale)
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as json_file:
+            json.dump([measurement.as_dict() for measurement in measurements], json_file, indent=1)
+
+    if options.update_baseline:
+        save_baseline(measurements, options.baseline)
+        print(report(measurements))
+        return 0
+
+    baseline = load_baseline(options.baseline) if os.path.exists(options.baseline) else {}
+    print(report(measurements, baseline))
+    if options.scale != 1.0 and baseline:
+        print("Not comparing with the baseline: the workloads are not at their baseline sizes.")
+        return 0
+    regressions = compare(measurements, baseline, options.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
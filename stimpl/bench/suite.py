@@ -0,0 +1,250 @@
+import io
+import json
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, Optional
+
+from stimpl.bench.workloads import WORKLOADS, Workload
+from stimpl.expression import Expr
+from stimpl.hooks import Hooks
+from stimpl.output import BufferedOutput
+from stimpl.profile import state_length
+from stimpl.runtime import run_stimpl
+
+"""
+Measuring
+
+`measure` runs a workload with an engine and records
+
+    ops                 the number of nodes that evaluating the program
+                        evaluates (counted once, with an enter hook, so
+                        that engines that skip work get credit for it)
+    seconds             the best time of `repeat` runs (or batches of
+                        runs, for programs that run very quickly)
+    ops_per_second      ops / seconds
+    peak_memory         the peak of the memory allocated during a run
+                        (in bytes, according to `tracemalloc`)
+    state_size          the number of bindings in the final `State`
+    max_state_length    the largest number of bindings that the `State`
+                        held (according to `stimpl.profile`)
+    value               the `repr` of the program's value
+    calibration         the best time of a fixed workload of plain
+                        Python (`calibrate`), run in the same process
+
+A baseline is the JSON of a list of measurements. `compare` reports
+every measurement that got slower (or bigger) than its baseline by more
+than a threshold, and every one whose value changed. Speeds are compared
+in ops per calibration (`relative_speed`) rather than ops/s, so that a
+baseline recorded on one machine is meaningful on another. The
+normalization cannot account for everything (a different version of
+Python, say, speeds some operations up more than others): regenerate the
+baseline when it is used somewhere very different from where it was
+recorded.
+"""
+
+ENGINES = ("tree", "closure", "python", "vm", "iterative")
+
+DEFAULT_THRESHOLD = 0.25
+
+# Runs that take less than this many seconds are timed in batches (of at
+# most `MAXIMUM_RUNS` runs).
+MINIMUM_SAMPLE = 0.02
+MAXIMUM_RUNS = 100000
+
+# Differences in peak memory below this many bytes are noise.
+MEMORY_SLACK = 1 << 16
+
+CALIBRATION_SIZE = 200000
+
+
+class Measurement(object):
+    def __init__(self, workload: str, engine: str, value: str, ops: int, seconds: float,
+                 peak_memory: int, state_size: int, max_state_length: int, calibration: float) -> None:
+        self.workload = workload
+        self.engine = engine
+        self.value = value
+        self.ops = ops
+        self.seconds = seconds
+        self.peak_memory = peak_memory
+        self.state_size = state_size
+        self.max_state_length = max_state_length
+        self.calibration = calibration
+
+    @property
+    def key(self) -> str:
+        return f"{self.workload}/{self.engine}"
+
+    @property
+    def ops_per_second(self) -> float:
+        return self.ops / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def relative_speed(self) -> float:
+        """
+        The ops evaluated in the time that the calibration workload takes.
+        """
+        return self.ops_per_second * self.calibration
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"workload": self.workload, "engine": self.engine, "value": self.value,
+                "ops": self.ops, "seconds": self.seconds, "ops_per_second": self.ops_per_second,
+                "peak_memory": self.peak_memory, "state_size": self.state_size,
+                "max_state_length": self.max_state_length, "calibration": self.calibration}
+
+    @staticmethod
+    def from_dict(measured: Dict[str, Any]) -> 'Measurement':
+        return Measurement(measured["workload"], measured["engine"], measured["value"], measured["ops"],
+                           measured["seconds"], measured["peak_memory"], measured["state_size"],
+                           measured["max_state_length"], measured["calibration"])
+
+    def __repr__(self) -> str:
+        return f"Measurement({self.key}, {self.ops_per_second:.0f} ops/s)"
+
+
+def counted_ops(program: Expr) -> int:
+    ops = 0
+
+    def count(node):
+        nonlocal ops
+        ops += 1
+    hooks = Hooks()
+    hooks.register("enter", count)
+    run_stimpl(program, engine="iterative", hooks=hooks, output=BufferedOutput(io.StringIO()))
+    return ops
+
+
+def calibration_workload(size: int) -> int:
+    # Dictionary lookups, arithmetic and calls: the kind of work that
+    # the engines do.
+    bindings: Dict[int, int] = {}
+    total = 0
+    for i in range(size):
+        bindings[i & 1023] = total
+        total = (total + bindings.get((i * 7) & 1023, i)) & 0xFFFF
+    return total
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    The best time (in seconds) of `repeat` runs of a fixed workload of
+    plain Python.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        calibration_workload(CALIBRATION_SIZE)
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds
+
+
+def measure(name: str, workload: Workload, engine: str, repeat: int = 3,
+            scale: float = 1.0, calibration: Optional[float] = None) -> Measurement:
+    program = workload.build(max(1, int(workload.size * scale)))
+    ops = counted_ops(program)
+    max_state_length = run_stimpl(program, profile=True, output=BufferedOutput(io.StringIO()))[3].max_state_length
+
+    # A first run fills the engine's caches.
+    run_stimpl(program, engine=engine, output=BufferedOutput(io.StringIO()))
+
+    # Fast runs are timed in batches long enough for the clock to
+    # measure them reliably.
+    runs = 1
+    seconds = float("inf")
+    sample = 0
+    while sample < repeat:
+        start = time.perf_counter()
+        for _ in range(runs):
+            value, _, state = run_stimpl(program, engine=engine, output=BufferedOutput(io.StringIO()))
+        elapsed = time.perf_counter() - start
+        if elapsed < MINIMUM_SAMPLE and runs < MAXIMUM_RUNS:
+            runs *= 10
+            continue
+        seconds = min(seconds, elapsed / runs)
+        sample += 1
+
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    run_stimpl(program, engine=engine, output=BufferedOutput(io.StringIO()))
+    peak_memory = tracemalloc.get_traced_memory()[1] - base
+    if not already_tracing:
+        tracemalloc.stop()
+
+    if calibration is None:
+        calibration = calibrate()
+    return Measurement(name, engine, repr(value), ops, seconds, peak_memory,
+                       state_length(state), max_state_length, calibration)
+
+
+def run_suite(workloads: Optional[Iterable[str]] = None, engines: Iterable[str] = ENGINES,
+              repeat: int = 3, scale: float = 1.0) -> List[Measurement]:
+    measurements = []
+    engines = tuple(engines)
+    calibration = calibrate()
+    for name in (WORKLOADS if workloads is None else workloads):
+        workload = WORKLOADS[name]
+        for engine in engines:
+            if workload.engines is None or engine in workload.engines:
+                measurements.append(measure(name, workload, engine, repeat, scale, calibration))
+    return measurements
+
+
+def save_baseline(measurements: List[Measurement], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump([measurement.as_dict() for measurement in measurements], baseline_file, indent=1)
+        baseline_file.write("\n")
+
+
+def load_baseline(path: str) -> Dict[str, Measurement]:
+    with open(path, "r", encoding="utf-8") as baseline_file:
+        measurements = [Measurement.from_dict(measured) for measured in json.load(baseline_file)]
+    return {measurement.key: measurement for measurement in measurements}
+
+
+def compare(measurements: List[Measurement], baseline: Dict[str, Measurement],
+            threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """
+    What regressed in `measurements` compared with `baseline` by more
+    than `threshold` (a fraction), one message per regression.
+    Measurements without a baseline are never regressions.
+    """
+    regressions = []
+    for measurement in measurements:
+        base = baseline.get(measurement.key)
+        if base is None:
+            continue
+        if measurement.value != base.value:
+            regressions.append(f"{measurement.key}: value {measurement.value} instead of {base.value}")
+        if measurement.relative_speed < base.relative_speed * (1 - threshold):
+            regressions.append(f"{measurement.key}: {measurement.relative_speed:.0f} ops per calibration, "
+                               f"down from {base.relative_speed:.0f}")
+        if measurement.peak_memory > base.peak_memory * (1 + threshold) + MEMORY_SLACK:
+            regressions.append(f"{measurement.key}: peak memory {measurement.peak_memory} bytes, "
+                               f"up from {base.peak_memory}")
+        if measurement.state_size > base.state_size * (1 + threshold) or \
+                measurement.max_state_length > base.max_state_length * (1 + threshold):
+            regressions.append(f"{measurement.key}: State of {measurement.state_size} "
+                               f"(at most {measurement.max_state_length}) bindings, up from "
+                               f"{base.state_size} (at most {base.max_state_length})")
+    return regressions
+
+
+def report(measurements: List[Measurement], baseline: Optional[Dict[str, Measurement]] = None) -> str:
+    """
+    `measurements` as a text table (with the change in relative speed
+    since `baseline`, if there is one).
+    """
+    header = ("workload", "engine", "ops/s", "change", "peak memory", "state", "max state")
+    rows = []
+    for measurement in measurements:
+        base = baseline.get(measurement.key) if baseline else None
+        change = "" if base is None else f"{measurement.relative_speed / base.relative_speed - 1:+.0%}"
+        rows.append((measurement.workload, measurement.engine, f"{measurement.ops_per_second:.0f}", change,
+                     f"{measurement.peak_memory}", f"{measurement.state_size}",
+                     f"{measurement.max_state_length}"))
+    widths = [max(len(row[column]) for row in rows + [header]) for column in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) if column < 2 else cell.rjust(width)
+                               for column, (cell, width) in enumerate(zip(row, widths)))
+                     for row in [header] + rows)
@@ -0,0 +1,107 @@
+from typing import Callable, Dict, Optional, Tuple
+
+from stimpl.expression import *
+
+"""
+Workloads
+
+Every workload builds a STIMPL program of a given size. The sizes in
+`WORKLOADS` are the ones that the suite (and its baseline) use.
+
+The suite counts the ops of a workload on the iterative machine, so a
+rate is only meaningful for engines that actually run its loops. The
+loops are written so that the closed forms of counted loops (see
+`stimpl.compile`) do not apply to them.
+"""
+
+
+def counter_loop(counter: str, bound: Expr, *body: Expr) -> Expr:
+    """
+    `counter` counted up from 0 to `bound` around `body`.
+    """
+    return Sequence(Assign(Variable(counter), IntLiteral(0)),
+                    While(Lt(Variable(counter), bound),
+                          Sequence(*body, Assign(Variable(counter), Add(Variable(counter), IntLiteral(1))))))
+
+
+def counted_loop(size: int) -> Expr:
+    return Program(Assign(Variable("total"), IntLiteral(0)),
+                   counter_loop("i", IntLiteral(size),
+                                Assign(Variable("total"),
+                                       Add(Variable("total"), Multiply(Variable("i"), Variable("i"))))),
+                   Variable("total"))
+
+
+def nested_loops(size: int) -> Expr:
+    return Program(Assign(Variable("total"), IntLiteral(0)),
+                   counter_loop("i", IntLiteral(size),
+                                counter_loop("j", Variable("i"),
+                                             Assign(Variable("total"),
+                                                    Add(Variable("total"), Multiply(Variable("i"), Variable("j")))))),
+                   Variable("total"))
+
+
+def fibonacci(size: int) -> Expr:
+    return Program(Assign(Variable("a"), IntLiteral(0)),
+                   Assign(Variable("b"), IntLiteral(1)),
+                   counter_loop("n", IntLiteral(size),
+                                Assign(Variable("t"), Add(Variable("a"), Variable("b"))),
+                                Assign(Variable("a"), Variable("b")),
+                                Assign(Variable("b"), Variable("t"))),
+                   Variable("a"))
+
+
+def string_concatenation(size: int) -> Expr:
+    return Program(Assign(Variable("text"), StringLiteral("")),
+                   counter_loop("i", IntLiteral(size),
+                                Assign(Variable("text"), Add(Variable("text"), StringLiteral("ab")))),
+                   Lt(StringLiteral(""), Variable("text")))
+
+
+def deep_nesting(size: int) -> Expr:
+    program = IntLiteral(0)
+    for _ in range(size):
+        program = Add(program, Sequence(Ren(), IntLiteral(1)))
+    return program
+
+
+def many_variables(size: int) -> Expr:
+    # `size` variables, each incremented `size` times by `step` (a
+    # variable, rather than a constant).
+    names = [f"v{index}" for index in range(size)]
+    return Program(*[Assign(Variable(name), IntLiteral(index)) for index, name in enumerate(names)],
+                   Assign(Variable("step"), IntLiteral(1)),
+                   counter_loop("i", IntLiteral(size),
+                                *[Assign(Variable(name), Add(Variable(name), Variable("step"))) for name in names]),
+                   Variable(names[-1]))
+
+
+def print_heavy(size: int) -> Expr:
+    return Program(counter_loop("i", IntLiteral(size),
+                                Print(Variable("i")),
+                                Print(Ren()),
+                                Print(StringLiteral("line"))))
+
+
+class Workload(object):
+    """
+    A program built by `build` at `size`, to be run with `engines` (every
+    engine, when None).
+    """
+
+    def __init__(self, build: Callable[[int], Expr], size: int, engines: Optional[Tuple[str, ...]] = None) -> None:
+        self.build = build
+        self.size = size
+        self.engines = engines
+
+
+WORKLOADS: Dict[str, Workload] = {
+    "counted_loop": Workload(counted_loop, 20000),
+    "nested_loops": Workload(nested_loops, 150),
+    "fibonacci": Workload(fibonacci, 5000),
+    "string_concatenation": Workload(string_concatenation, 5000),
+    # Only the engines that do not recurse can run it.
+    "deep_nesting": Workload(deep_nesting, 5000, ("vm", "iterative")),
+    "many_variables": Workload(many_variables, 100),
+    "print_heavy": Workload(print_heavy, 5000),
+}
@@ -0,0 +1,447 @@
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.output import emit
+from stimpl.rope import ROPE_LENGTH, concat
+from stimpl.runtime import State, current_budget
+
+"""
+Python code generation
+
+The code generator translates a STIMPL expression tree into the source of
+a single Python function with real `while` and `if` statements. Every
+STIMPL variable becomes a pair of Python locals (its value and its type)
+and every intermediate result becomes a pair of temporaries, so the
+generated function never touches a `State` until it returns. The source
+is `compile()`d once per program and the resulting function is cached.
+
+The generated function has the same signature as `evaluate` with the
+expression already supplied:
+
+    generated(state) -> (value, type, state)
+
+Semantics are exactly those of `evaluate`: operands are evaluated
+left-to-right into temporaries (so later side effects cannot change
+values that were already computed), `And` and `Or` never short circuit,
+the first assignment to a variable fixes its type and dividing by zero
+raises an `InterpMathError`.
+"""
+
+ARITHMETIC_TYPES = (Integer, FloatingPoint)
+ADDABLE_TYPES = (Integer, FloatingPoint, String)
+ORDERED_TYPES = (Integer, Boolean, String, FloatingPoint)
+
+"""
+Runtime support for generated code. Each `fail_*` helper is only called
+once the generated code knows that an operation cannot succeed; it
+raises the same error that `evaluate` would.
+"""
+
+
+def load_variable(state: State, variable_name: str) -> Tuple[Any, Optional[Type]]:
+    value = state.get_value(variable_name)
+    if value is None:
+        return (None, None)
+    return value
+
+
+def bound_state(state: State, bindings: Tuple[Tuple[str, Any, Optional[Type]], ...]) -> State:
+    """
+    `state` with the variables that are bound in `bindings` bound: the
+    state that the generated function hands back.
+    """
+    for variable_name, variable_value, variable_type in bindings:
+        if variable_type is not None:
+            state = state.set_value(variable_name, variable_value, variable_type)
+    return state
+
+
+def fail_read(variable_name: str):
+    raise InterpSyntaxError(
+        f"Cannot read from {variable_name} before assignment.")
+
+
+def fail_assign(value_type: Type, variable_type: Type):
+    raise InterpTypeError(f"""Mismatched types for Assignment:
+            Cannot assign {value_type} to {variable_type}""")
+
+
+def fail_arithmetic(name: str, verb: str, preposition: str, left_type: Type, right_type: Type):
+    if left_type is not right_type:
+        raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot {verb} {left_type} {preposition} {right_type}""")
+    raise InterpTypeError(f"""Cannot {verb} {left_type}s""")
+
+
+def fail_divide_by_zero():
+    raise InterpMathError("Cannot divide by zero.")
+
+
+def fail_logical(name: str, verb: str, left_type: Type, right_type: Type):
+    if left_type is not right_type:
+        raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot evaluate {left_type} {verb} {right_type}""")
+    raise InterpTypeError(
+        f"Cannot perform logical {verb} on non-boolean operands.")
+
+
+def fail_not():
+    raise InterpTypeError("Cannot perform logical not on non-boolean operand.")
+
+
+def fail_relational(name: str, symbol: str, left_type: Type, right_type: Type):
+    if left_type is not right_type:
+        raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot compare {left_type} and {right_type}""")
+    raise InterpTypeError(f"Cannot perform {symbol} on {left_type} type.")
+
+
+def fail_condition(construct: str, condition_type: Type):
+    raise InterpTypeError(
+        f"{construct} condition must be Boolean, not {condition_type}.")
+
+
+def fail_unhandled():
+    raise InterpSyntaxError("Unhandled!")
+
+
+ARITHMETIC = {
+    Add: ("Add", "add", "to", "+", "ADDABLE_TYPES"),
+    Subtract: ("Subtract", "subtract", "from", "-", "ARITHMETIC_TYPES"),
+    Multiply: ("Multiply", "multiply", "by", "*", "ARITHMETIC_TYPES"),
+}
+
+LOGICAL = {
+    And: ("And", "and"),
+    Or: ("Or", "or"),
+}
+
+RELATIONAL = {
+    Lt: ("Lt", "<", False),
+    Lte: ("Lte", "<=", True),
+    Gt: ("Gt", ">", False),
+    Gte: ("Gte", ">=", True),
+    Eq: ("Eq", "==", True),
+    Ne: ("Ne", "!=", False),
+}
+
+"""
+Code generation
+"""
+
+# An operand is a pair of Python expressions (as source text) that
+# evaluate to the value and the type of a STIMPL expression.
+Operand = Tuple[str, str]
+
+
+class CodeGenerator(object):
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.indent = 1
+        self.temporaries = 0
+        self.constants: Dict[str, Any] = {}
+        self.variables: Dict[str, int] = {}
+
+    def line(self, text: str) -> None:
+        self.lines.append("    " * self.indent + text)
+
+    def temporary(self) -> Operand:
+        self.temporaries += 1
+        return (f"r{self.temporaries}", f"rt{self.temporaries}")
+
+    def constant(self, value: Any) -> str:
+        name = f"k{len(self.constants)}"
+        self.constants[name] = value
+        return name
+
+    def variable(self, variable_name: str) -> Operand:
+        if variable_name not in self.variables:
+            self.variables[variable_name] = len(self.variables)
+        index = self.variables[variable_name]
+        return (f"v{index}", f"t{index}")
+
+    def block(self, expression: Expr, target: Optional[Operand]) -> None:
+        """
+        Generate an indented block that evaluates `expression` (and stores
+        its result into `target`, when given).
+        """
+        self.indent += 1
+        start = len(self.lines)
+        operand = self.generate(expression)
+        if target is not None:
+            self.line(f"{target[0]}, {target[1]} = {operand[0]}, {operand[1]}")
+        if len(self.lines) == start:
+            self.line("pass")
+        self.indent -= 1
+
+    def generate(self, expression: Expr) -> Operand:
+        match expression:
+            case Ren():
+                return ("None", "UNIT")
+
+            case IntLiteral(literal=l):
+                return (self.constant(l), "INTEGER")
+
+            case FloatingPointLiteral(literal=l):
+                return (self.constant(l), "FLOATINGPOINT")
+
+            case StringLiteral(literal=l):
+                return (self.constant(l), "STRING")
+
+            case BooleanLiteral(literal=l):
+                return (self.constant(l), "BOOLEAN")
+
+            case Print(to_print=to_print):
+                value, value_type = self.generate(to_print)
+                self.line(f"emit({value}, {value_type})")
+                return (value, value_type)
+
+            case Sequence(exprs=exprs) | Program(exprs=exprs):
+                operand = ("None", "UNIT")
+                for expr in exprs:
+                    operand = self.generate(expr)
+                return operand
+
+            case Variable(variable_name=variable_name):
+                value, value_type = self.variable(variable_name)
+                name = self.constant(variable_name)
+                result, result_type = self.temporary()
+                self.line(f"if {value_type} is None: fail_read({name})")
+                self.line(f"{result}, {result_type} = {value}, {value_type}")
+                return (result, result_type)
+
+            case Assign(variable=variable, value=value):
+                value, value_type = self.generate(value)
+                variable_value, variable_type = self.variable(
+                    variable.variable_name)
+                self.line(f"if {variable_type} is None: bound += 1")
+                self.line(f"elif {variable_type} is not {value_type}: "
+                          f"fail_assign({value_type}, {variable_type})")
+                self.line(f"{variable_value}, {variable_type} = {value}, {value_type}")
+                return (value, value_type)
+
+            case Divide(left=left, right=right):
+                left_value, left_type = self.generate(left)
+                right_value, right_type = self.generate(right)
+                result, result_type = self.temporary()
+                self.line(f"if {left_type} is not {right_type} or "
+                          f"type({left_type}) not in ARITHMETIC_TYPES: "
+                          f"fail_arithmetic('Divide', 'divide', 'by', {left_type}, {right_type})")
+                self.line(f"if {right_value} == 0: fail_divide_by_zero()")
+                self.line(f"{result} = {left_value} // {right_value} "
+                          f"if type({left_type}) is Integer else {left_value} / {right_value}")
+                self.line(f"{result_type} = {left_type}")
+                return (result, result_type)
+
+            case Add(left=left, right=right) | Subtract(left=left, right=right) | Multiply(left=left, right=right):
+                name, verb, preposition, symbol, allowed = ARITHMETIC[kind(
+                    expression)]
+                left_value, left_type = self.generate(left)
+                right_value, right_type = self.generate(right)
+                result, result_type = self.temporary()
+                self.line(f"if {left_type} is not {right_type} or "
+                          f"type({left_type}) not in {allowed}: "
+                          f"fail_arithmetic({name!r}, {verb!r}, {preposition!r}, {left_type}, {right_type})")
+                known = {left_type, right_type} & {"INTEGER", "FLOATINGPOINT", "STRING"}
+                if symbol == "+" and known != {"INTEGER"} and known != {"FLOATINGPOINT"}:
+                    # Strings that are long already are concatenated into
+                    # ropes (see `stimpl.rope`), short ones (which are
+                    # never ropes) simply added.
+                    is_long = f"len({left_value}) >= ROPE_LENGTH"
+                    if not known:
+                        is_long = f"{left_type} is STRING and {is_long}"
+                    self.line(f"{result}, {result_type} = concat({left_value}, {right_value}) "
+                              f"if {is_long} else {left_value} + {right_value}, {left_type}")
+                else:
+                    self.line(f"{result}, {result_type} = "
+                              f"{left_value} {symbol} {right_value}, {left_type}")
+                return (result, result_type)
+
+            case And(left=left, right=right) | Or(left=left, right=right):
+                name, verb = LOGICAL[kind(expression)]
+                left_value, left_type = self.generate(left)
+                right_value, right_type = self.generate(right)
+                result, result_type = self.temporary()
+                self.line(f"if type({left_type}) is not Boolean or "
+                          f"type({right_type}) is not Boolean: "
+                          f"fail_logical({name!r}, {verb!r}, {left_type}, {right_type})")
+                self.line(f"{result}, {result_type} = "
+                          f"{left_value} {verb} {right_value}, BOOLEAN")
+                return (result, result_type)
+
+            case Not(expr=expr):
+                value, value_type = self.generate(expr)
+                result, result_type = self.temporary()
+                self.line(f"if type({value_type}) is not Boolean: fail_not()")
+                self.line(f"{result}, {result_type} = not {value}, BOOLEAN")
+                return (result, result_type)
+
+            case Lt(left=left, right=right) | Lte(left=left, right=right) | \
+                    Gt(left=left, right=right) | Gte(left=left, right=right) | \
+                    Eq(left=left, right=right) | Ne(left=left, right=right):
+                name, symbol, unit_result = RELATIONAL[kind(expression)]
+                left_value, left_type = self.generate(left)
+                right_value, right_type = self.generate(right)
+                result, result_type = self.temporary()
+                self.line(f"if {left_type} is not {right_type}: "
+                          f"fail_relational({name!r}, {symbol!r}, {left_type}, {right_type})")
+                self.line(f"if type({left_type}) in ORDERED_TYPES: "
+                          f"{result} = {left_value} {symbol} {right_value}")
+                self.line(f"elif type({left_type}) is Unit: {result} = {unit_result}")
+                self.line(f"else: fail_relational({name!r}, {symbol!r}, {left_type}, {right_type})")
+                self.line(f"{result_type} = BOOLEAN")
+                return (result, result_type)
+
+            case If(condition=condition, true=true, false=false):
+                condition_value, condition_type = self.generate(condition)
+                target = self.temporary()
+                self.line(f"if type({condition_type}) is not Boolean: "
+                          f"fail_condition('If', {condition_type})")
+                self.line(f"if {condition_value}:")
+                self.block(true, target)
+                self.line("else:")
+                self.block(false, target)
+                return target
+
+            case While(condition=condition, body=body):
+                self.line("while True:")
+                self.indent += 1
+                condition_value, condition_type = self.generate(condition)
+                self.line(f"if type({condition_type}) is not Boolean: "
+                          f"fail_condition('While', {condition_type})")
+                self.line(f"if not {condition_value}: break")
+                self.indent -= 1
+                self.block(body, None)
+                self.indent += 1
+                self.line("if budget is not None: budget.charge(entries=bound)")
+                self.indent -= 1
+                return ("False", "BOOLEAN")
+
+            case _:
+                self.line("fail_unhandled()")
+                return ("None", "UNIT")
+
+    def bindings(self) -> str:
+        """
+        A tuple of the name, value and type of every variable.
+        """
+        return "(" + "".join(f"({name!r}, v{index}, t{index}), "
+                             for name, index in self.variables.items()) + ")"
+
+    def function(self, program: Expr) -> str:
+        # Every variable gets its locals before any code is generated, so
+        # that the function can rebuild the state of the run (see
+        # `bound_state`).
+        pending = [program]
+        while pending:
+            expression = pending.pop()
+            if isinstance(expression, Variable):
+                self.variable(expression.variable_name)
+            pending.extend(reversed(children(expression)))
+        value, value_type = self.generate(program)
+        body = self.lines
+
+        self.lines = []
+        self.line("# " + ", ".join(f"v{index}/t{index}: {name!r}"
+                                   for name, index in self.variables.items()))
+        for name, index in self.variables.items():
+            self.line(f"v{index}, t{index} = load_variable(state, {name!r})")
+        self.line("budget = current_budget.get()")
+        # The number of live bindings in the state that the function would
+        # hand back, counted when the budget limits it.
+        self.line("bound = state.live_length() if budget is not None and budget.max_state_entries is not None else 0")
+        prologue = self.lines
+
+        self.lines = []
+        self.line(f"return ({value}, {value_type}, bound_state(state, {self.bindings()}))")
+        epilogue = self.lines
+
+        return "\n".join(["def stimpl_program(state):"] + prologue + body + epilogue) + "\n"
+
+
+def namespace() -> Dict[str, Any]:
+    return {
+        "load_variable": load_variable,
+        "bound_state": bound_state,
+        "emit": emit,
+        "concat": concat,
+        "ROPE_LENGTH": ROPE_LENGTH,
+        "current_budget": current_budget,
+        "fail_read": fail_read,
+        "fail_assign": fail_assign,
+        "fail_arithmetic": fail_arithmetic,
+        "fail_divide_by_zero": fail_divide_by_zero,
+        "fail_logical": fail_logical,
+        "fail_not": fail_not,
+        "fail_relational": fail_relational,
+        "fail_condition": fail_condition,
+        "fail_unhandled": fail_unhandled,
+        "ARITHMETIC_TYPES": ARITHMETIC_TYPES,
+        "ADDABLE_TYPES": ADDABLE_TYPES,
+        "ORDERED_TYPES": ORDERED_TYPES,
+        "Integer": Integer,
+        "Boolean": Boolean,
+        "Unit": Unit,
+        "UNIT": Unit(),
+        "INTEGER": Integer(),
+        "FLOATINGPOINT": FloatingPoint(),
+        "STRING": String(),
+        "BOOLEAN": Boolean(),
+    }
+
+
+def generate_source(program: Expr) -> Tuple[str, Dict[str, Any]]:
+    """
+    Generate the Python source for `program`, along with the constants
+    that the source refers to by name.
+    """
+    generator = CodeGenerator()
+    source = generator.function(program)
+    return (source, generator.constants)
+
+
+def dump_source(program: Expr) -> str:
+    """
+    The generated Python source for `program`, with the values of its
+    constants listed in a header comment.
+    """
+    source, constants = generate_source(program)
+    header = "".join(f"# {name} = {value!r}\n" for name, value in constants.items())
+    return header + source
+
+
+"""
+Generated programs are cached per program object, weakly, just like the
+closures built by `stimpl.compile`.
+"""
+generated_programs: 'WeakKeyDictionary[Expr, Callable]' = WeakKeyDictionary()
+
+
+def generate_program(program: Expr) -> Callable[[State], Tuple[Optional[Any], Type, State]]:
+    generated = generated_programs.get(program)
+    if generated is None:
+        try:
+            source, constants = generate_source(program)
+            code = compile(source, "<stimpl>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            # The code generator recurses, and CPython limits how deeply
+            # blocks may be nested in a single function. Programs that
+            # nest deeper than either allows run on the virtual machine,
+            # which does not recurse, instead.
+            from stimpl.vm import compile_bytecode, execute
+            generated = partial(execute, compile_bytecode(program))
+        else:
+            scope = namespace()
+            scope.update(constants)
+            exec(code, scope)
+            generated = scope["stimpl_program"]
+        generated_programs[program] = generated
+    return generated
+
+
+def evaluate_generated(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State]:
+    return generate_program(expression)(state)
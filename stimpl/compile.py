@@ -0,0 +1,705 @@
+import operator
+from typing import Any, Callable, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.hooks import Hooks
+from stimpl.output import emit
+from stimpl.rope import add_values, concat
+from stimpl.runtime import EmptyState, State, current_budget
+from stimpl.typecheck import TypeReport, typecheck
+
+"""
+Closure compilation
+
+Instead of re-dispatching on the kind of every node each time it is
+evaluated (as `evaluate` does), the closure compiler walks an expression
+tree once and builds a tree of Python closures -- one per node. Each
+closure has its operand closures, the operation to perform and the
+types it accepts bound at build time, so running the program is nothing
+more than calling the root closure with a state.
+
+`compile_program` also runs `stimpl.typecheck` over the program first and
+builds the fast, check-free variant of every node whose operand types are
+proven, keeping the dynamic checks only where inference is inconclusive.
+
+A compiled node has the same signature as `evaluate` with the expression
+already supplied:
+
+    compiled(state) -> (value, type, state)
+"""
+
+Compiled = Callable[[State], Tuple[Optional[Any], Type, State]]
+
+ARITHMETIC_TYPES = (Integer, FloatingPoint)
+ADDABLE_TYPES = (Integer, FloatingPoint, String)
+ORDERED_TYPES = (Integer, Boolean, String, FloatingPoint)
+ALL_TYPES = (Unit, Integer, FloatingPoint, String, Boolean)
+
+ARITHMETIC = {
+    Add: ("Add", "add", "to", ADDABLE_TYPES, operator.add),
+    Subtract: ("Subtract", "subtract", "from", ARITHMETIC_TYPES, operator.sub),
+    Multiply: ("Multiply", "multiply", "by", ARITHMETIC_TYPES, operator.mul),
+}
+
+LOGICAL = {
+    And: ("And", "and", lambda l, r: l and r),
+    Or: ("Or", "or", lambda l, r: l or r),
+}
+
+RELATIONAL = {
+    Lt: ("Lt", "<", False, operator.lt),
+    Lte: ("Lte", "<=", True, operator.le),
+    Gt: ("Gt", ">", False, operator.gt),
+    Gte: ("Gte", ">=", True, operator.ge),
+    Eq: ("Eq", "==", True, operator.eq),
+    Ne: ("Ne", "!=", False, operator.ne),
+}
+
+
+def compile_literal(literal: Any, literal_type: Type) -> Compiled:
+    def run(state):
+        return (literal, literal_type, state)
+    return run
+
+
+def compile_print(to_print: Compiled) -> Compiled:
+    def run(state):
+        printable_value, printable_type, new_state = to_print(state)
+        emit(printable_value, printable_type)
+        return (printable_value, printable_type, new_state)
+    return run
+
+
+def compile_sequence(exprs: Tuple[Compiled, ...]) -> Compiled:
+    if len(exprs) == 0:
+        unit = Unit()
+
+        def run_empty(state):
+            return (None, unit, state)
+        return run_empty
+
+    if len(exprs) == 1:
+        return exprs[0]
+
+    def run(state):
+        for expr in exprs:
+            result, result_type, state = expr(state)
+        return (result, result_type, state)
+    return run
+
+
+def compile_variable(variable_name: str) -> Compiled:
+    error_msg = f"Cannot read from {variable_name} before assignment."
+
+    def run(state):
+        value = state.get_value(variable_name)
+        if value is None:
+            raise InterpSyntaxError(error_msg)
+        variable_value, variable_type = value
+        return (variable_value, variable_type, state)
+    return run
+
+
+def compile_assign(variable_name: str, value: Compiled, checked: bool = True) -> Compiled:
+    def run(state):
+        value_result, value_type, new_state = value(state)
+
+        variable_from_state = new_state.get_value(variable_name)
+        if variable_from_state is not None:
+            _, variable_type = variable_from_state
+            if value_type is not variable_type:
+                raise InterpTypeError(f"""Mismatched types for Assignment:
+            Cannot assign {value_type} to {variable_type}""")
+
+        new_state = new_state.set_value(
+            variable_name, value_result, value_type)
+        return (value_result, value_type, new_state)
+
+    def run_unchecked(state):
+        value_result, value_type, new_state = value(state)
+        return (value_result, value_type,
+                new_state.set_value(variable_name, value_result, value_type))
+
+    return run if checked else run_unchecked
+
+
+def compile_arithmetic(left: Compiled, right: Compiled, name: str,
+                       verb: str, preposition: str, allowed: Tuple[type, ...],
+                       operation: Callable[[Any, Any], Any]) -> Compiled:
+    def run(state):
+        left_result, left_type, new_state = left(state)
+        right_result, right_type, new_state = right(new_state)
+
+        if left_type is not right_type:
+            raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot {verb} {left_type} {preposition} {right_type}""")
+
+        if type(left_type) not in allowed:
+            raise InterpTypeError(f"""Cannot {verb} {left_type}s""")
+
+        return (operation(left_result, right_result), left_type, new_state)
+    return run
+
+
+def compile_divide(left: Compiled, right: Compiled) -> Compiled:
+    def run(state):
+        left_result, left_type, new_state = left(state)
+        right_result, right_type, new_state = right(new_state)
+
+        if left_type is not right_type:
+            raise InterpTypeError(f"""Mismatched types for Divide:
+            Cannot divide {left_type} by {right_type}""")
+
+        match left_type:
+            case Integer():
+                if right_result == 0:
+                    raise InterpMathError("Cannot divide by zero.")
+                result = left_result // right_result
+            case FloatingPoint():
+                if right_result == 0:
+                    raise InterpMathError("Cannot divide by zero.")
+                result = left_result / right_result
+            case _:
+                raise InterpTypeError(f"""Cannot divide {left_type}s""")
+
+        return (result, left_type, new_state)
+    return run
+
+
+def compile_arithmetic_typed(left: Compiled, right: Compiled, result_type: Type,
+                             operation: Callable[[Any, Any], Any]) -> Compiled:
+    def run(state):
+        left_result, _, new_state = left(state)
+        right_result, _, new_state = right(new_state)
+        return (operation(left_result, right_result), result_type, new_state)
+    return run
+
+
+def compile_divide_typed(left: Compiled, right: Compiled, result_type: Type) -> Compiled:
+    divide = operator.floordiv if type(
+        result_type) is Integer else operator.truediv
+
+    def run(state):
+        left_result, _, new_state = left(state)
+        right_result, _, new_state = right(new_state)
+        if right_result == 0:
+            raise InterpMathError("Cannot divide by zero.")
+        return (divide(left_result, right_result), result_type, new_state)
+    return run
+
+
+def compile_logical(left: Compiled, right: Compiled, name: str, verb: str,
+                    operation: Callable[[Any, Any], Any]) -> Compiled:
+    def run(state):
+        left_value, left_type, new_state = left(state)
+        right_value, right_type, new_state = right(new_state)
+
+        if left_type is not right_type:
+            raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot evaluate {left_type} {verb} {right_type}""")
+
+        if type(left_type) is not Boolean:
+            raise InterpTypeError(
+                f"Cannot perform logical {verb} on non-boolean operands.")
+
+        return (operation(left_value, right_value), left_type, new_state)
+    return run
+
+
+def compile_logical_typed(left: Compiled, right: Compiled,
+                          operation: Callable[[Any, Any], Any]) -> Compiled:
+    boolean = Boolean()
+
+    def run(state):
+        left_value, _, new_state = left(state)
+        right_value, _, new_state = right(new_state)
+        return (operation(left_value, right_value), boolean, new_state)
+    return run
+
+
+def compile_not(expr: Compiled, checked: bool = True) -> Compiled:
+    def run(state):
+        value, value_type, new_state = expr(state)
+
+        if type(value_type) is not Boolean:
+            raise InterpTypeError(
+                "Cannot perform logical not on non-boolean operand.")
+
+        return (not value, value_type, new_state)
+
+    def run_unchecked(state):
+        value, value_type, new_state = expr(state)
+        return (not value, value_type, new_state)
+
+    return run if checked else run_unchecked
+
+
+def compile_relational(left: Compiled, right: Compiled, name: str,
+                       symbol: str, unit_result: bool,
+                       operation: Callable[[Any, Any], bool]) -> Compiled:
+    boolean = Boolean()
+
+    def run(state):
+        left_value, left_type, new_state = left(state)
+        right_value, right_type, new_state = right(new_state)
+
+        if left_type is not right_type:
+            raise InterpTypeError(f"""Mismatched types for {name}:
+            Cannot compare {left_type} and {right_type}""")
+
+        if type(left_type) in ORDERED_TYPES:
+            result = operation(left_value, right_value)
+        elif type(left_type) is Unit:
+            result = unit_result
+        else:
+            raise InterpTypeError(
+                f"Cannot perform {symbol} on {left_type} type.")
+
+        return (result, boolean, new_state)
+    return run
+
+
+def compile_relational_typed(left: Compiled, right: Compiled,
+                             operation: Callable[[Any, Any], bool]) -> Compiled:
+    boolean = Boolean()
+
+    def run(state):
+        left_value, _, new_state = left(state)
+        right_value, _, new_state = right(new_state)
+        return (operation(left_value, right_value), boolean, new_state)
+    return run
+
+
+def compile_if(condition: Compiled, true: Compiled, false: Compiled, checked: bool = True) -> Compiled:
+    def run(state):
+        condition_value, condition_type, new_state = condition(state)
+
+        if checked and type(condition_type) is not Boolean:
+            raise InterpTypeError(
+                f"If condition must be Boolean, not {condition_type}.")
+
+        if condition_value:
+            return true(new_state)
+        return false(new_state)
+    return run
+
+
+def compile_while(condition: Compiled, body: Compiled, checked: bool = True) -> Compiled:
+    boolean = Boolean()
+
+    def run(state):
+        budget = current_budget.get()
+        while True:
+            condition_value, condition_type, state = condition(state)
+
+            if type(condition_type) is not Boolean:
+                raise InterpTypeError(
+                    f"While condition must be Boolean, not {condition_type}.")
+
+            if not condition_value:
+                break
+            _, _, state = body(state)
+            state = state.maybe_compact()
+            if budget is not None:
+                budget.charge(state)
+
+        return (False, boolean, state)
+
+    def run_unchecked(state):
+        budget = current_budget.get()
+        while True:
+            condition_value, _, state = condition(state)
+            if not condition_value:
+                break
+            _, _, state = body(state)
+            state = state.maybe_compact()
+            if budget is not None:
+                budget.charge(state)
+
+        return (False, boolean, state)
+
+    return run if checked else run_unchecked
+
+
+"""
+Counted loops
+
+Many loops count a variable up by one until it reaches a bound:
+
+    While(Lt(Variable("i"), IntLiteral(N)),
+          Sequence(..., Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))))
+
+When nothing else in the body assigns the counter, and the counter holds
+an integer when the loop starts, the loop runs its body once for every
+value in `range(i, N)`. So there is no need to evaluate the condition or
+the increment: the counter can be set directly. When the rest of the body
+does nothing but add the counter (or a constant) to integer accumulators,
+the loop does not need to run at all: the final values of the
+accumulators have a closed form.
+
+Whenever those assumptions do not hold at runtime, the ordinary loop
+runs instead, so results, output and errors are always exactly those of
+`compile_while`. A closed-form loop is charged all its iterations at once
+(see `stimpl.runtime.Budget`), and a loop that would not stay within its
+budget runs for real, so that it stops exactly where `compile_while`
+would.
+"""
+
+
+class CountedLoop(object):
+    def __init__(self, counter: str, bound: int, prefix: Tuple[Expr, ...]) -> None:
+        self.counter = counter
+        self.bound = bound
+        # The statements of the body before the increment.
+        self.prefix = prefix
+
+
+def assigned_variables(expression: Expr) -> set:
+    assigned = set()
+    pending = [expression]
+    while pending:
+        expression = pending.pop()
+        if isinstance(expression, Assign):
+            assigned.add(expression.variable.variable_name)
+        pending.extend(children(expression))
+    return assigned
+
+
+def counted_loop(condition: Expr, body: Expr) -> Optional[CountedLoop]:
+    match condition:
+        case Lt(left=Variable(variable_name=counter), right=IntLiteral(literal=bound)):
+            pass
+        case Lte(left=Variable(variable_name=counter), right=IntLiteral(literal=bound)):
+            bound = bound + 1
+        case _:
+            return None
+
+    statements = body.exprs if kind(body) is Sequence else (body,)
+    if len(statements) == 0:
+        return None
+    match statements[-1]:
+        case Assign(variable=Variable(variable_name=assigned),
+                    value=Add(left=Variable(variable_name=read), right=IntLiteral(literal=1))) \
+                if assigned == counter and read == counter:
+            pass
+        case _:
+            return None
+
+    prefix = tuple(statements[:-1])
+    if any(counter in assigned_variables(statement) for statement in prefix):
+        return None
+    return CountedLoop(counter, bound, prefix)
+
+
+def accumulations(loop: CountedLoop) -> Optional[Tuple[Tuple[str, Optional[int]], ...]]:
+    """
+    When every statement of the body (but the increment) adds either the
+    counter or an integer constant to a variable of its own, a pair of the
+    variable and the constant (None for the counter) for each of them.
+    """
+    found = []
+    for statement in loop.prefix:
+        match statement:
+            case Assign(variable=Variable(variable_name=assigned),
+                        value=Add(left=Variable(variable_name=read), right=Variable(variable_name=term))) \
+                    if assigned == read and term == loop.counter:
+                found.append((assigned, None))
+            case Assign(variable=Variable(variable_name=assigned),
+                        value=Add(left=Variable(variable_name=read), right=IntLiteral(literal=term))) \
+                    if assigned == read:
+                found.append((assigned, term))
+            case _:
+                return None
+    if len({accumulator for accumulator, _ in found}) != len(found):
+        return None
+    return tuple(found)
+
+
+def compile_counted_while(loop: CountedLoop, prefix: Compiled, fallback: Compiled) -> Compiled:
+    counter, bound = loop.counter, loop.bound
+    boolean = Boolean()
+
+    def run(state):
+        current = state.get_value(counter)
+        if current is None or type(current[1]) is not Integer:
+            return fallback(state)
+        integer = current[1]
+        budget = current_budget.get()
+        for value in range(current[0], bound):
+            _, _, state = prefix(state)
+            state = state.set_value(counter, value + 1, integer).maybe_compact()
+            if budget is not None:
+                budget.charge(state)
+        return (False, boolean, state)
+
+    return run
+
+
+def compile_accumulating_while(loop: CountedLoop, accumulated: Tuple[Tuple[str, Optional[int]], ...],
+                               fallback: Compiled) -> Compiled:
+    counter, bound = loop.counter, loop.bound
+    boolean = Boolean()
+
+    def run(state):
+        current = state.get_value(counter)
+        if current is None or type(current[1]) is not Integer:
+            return fallback(state)
+        start, integer = current
+        if start >= bound:
+            return (False, boolean, state)
+
+        iterations = bound - start
+        budget = current_budget.get()
+        if budget is not None and not budget.affords(iterations):
+            # Only the real loop can tell where it runs out of its budget.
+            return fallback(state)
+        totals = []
+        for accumulator, term in accumulated:
+            value = state.get_value(accumulator)
+            if value is None or type(value[1]) is not Integer:
+                return fallback(state)
+            if term is None:
+                # The sum of start, start + 1, ..., bound - 1.
+                totals.append(value[0] + (start + bound - 1) * iterations // 2)
+            else:
+                totals.append(value[0] + term * iterations)
+
+        for (accumulator, _), total in zip(accumulated, totals):
+            state = state.set_value(accumulator, total, integer)
+        state = state.set_value(counter, bound, integer)
+        if budget is not None:
+            budget.charge(state, iterations)
+        return (False, boolean, state)
+
+    return run
+
+
+def compile_unhandled() -> Compiled:
+    def run(state):
+        raise InterpSyntaxError("Unhandled!")
+    return run
+
+
+def proven_type(left: Expr, right: Expr, allowed: Tuple[type, ...]) -> Optional[Type]:
+    """
+    The type of both `left` and `right` when `stimpl.typecheck` proved that
+    they have the same type and that it is one of `allowed`.
+    """
+    left_type, right_type = left.static_type, right.static_type
+    if left_type is not None and right_type is not None and \
+            type(left_type) is type(right_type) and type(left_type) in allowed:
+        return left_type
+    return None
+
+
+def compile_expr(expression: Expr, typed: bool = False, hooks: Optional[Hooks] = None) -> Compiled:
+    """
+    Compile `expression`. When `typed`, the `static_type` annotations left
+    by `stimpl.typecheck` are trusted to skip the type checks that they
+    prove unnecessary. When there are `hooks`, every closure calls them
+    (see `compile_hooked`).
+    """
+    compiled = compile_node(expression, typed, hooks)
+    if hooks is not None:
+        compiled = compile_hooked(expression, compiled, hooks)
+    return compiled
+
+
+def compile_node(expression: Expr, typed: bool, hooks: Optional[Hooks]) -> Compiled:
+    def sub(expression):
+        return compile_expr(expression, typed, hooks)
+
+    def proven(left, right, allowed):
+        return proven_type(left, right, allowed) if typed else None
+
+    match expression:
+        case Ren():
+            return compile_literal(None, Unit())
+
+        case IntLiteral(literal=l):
+            return compile_literal(l, Integer())
+
+        case FloatingPointLiteral(literal=l):
+            return compile_literal(l, FloatingPoint())
+
+        case StringLiteral(literal=l):
+            return compile_literal(l, String())
+
+        case BooleanLiteral(literal=l):
+            return compile_literal(l, Boolean())
+
+        case Print(to_print=to_print):
+            return compile_print(sub(to_print))
+
+        case Sequence(exprs=exprs) | Program(exprs=exprs):
+            return compile_sequence(tuple(sub(expr) for expr in exprs))
+
+        case Variable(variable_name=variable_name):
+            return compile_variable(variable_name)
+
+        case Assign(variable=variable, value=value):
+            checked = proven(variable, value, ALL_TYPES) is None
+            return compile_assign(variable.variable_name, sub(value), checked)
+
+        case Add(left=left, right=right) | Subtract(left=left, right=right) | \
+                Multiply(left=left, right=right):
+            name, verb, preposition, allowed, operation = ARITHMETIC[kind(expression)]
+            result_type = proven(left, right, allowed)
+            if result_type is not None:
+                if type(result_type) is String:
+                    operation = concat
+                return compile_arithmetic_typed(sub(left), sub(right), result_type, operation)
+            if kind(expression) is Add:
+                operation = add_values
+            return compile_arithmetic(sub(left), sub(right), name, verb,
+                                      preposition, allowed, operation)
+
+        case Divide(left=left, right=right):
+            result_type = proven(left, right, ARITHMETIC_TYPES)
+            if result_type is not None:
+                return compile_divide_typed(sub(left), sub(right), result_type)
+            return compile_divide(sub(left), sub(right))
+
+        case And(left=left, right=right) | Or(left=left, right=right):
+            name, verb, operation = LOGICAL[kind(expression)]
+            if proven(left, right, (Boolean,)) is not None:
+                return compile_logical_typed(sub(left), sub(right), operation)
+            return compile_logical(sub(left), sub(right), name, verb, operation)
+
+        case Not(expr=expr):
+            checked = proven(expr, expr, (Boolean,)) is None
+            return compile_not(sub(expr), checked)
+
+        case If(condition=condition, true=true, false=false):
+            checked = proven(condition, condition, (Boolean,)) is None
+            compiled_condition = sub(condition)
+            if hooks is not None:
+                compiled_condition = compile_hooked_condition(expression, compiled_condition, hooks)
+            return compile_if(compiled_condition, sub(true), sub(false), checked)
+
+        case Lt(left=left, right=right) | Lte(left=left, right=right) | \
+                Gt(left=left, right=right) | Gte(left=left, right=right) | \
+                Eq(left=left, right=right) | Ne(left=left, right=right):
+            name, symbol, unit_result, operation = RELATIONAL[kind(expression)]
+            operand_type = proven(left, right, ORDERED_TYPES + (Unit,))
+            if operand_type is not None:
+                if type(operand_type) is Unit:
+                    return compile_relational_typed(sub(left), sub(right),
+                                                    lambda l, r: unit_result)
+                return compile_relational_typed(sub(left), sub(right), operation)
+            return compile_relational(sub(left), sub(right), name, symbol,
+                                      unit_result, operation)
+
+        case While(condition=condition, body=body):
+            checked = proven(condition, condition, (Boolean,)) is None
+            if hooks is not None:
+                # Every iteration has to run for the hooks to see it.
+                return compile_while(compile_hooked_condition(expression, sub(condition), hooks),
+                                     compile_hooked_body(expression, sub(body), hooks), checked)
+            compiled = compile_while(sub(condition), sub(body), checked)
+            loop = counted_loop(condition, body)
+            if loop is None:
+                return compiled
+            accumulated = accumulations(loop)
+            if accumulated is not None:
+                return compile_accumulating_while(loop, accumulated, compiled)
+            return compile_counted_while(loop, compile_sequence(tuple(sub(statement) for statement in loop.prefix)),
+                                         compiled)
+
+        case _:
+            return compile_unhandled()
+
+
+"""
+Hooks
+
+With `hooks`, every compiled node is wrapped in a closure that calls the
+enter and exit hooks around it (and, for an `Assign`, the assign hook),
+the condition of every `If` and `While` in one that calls the branch
+hook and the body of every `While` in one that calls the back-edge hook,
+so that the hooks are called in the same order as on the iterative
+machine.
+"""
+
+
+def compile_hooked(node: Expr, compiled: Compiled, hooks: Hooks) -> Compiled:
+    if isinstance(node, Assign):
+        variable_name = node.variable.variable_name
+
+        def run_assign(state):
+            hooks.enter(node)
+            value, value_type, new_state = compiled(state)
+            hooks.assign(node, variable_name, value, value_type)
+            hooks.exit(node, value, value_type)
+            return (value, value_type, new_state)
+        return run_assign
+
+    def run(state):
+        hooks.enter(node)
+        value, value_type, new_state = compiled(state)
+        hooks.exit(node, value, value_type)
+        return (value, value_type, new_state)
+    return run
+
+
+def compile_hooked_condition(node: Expr, condition: Compiled, hooks: Hooks) -> Compiled:
+    def run(state):
+        condition_value, condition_type, new_state = condition(state)
+        # A condition that is not a boolean is an error, not a decision.
+        if type(condition_type) is Boolean:
+            hooks.branch(node, bool(condition_value))
+        return (condition_value, condition_type, new_state)
+    return run
+
+
+def compile_hooked_body(node: Expr, body: Compiled, hooks: Hooks) -> Compiled:
+    def run(state):
+        result = body(state)
+        hooks.back_edge(node)
+        return result
+    return run
+
+
+"""
+Compiled programs are cached per program object so that running the same
+program many times only pays for compilation once. The cache holds the
+programs weakly: it never keeps a program alive on its own.
+"""
+compiled_programs: 'WeakKeyDictionary[Expr, Compiled]' = WeakKeyDictionary()
+
+
+def compile_program(program: Expr) -> Compiled:
+    compiled = compiled_programs.get(program)
+    if compiled is None:
+        report = typecheck(program)
+        compiled = compile_expr(program, typed=True)
+        if report.variables or report.unproven:
+            compiled = compile_guarded(report, compiled, compile_expr(program))
+        compiled_programs[program] = compiled
+    return compiled
+
+
+def compile_guarded(report: TypeReport, typed: Compiled, checked: Compiled) -> Compiled:
+    """
+    Run `typed` unless the initial state binds one of the program's
+    variables to a type other than the one inferred for it, in which case
+    the annotations cannot be trusted and `checked` runs instead.
+    """
+    def run(state):
+        if isinstance(state, EmptyState) or report.consistent_with(state):
+            return typed(state)
+        return checked(state)
+    return run
+
+
+def evaluate_compiled(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State]:
+    return compile_program(expression)(state)
+
+
+def evaluate_compiled_hooked(expression: Expr, state: State, hooks: Hooks) -> Tuple[Optional[Any], Type, State]:
+    # Compiled afresh (and with every check) for every run: the closures
+    # hold on to `hooks`.
+    return compile_expr(expression, hooks=hooks)(state)
@@ -13,6 +13,16 @@ class InterpSyntaxError(InterpError):
       error_msg = "InterpSyntaxError"
     super().__init__(error_msg)
 
+class InterpParseError(InterpSyntaxError):
+  def __init__(self, error_msg, line, column):
+    self.line = line
+    self.column = column
+    self.error_msg = error_msg
+    super().__init__(f"{error_msg} at line {line}, column {column}.")
+
+  def __reduce__(self):
+    return (InterpParseError, (self.error_msg, self.line, self.column))
+
 class InterpTypeError(InterpError):
   def __init__(self, error_msg = None):
     if error_msg == None:
@@ -25,5 +35,20 @@ class InterpMathError(InterpError):
       error_msg = "InterpMathError"
     super().__init__(error_msg)
 
+class InterpResourceError(InterpError):
+  def __init__(self, limit, steps, elapsed, state_entries = None):
+    self.limit = limit
+    self.steps = steps
+    self.elapsed = elapsed
+    self.state_entries = state_entries
+    error_msg = f"Exceeded {limit} after {steps} loop iterations in {elapsed:.3f}s"
+    if state_entries != None:
+      error_msg += f" with {state_entries} State entries"
+    super().__init__(error_msg + ".")
+
+  def __reduce__(self):
+    return (InterpResourceError, (self.limit, self.steps, self.elapsed, self.state_entries))
+
 def pretty_type(value):
   return f"{str(type(value).__name__)}"
+
@@ -1,3 +1,5 @@
+from typing import Tuple
+
 from stimpl.errors import InterpSyntaxError, InterpTypeError, pretty_type
 """
 Expressions
@@ -5,8 +7,21 @@ Expressions
 
 
 class Expr(object):
+    """
+    Every expression class declares `__slots__`, so nodes carry no
+    instance `__dict__`, and `__match_args__`, so they can be matched
+    positionally (e.g., `case Add(left, right)`).
+
+    `static_type` is the type that evaluating the expression produces
+    whenever it evaluates successfully, as proven by `stimpl.typecheck`
+    (None when the expression has not been checked or its type cannot be
+    proven).
+    """
+    __slots__ = ("static_type", "__weakref__")
+    __match_args__ = ()
+
     def __init__(self):
-        pass
+        self.static_type = None
 
 
 """
@@ -15,8 +30,11 @@ Unit expression.
 
 
 class Ren(Expr):
+    __slots__ = ()
+    __match_args__ = ()
+
     def __init__(self):
-        pass
+        super().__init__()
 
     def __repr__(self):
         return f"Ren value"
@@ -28,14 +46,20 @@ Literal expressions.
 
 
 class Literal(Expr):
+    __slots__ = ("literal",)
+    __match_args__ = ("literal",)
+
     def __init__(self, literal):
         self.literal = literal
+        super().__init__()
 
     def __repr__(self):
         return f"literal value: {self.literal}"
 
 
 class IntLiteral(Literal):
+    __slots__ = ()
+
     def __init__(self, literal):
         if type(literal) != int:
             raise InterpTypeError(
@@ -44,6 +68,8 @@ class IntLiteral(Literal):
 
 
 class FloatingPointLiteral(Literal):
+    __slots__ = ()
+
     def __init__(self, literal):
         if type(literal) != float:
             raise InterpTypeError(
@@ -52,6 +78,8 @@ class FloatingPointLiteral(Literal):
 
 
 class StringLiteral(Literal):
+    __slots__ = ()
+
     def __init__(self, literal):
         if type(literal) != str:
             raise InterpTypeError(
@@ -60,6 +88,8 @@ class StringLiteral(Literal):
 
 
 class BooleanLiteral(Literal):
+    __slots__ = ()
+
     def __init__(self, literal):
         if type(literal) != bool:
             raise InterpTypeError(
@@ -73,8 +103,12 @@ Variable Expression
 
 
 class Variable(Expr):
+    __slots__ = ("variable_name",)
+    __match_args__ = ("variable_name",)
+
     def __init__(self, variable_name):
         self.variable_name = variable_name
+        super().__init__()
 
     def __repr__(self):
         return f"Variable {self.variable_name}"
@@ -89,22 +123,31 @@ Operators
 
 
 class Assign(Expr):
+    __slots__ = ("variable", "value")
+    __match_args__ = ("variable", "value")
+
     def __init__(self, variable, value):
         if not isinstance(variable, Variable):
             raise InterpSyntaxError("Must assign to a variable.")
         self.variable = variable
         self.value = value
+        super().__init__()
 
     def __repr__(self):
         return f"{self.variable} = {self.value}"
 
 
 class UnaryOperator(Expr):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
 
 class Print(UnaryOperator):
+    __slots__ = ("to_print",)
+    __match_args__ = ("to_print",)
+
     def __init__(self, to_print):
         self.to_print = to_print
         super().__init__()
@@ -114,6 +157,9 @@ class Print(UnaryOperator):
 
 
 class Not(UnaryOperator):
+    __slots__ = ("expr",)
+    __match_args__ = ("expr",)
+
     def __init__(self, expr):
         self.expr = expr
         super().__init__()
@@ -123,6 +169,9 @@ class Not(UnaryOperator):
 
 
 class BinaryOperator(Expr):
+    __slots__ = ("left", "right")
+    __match_args__ = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -130,6 +179,8 @@ class BinaryOperator(Expr):
 
 
 class And(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -138,6 +189,8 @@ class And(BinaryOperator):
 
 
 class Or(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -146,6 +199,8 @@ class Or(BinaryOperator):
 
 
 class Lt(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -154,6 +209,8 @@ class Lt(BinaryOperator):
 
 
 class Lte(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -162,6 +219,8 @@ class Lte(BinaryOperator):
 
 
 class Gt(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -170,6 +229,8 @@ class Gt(BinaryOperator):
 
 
 class Gte(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -178,6 +239,8 @@ class Gte(BinaryOperator):
 
 
 class Eq(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -186,6 +249,8 @@ class Eq(BinaryOperator):
 
 
 class Ne(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -194,6 +259,8 @@ class Ne(BinaryOperator):
 
 
 class Add(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -202,6 +269,8 @@ class Add(BinaryOperator):
 
 
 class Subtract(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -210,6 +279,8 @@ class Subtract(BinaryOperator):
 
 
 class Multiply(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -218,6 +289,8 @@ class Multiply(BinaryOperator):
 
 
 class Divide(BinaryOperator):
+    __slots__ = ()
+
     def __init__(self, left, right):
         super().__init__(left, right)
 
@@ -231,8 +304,12 @@ Combining forms.
 
 
 class Program(Expr):
+    __slots__ = ("exprs",)
+    __match_args__ = ("exprs",)
+
     def __init__(self, *exprs):
         self.exprs = exprs
+        super().__init__()
 
     def __repr__(self):
         exprs = self.exprs
@@ -242,8 +319,12 @@ class Program(Expr):
 
 
 class Sequence(Expr):
+    __slots__ = ("exprs",)
+    __match_args__ = ("exprs",)
+
     def __init__(self, *exprs):
         self.exprs = exprs
+        super().__init__()
 
     def __repr__(self):
         exprs = self.exprs
@@ -253,19 +334,68 @@ class Sequence(Expr):
 
 
 class If(Expr):
+    __slots__ = ("condition", "true", "false")
+    __match_args__ = ("condition", "true", "false")
+
     def __init__(self, condition, true, false):
         self.condition = condition
         self.true = true
         self.false = false
+        super().__init__()
 
     def __repr__(self):
         return f"if ({self.condition}) then {{ {self.true} }} else {{ {self.false} }}"
 
 
 class While(Expr):
+    __slots__ = ("condition", "body")
+    __match_args__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
+        super().__init__()
 
     def __repr__(self):
         return f"while ({self.condition}) {{ {self.body} }}"
+
+
+expression_kinds = {}
+
+
+def kind(expression: Expr) -> type:
+    """
+    The class of `expression` -- or, for instances of classes defined
+    elsewhere that extend the classes here (like the views of
+    `stimpl.table`), the nearest class defined here.
+    """
+    expression_class = type(expression)
+    found = expression_kinds.get(expression_class)
+    if found is None:
+        found = next(base for base in expression_class.__mro__
+                     if base.__module__ == __name__)
+        expression_kinds[expression_class] = found
+    return found
+
+
+def children(expression: Expr) -> Tuple[Expr, ...]:
+    """
+    The subexpressions of `expression`, in the order that they appear.
+    """
+    match expression:
+        case Print(to_print=to_print):
+            return (to_print,)
+        case Not(expr=expr):
+            return (expr,)
+        case Assign(variable=variable, value=value):
+            return (variable, value)
+        case BinaryOperator(left=left, right=right):
+            return (left, right)
+        case Sequence(exprs=exprs) | Program(exprs=exprs):
+            return tuple(exprs)
+        case If(condition=condition, true=true, false=false):
+            return (condition, true, false)
+        case While(condition=condition, body=body):
+            return (condition, body)
+        case _:
+            return ()
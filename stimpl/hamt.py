@@ -0,0 +1,165 @@
+from typing import Any, Iterator, Optional, Tuple
+
+from stimpl.types import Type
+from stimpl.runtime import State
+
+"""
+Persistent hash array mapped trie
+
+`State` is a linked list of bindings: setting a variable prepends a node
+and reading one walks the list until it finds the most recent binding for
+that variable, so reads cost time proportional to the number of
+assignments made so far. `PersistentState` offers exactly the same
+immutable interface but keeps its bindings in a hash array mapped trie
+(HAMT). Every node of the trie branches 32 ways on five bits of the
+variable name's hash and stores only the branches that are present,
+packed behind a bitmap. Reads walk at most one node per five bits of hash
+and writes copy only the nodes on that path, so both are effectively
+constant-time, and older states are never disturbed by newer ones.
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+HASH_BITS = 64
+
+
+class HamtNode(object):
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap: int, entries: tuple) -> None:
+        # Each entry is either a (variable_name, value) leaf or a child
+        # node.
+        self.bitmap = bitmap
+        self.entries = entries
+
+
+class CollisionNode(object):
+    """
+    Holds the leaves of variables whose names have identical hashes.
+    """
+    __slots__ = ("entries",)
+
+    def __init__(self, entries: tuple) -> None:
+        self.entries = entries
+
+
+EMPTY_NODE = HamtNode(0, ())
+
+
+def node_get(node: Any, variable_name: str, name_hash: int) -> Optional[Tuple[Any, Type]]:
+    shift = 0
+    while True:
+        if type(node) is CollisionNode:
+            for leaf_name, value in node.entries:
+                if leaf_name == variable_name:
+                    return value
+            return None
+
+        bit = 1 << ((name_hash >> shift) & MASK)
+        if not node.bitmap & bit:
+            return None
+        entry = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+        if type(entry) is tuple:
+            return entry[1] if entry[0] == variable_name else None
+        node = entry
+        shift += BITS
+
+
+def merge_leaves(first: tuple, first_hash: int, second: tuple, second_hash: int, shift: int) -> Any:
+    if shift >= HASH_BITS:
+        return CollisionNode((first, second))
+
+    first_index = (first_hash >> shift) & MASK
+    second_index = (second_hash >> shift) & MASK
+    if first_index == second_index:
+        return HamtNode(1 << first_index,
+                        (merge_leaves(first, first_hash, second, second_hash, shift + BITS),))
+    if first_index < second_index:
+        entries = (first, second)
+    else:
+        entries = (second, first)
+    return HamtNode((1 << first_index) | (1 << second_index), entries)
+
+
+def node_set(node: Any, leaf: tuple, name_hash: int, shift: int) -> Tuple[Any, bool]:
+    """
+    A copy of `node` with `leaf` stored in it, and whether `leaf` added a
+    new variable (rather than replacing an existing binding).
+    """
+    variable_name = leaf[0]
+    if type(node) is CollisionNode:
+        entries = node.entries
+        for index, (leaf_name, _) in enumerate(entries):
+            if leaf_name == variable_name:
+                return (CollisionNode(entries[:index] + (leaf,) + entries[index + 1:]), False)
+        return (CollisionNode(entries + (leaf,)), True)
+
+    bit = 1 << ((name_hash >> shift) & MASK)
+    index = (node.bitmap & (bit - 1)).bit_count()
+    entries = node.entries
+
+    if not node.bitmap & bit:
+        return (HamtNode(node.bitmap | bit, entries[:index] + (leaf,) + entries[index:]), True)
+
+    entry = entries[index]
+    if type(entry) is tuple:
+        if entry[0] == variable_name:
+            replacement, added = leaf, False
+        else:
+            replacement, added = merge_leaves(entry, hash(entry[0]), leaf, name_hash,
+                                              shift + BITS), True
+    else:
+        replacement, added = node_set(entry, leaf, name_hash, shift + BITS)
+    return (HamtNode(node.bitmap, entries[:index] + (replacement,) + entries[index + 1:]), added)
+
+
+def node_items(node: Any) -> Iterator[tuple]:
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        for entry in node.entries:
+            if type(entry) is tuple:
+                yield entry
+            else:
+                pending.append(entry)
+
+
+class PersistentState(State):
+    __slots__ = ("root", "size")
+
+    def __init__(self, root: HamtNode = EMPTY_NODE, size: int = 0) -> None:
+        self.root = root
+        self.size = size
+
+    def copy(self) -> 'PersistentState':
+        return PersistentState(self.root, self.size)
+
+    def set_value(self, variable_name: str, variable_value: Any, variable_type: Type) -> 'PersistentState':
+        root, added = node_set(self.root, (variable_name, (variable_value, variable_type)),
+                               hash(variable_name), 0)
+        return PersistentState(root, self.size + 1 if added else self.size)
+
+    def get_value(self, variable_name: str) -> Any:
+        return node_get(self.root, variable_name, hash(variable_name))
+
+    def bindings(self) -> Iterator[Tuple[str, Any, Type]]:
+        for variable_name, (variable_value, variable_type) in node_items(self.root):
+            yield (variable_name, variable_value, variable_type)
+
+    def live_length(self) -> int:
+        return self.size
+
+    def compact(self) -> 'PersistentState':
+        # A trie never holds shadowed bindings.
+        return self
+
+    def maybe_compact(self) -> 'PersistentState':
+        return self
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return "".join(f"{variable_name}: {value}, "
+                       for variable_name, value in node_items(self.root))
@@ -0,0 +1,180 @@
+from typing import Any, List, Tuple
+from weakref import WeakValueDictionary
+
+from stimpl.expression import *
+from stimpl.table import KINDS, LITERAL_KINDS
+
+"""
+Hash consing
+
+Generated programs repeat the same subtrees (`Variable("i")`,
+`Lt(Variable("i"), IntLiteral(10))`, ...) over and over, and every copy
+is an object of its own. An `ExprFactory` builds every structurally
+distinct node just once and hands back that one node whenever an
+identical one is asked for, so identical subtrees share a single object.
+
+Nodes built by a factory are instances of subclasses of the ordinary node
+classes -- `isinstance`, `match` and therefore every engine treat them
+exactly like the nodes themselves -- that also compare (and hash)
+structurally: two of them are equal exactly when they are trees of the
+same kinds of nodes with the same literals and variable names, even when
+they were built by different factories. That makes them usable as keys
+of the per-program caches that the engines keep (and of any other
+cache). Each node computes its hash from the hashes of its children when
+it is built, so hashing is constant-time and comparing never recurses.
+
+The factory refers to its nodes weakly: a node that no program uses any
+longer is not kept alive by the factory.
+
+Note that a shared node carries a single `static_type`: type checking a
+program annotates every program that shares its nodes, too.
+"""
+
+
+class Consed(object):
+    __slots__ = ()
+
+    def __hash__(self) -> int:
+        return self.structural_hash
+
+    def __eq__(self, other: Any) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Consed):
+            return NotImplemented
+        return structurally_equal(self, other)
+
+    def __ne__(self, other: Any) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+
+def make_consed(kind: type) -> type:
+    return type(f"Consed{kind.__name__}", (Consed, kind),
+                {"__slots__": ("structural_hash",)})
+
+
+CONSED = {kind: make_consed(kind) for kind in KINDS}
+
+
+def literal_key(literal: Any) -> Tuple[type, str]:
+    # repr() keeps values that compare equal but are not the same (0.0
+    # and -0.0, 1 and True) apart.
+    return (type(literal), repr(literal))
+
+
+def leaf_key(expression: Expr) -> Any:
+    match expression:
+        case Literal(literal=literal):
+            return literal_key(literal)
+        case Variable(variable_name=variable_name):
+            return variable_name
+        case _:
+            return None
+
+
+def leaf_value(expression: Expr) -> Any:
+    if isinstance(expression, Variable):
+        return expression.variable_name
+    return expression.literal
+
+
+def structurally_equal(left: Expr, right: Expr) -> bool:
+    pending = [(left, right)]
+    while pending:
+        left, right = pending.pop()
+        if left is right:
+            continue
+        if kind(left) is not kind(right) or hash(left) != hash(right) or \
+                leaf_key(left) != leaf_key(right):
+            return False
+        left_children, right_children = children(left), children(right)
+        if len(left_children) != len(right_children):
+            return False
+        pending.extend(zip(left_children, right_children))
+    return True
+
+
+class ExprFactory(object):
+    def __init__(self) -> None:
+        self.nodes: 'WeakValueDictionary[Tuple, Expr]' = WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def owns(self, expression: Expr) -> bool:
+        """
+        Whether `expression` is one of this factory's shared nodes.
+        """
+        if not isinstance(expression, Consed):
+            return False
+        expression_kind = kind(expression)
+        if expression_kind in LITERAL_KINDS or expression_kind is Variable:
+            key = (expression_kind, leaf_key(expression))
+        else:
+            key = (expression_kind,) + tuple(id(child) for child in children(expression))
+        return self.nodes.get(key) is expression
+
+    def make(self, kind: type, *operands: Any) -> Expr:
+        """
+        The node built by `kind(*operands)`, shared with every identical
+        node built by this factory. Operands that are expressions are
+        `intern`ed first.
+        """
+        return self.share(kind, tuple(self.intern(operand) if isinstance(operand, Expr) else operand
+                                      for operand in operands))
+
+    def share(self, kind: type, operands: Tuple) -> Expr:
+        # The operands that are expressions are already shared, so the
+        # identities of the operands identify the node.
+        if kind in LITERAL_KINDS or kind is Variable:
+            (leaf,) = operands
+            key = (kind, literal_key(leaf) if kind in LITERAL_KINDS else leaf)
+            structural_hash = hash((kind.__name__, key[1]))
+        else:
+            key = (kind,) + tuple(id(operand) for operand in operands)
+            structural_hash = hash((kind.__name__,) +
+                                   tuple(operand.structural_hash for operand in operands))
+        node = self.nodes.get(key)
+        if node is None:
+            node = CONSED[kind](*operands)
+            node.structural_hash = structural_hash
+            self.nodes[key] = node
+        return node
+
+    def intern(self, program: Expr) -> Expr:
+        """
+        `program` with every node replaced by the factory's shared copy of
+        it.
+        """
+        results: List[Expr] = []
+        pending = [(program, False)]
+        while pending:
+            expression, expanded = pending.pop()
+            if not expanded and self.owns(expression):
+                # Everything below a shared node is shared already.
+                results.append(expression)
+                continue
+            if not expanded:
+                pending.append((expression, True))
+                for child in reversed(children(expression)):
+                    pending.append((child, False))
+                continue
+            count = len(children(expression))
+            operands = tuple(results[len(results) - count:])
+            del results[len(results) - count:]
+            expression_kind = kind(expression)
+            if expression_kind in LITERAL_KINDS or expression_kind is Variable:
+                operands = (leaf_value(expression),)
+            results.append(self.share(expression_kind, operands))
+        return results[0]
+
+
+def hash_cons(program: Expr, factory: ExprFactory = None) -> Expr:
+    """
+    `program` with its identical subtrees shared (by `factory`, or by a
+    factory of its own).
+    """
+    if factory is None:
+        factory = ExprFactory()
+    return factory.intern(program)
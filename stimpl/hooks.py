@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from stimpl.expression import Expr
+from stimpl.rope import flattened
+from stimpl.types import Type
+
+"""
+Hooks
+
+A `Hooks` object holds callbacks for the events of a run:
+
+    enter(node)                                 before `node` is evaluated
+    exit(node, value, value_type)               once `node` has its value
+    assign(node, variable_name, value,          once the `Assign` `node`
+           value_type)                          has bound its variable
+    back_edge(node)                             after every iteration of
+                                                the `While` `node`
+    branch(node, taken)                         once the `If` or `While`
+                                                `node` has checked its
+                                                condition (`taken` is
+                                                whether it holds)
+
+`run_stimpl(program, hooks=hooks)` calls them while it runs `program`
+(and `hooked(hooks)` makes `hooks` apply to every run inside a `with`
+block). Whether there are any callbacks at all is decided once per run:
+when there are none, the program runs on the plain engine, exactly as if
+hooks did not exist. When there are, the closure engine runs a compiled
+program with hook calls wrapped around its closures, and every other
+engine hands the program to the iterative machine of `stimpl.iterative`,
+whose handler tables are swapped for ones that call the hooks. Both call
+them in the same order, and the specialized loops of `stimpl.compile`
+are left out so that every iteration is observed.
+"""
+
+EVENTS = ("enter", "exit", "assign", "back_edge", "branch")
+
+
+class Hooks(object):
+    def __init__(self) -> None:
+        self.callbacks: Dict[str, List[Callable[..., Any]]] = {event: [] for event in EVENTS}
+
+    def register(self, event: str, callback: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Call `callback` on every `event`. Returns `callback`, so that
+        `register` can be used as a decorator through `on`.
+        """
+        if event not in self.callbacks:
+            raise ValueError(f"Unknown STIMPL hook event: {event}")
+        self.callbacks[event].append(callback)
+        return callback
+
+    def unregister(self, event: str, callback: Callable[..., Any]) -> None:
+        if event not in self.callbacks:
+            raise ValueError(f"Unknown STIMPL hook event: {event}")
+        self.callbacks[event].remove(callback)
+
+    def on(self, event: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        A decorator that registers the function that it decorates for
+        `event`.
+        """
+        return lambda callback: self.register(event, callback)
+
+    def __bool__(self) -> bool:
+        return any(self.callbacks.values())
+
+    def enter(self, node: Expr) -> None:
+        for callback in self.callbacks["enter"]:
+            callback(node)
+
+    def exit(self, node: Expr, value: Any, value_type: Type) -> None:
+        for callback in self.callbacks["exit"]:
+            callback(node, flattened(value), value_type)
+
+    def assign(self, node: Expr, variable_name: str, value: Any, value_type: Type) -> None:
+        for callback in self.callbacks["assign"]:
+            callback(node, variable_name, flattened(value), value_type)
+
+    def back_edge(self, node: Expr) -> None:
+        for callback in self.callbacks["back_edge"]:
+            callback(node)
+
+    def branch(self, node: Expr, taken: bool) -> None:
+        for callback in self.callbacks["branch"]:
+            callback(node, taken)
+
+
+current_hooks: ContextVar = ContextVar("current_hooks", default=None)
+
+
+@contextmanager
+def hooked(hooks: Hooks) -> Iterator[Hooks]:
+    """
+    Call `hooks` in every run inside the `with` block.
+    """
+    token = current_hooks.set(hooks)
+    try:
+        yield hooks
+    finally:
+        current_hooks.reset(token)
+
+
+def select_hooked_engine(engine: str, hooks: Hooks) -> Callable:
+    if engine == "closure":
+        from stimpl.compile import evaluate_compiled_hooked
+        evaluate_hooked = evaluate_compiled_hooked
+    else:
+        from stimpl.iterative import evaluate_iterative_hooked
+        evaluate_hooked = evaluate_iterative_hooked
+    return lambda program, state: evaluate_hooked(program, state, hooks)
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+from itertools import count
+from typing import Any, List, Optional, Tuple
+
+from stimpl.expression import *
+from stimpl.types import Type, Unit
+from stimpl.hashcons import ExprFactory
+from stimpl.output import current_output, output_to
+from stimpl.rope import flattened
+from stimpl.runtime import EmptyState, State, flattened_state, select_engine
+
+"""
+Incremental execution
+
+Scripts are edited and run again and again, and most edits only touch
+their end. An `IncrementalRunner` runs a `Program` one top-level
+expression at a time and keeps a checkpoint after each of them: the
+value, type and `State` that the program had reached, and what the
+expression printed. States are persistent, so a checkpoint costs no more
+than a reference to one.
+
+A checkpoint is keyed by the expression and by the checkpoint before it,
+so it stands for the whole prefix of the program up to that expression.
+Expressions are hash-consed (see `stimpl.hashcons`) by the runner's
+factory: finding the checkpoint of an unchanged expression is a
+constant-time lookup, and a changed expression -- or any expression after
+it -- simply finds none. Running a program again therefore resumes from
+the end of its longest unchanged prefix and evaluates only the rest.
+
+What the skipped expressions printed is written to the output sink again
+(or not, when `replay_output` is off), in order, before the rest of the
+program runs, so the output of a run is exactly that of running the
+whole program from scratch. The runner keeps at most `max_checkpoints`
+checkpoints and drops the least recently used ones first.
+
+Every run starts from an empty state. Expressions that raise leave no
+checkpoint behind.
+"""
+
+
+class Checkpoint(object):
+    __slots__ = ("serial", "value", "value_type", "state", "printed")
+
+    def __init__(self, serial: int, value: Any, value_type: Type, state: State,
+                 printed: Tuple[Tuple[Any, Type], ...]) -> None:
+        self.serial = serial
+        self.value = value
+        self.value_type = value_type
+        self.state = state
+        self.printed = printed
+
+
+class RecordingOutput(object):
+    """
+    Passes everything printed on to `sink` and keeps a copy of it.
+    """
+
+    def __init__(self, sink: Any) -> None:
+        self.sink = sink
+        self.printed: List[Tuple[Any, Type]] = []
+
+    def write(self, printed_value: Any, printed_type: Type) -> None:
+        self.printed.append((printed_value, printed_type))
+        self.sink.write(printed_value, printed_type)
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+
+class IncrementalRunner(object):
+    def __init__(self, engine: str = "tree", max_checkpoints: int = 1024,
+                 replay_output: bool = True) -> None:
+        self.engine = engine
+        self.evaluate = select_engine(engine)
+        self.max_checkpoints = max_checkpoints
+        self.replay_output = replay_output
+        self.factory = ExprFactory()
+        self.checkpoints: 'OrderedDict[Tuple[int, Expr], Checkpoint]' = OrderedDict()
+        self.serials = count(1)
+        # How many top-level expressions the last run took from
+        # checkpoints and how many it evaluated.
+        self.reused = 0
+        self.evaluated = 0
+
+    def __len__(self) -> int:
+        return len(self.checkpoints)
+
+    def clear(self) -> None:
+        self.checkpoints.clear()
+
+    def run(self, program: Expr, output: Any = None,
+            replay_output: Optional[bool] = None) -> Tuple[Optional[Any], Type, State]:
+        """
+        Run `program` (like `run_stimpl`), starting from the checkpoint at
+        the end of its longest prefix that has run before. What it prints
+        goes to `output`, if given, and to the current sink otherwise.
+        """
+        if replay_output is None:
+            replay_output = self.replay_output
+        if output is None:
+            return self.run_program(program, replay_output)
+        with output_to(output):
+            return self.run_program(program, replay_output)
+
+    def run_program(self, program: Expr, replay_output: bool) -> Tuple[Optional[Any], Type, State]:
+        exprs = program.exprs if kind(program) is Program else (program,)
+        sink = current_output.get()
+        value, value_type, state = None, Unit(), EmptyState()
+        checkpoints = self.checkpoints
+        parent = 0
+        self.reused = self.evaluated = 0
+
+        for expression in exprs:
+            expression = self.factory.intern(expression)
+            key = (parent, expression)
+            checkpoint = checkpoints.get(key)
+            if checkpoint is not None:
+                checkpoints.move_to_end(key)
+                self.reused += 1
+                if replay_output:
+                    for printed_value, printed_type in checkpoint.printed:
+                        sink.write(printed_value, printed_type)
+            else:
+                self.evaluated += 1
+                recording = RecordingOutput(sink)
+                token = current_output.set(recording)
+                try:
+                    value, value_type, state = self.evaluate(expression, state)
+                finally:
+                    current_output.reset(token)
+                checkpoint = Checkpoint(next(self.serials), value, value_type, state,
+                                        tuple(recording.printed))
+                checkpoints[key] = checkpoint
+                if len(checkpoints) > self.max_checkpoints:
+                    checkpoints.popitem(last=False)
+            value, value_type, state = checkpoint.value, checkpoint.value_type, checkpoint.state
+            parent = checkpoint.serial
+
+        return (flattened(value), value_type, flattened_state(state))
@@ -0,0 +1,576 @@
+from typing import Any, Callable, List, Optional, Sequence as Seq, Tuple
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.runtime import State, current_budget
+from stimpl.rope import concat
+from stimpl.hooks import Hooks
+from stimpl.table import KINDS, KIND_INDICES
+from stimpl.codegen import ARITHMETIC_TYPES, ADDABLE_TYPES, ORDERED_TYPES, \
+    emit, fail_read, fail_assign, fail_arithmetic, fail_divide_by_zero, \
+    fail_logical, fail_not, fail_relational, fail_condition, fail_unhandled
+
+"""
+Iterative evaluation
+
+`evaluate` recurses once per level of nesting, so deeply nested programs
+exhaust the Python recursion limit. The `Machine` evaluates programs with
+exactly the same semantics (the same results, the same output and the
+same errors, raised at the same points) using explicit stacks instead of
+the Python stack:
+
+  - the task stack holds the work that remains to be done. A task is a
+    single integer that combines the index of a node and a phase: every
+    node is *visited* (which pushes the tasks that evaluate its operands
+    and the one that finishes it) and most are then *finished* (which
+    combines the values of its operands). A `While` has one more phase,
+    the back-edge that runs after every iteration of its body.
+  - the value stack holds the (value, type) pairs of the operands that
+    have been evaluated but not yet consumed.
+  - the state register holds the current `State`.
+
+What a task does is looked up in a table of handlers indexed by phase and
+by kind of node, so that instrumented machines can swap in handlers of
+their own. Nothing but the task stack tracks progress, so a machine can
+be run a bounded number of steps at a time and resumed later.
+
+Before it runs, a program is loaded into an `Image`: its nodes in
+post-order, each reduced to the index of its kind and its operands (the
+indices of its children, its literal value or its variable name).
+"""
+
+VISIT = 0
+FINISH = 1
+LOOP = 2
+# Not used by the plain machine: instrumented machines push an exit task
+# for a node before visiting it, which runs once the node has its value.
+EXIT = 3
+
+PHASE_BITS = 2
+PHASE_MASK = (1 << PHASE_BITS) - 1
+
+# The kind index of nodes that are not STIMPL expressions.
+UNHANDLED = len(KINDS)
+
+# Under a timeout, how many tasks a machine performs between two looks at
+# the clock.
+NODE_BATCH = 1 << 14
+
+STRING_TYPE = String()
+UNIT_VALUE = (None, Unit())
+FALSE_VALUE = (False, Boolean())
+
+LITERAL_TYPES = {IntLiteral: Integer(), FloatingPointLiteral: FloatingPoint(),
+                 StringLiteral: String(), BooleanLiteral: Boolean()}
+
+
+def kind_index(expression: Any) -> int:
+    found = KIND_INDICES.get(type(expression))
+    if found is None:
+        if not isinstance(expression, Expr):
+            return UNHANDLED
+        found = KIND_INDICES.get(kind(expression), UNHANDLED)
+    return found
+
+
+def evaluated_children(expression: Expr) -> Tuple[Expr, ...]:
+    """
+    The subexpressions that evaluating `expression` evaluates (unlike
+    `children`, not the variable that an `Assign` assigns).
+    """
+    if isinstance(expression, Assign):
+        return (expression.value,)
+    if not isinstance(expression, Expr):
+        return ()
+    return children(expression)
+
+
+class Image(object):
+    __slots__ = ("kinds", "arguments", "dispatch_tables", "__weakref__")
+
+    def __init__(self, kinds: List[int], arguments: List[Any]) -> None:
+        self.kinds = kinds
+        self.arguments = arguments
+        self.dispatch_tables = {}
+
+    def dispatch_table(self, handlers: Seq[List['Handler']]) -> List['Handler']:
+        """
+        The handler for every task of this image, indexed by task, when
+        the machine uses `handlers`.
+        """
+        cached = self.dispatch_tables.get(id(handlers))
+        if cached is None or cached[0] is not handlers:
+            table = []
+            for expression_kind in self.kinds:
+                table.extend(handlers[phase][expression_kind] for phase in range(len(handlers)))
+                table.extend([unreachable] * ((1 << PHASE_BITS) - len(handlers)))
+            cached = self.dispatch_tables[id(handlers)] = (handlers, table)
+        return cached[1]
+
+    @property
+    def root(self) -> int:
+        return len(self.kinds) - 1
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+
+def load(program: Expr) -> Image:
+    kinds: List[int] = []
+    arguments: List[Any] = []
+    results: List[int] = []
+    pending = [(program, False)]
+    while pending:
+        expression, expanded = pending.pop()
+        if not expanded:
+            pending.append((expression, True))
+            for child in reversed(evaluated_children(expression)):
+                pending.append((child, False))
+            continue
+        count = len(evaluated_children(expression))
+        child_indices = tuple(results[len(results) - count:])
+        del results[len(results) - count:]
+
+        expression_kind = kind_index(expression)
+        if expression_kind == UNHANDLED:
+            argument = None
+        elif KINDS[expression_kind] in LITERAL_TYPES:
+            argument = (expression.literal,
+                        LITERAL_TYPES[KINDS[expression_kind]])
+        elif KINDS[expression_kind] is Variable:
+            argument = expression.variable_name
+        elif KINDS[expression_kind] is Assign:
+            argument = (expression.variable.variable_name, child_indices[0])
+        else:
+            argument = child_indices
+        kinds.append(expression_kind)
+        arguments.append(argument)
+        results.append(len(kinds) - 1)
+    return Image(kinds, arguments)
+
+
+"""
+Handlers
+
+A handler is called with the machine and the index of the node that the
+task is for.
+"""
+
+Handler = Callable[['Machine', int], None]
+
+
+def visit_constant(machine: 'Machine', index: int) -> None:
+    machine.values.append(machine.arguments[index])
+
+
+def visit_ren(machine: 'Machine', index: int) -> None:
+    machine.values.append(UNIT_VALUE)
+
+
+def visit_variable(machine: 'Machine', index: int) -> None:
+    variable_name = machine.arguments[index]
+    value = machine.state.get_value(variable_name)
+    if value is None:
+        fail_read(variable_name)
+    machine.values.append(value)
+
+
+def visit_operator(machine: 'Machine', index: int) -> None:
+    """
+    Evaluate the operands of node `index`, left to right, then finish it.
+    """
+    tasks = machine.tasks
+    tasks.append(index << PHASE_BITS | FINISH)
+    for child in reversed(machine.arguments[index]):
+        tasks.append(child << PHASE_BITS)
+
+
+def visit_assign(machine: 'Machine', index: int) -> None:
+    machine.tasks.append(index << PHASE_BITS | FINISH)
+    machine.tasks.append(machine.arguments[index][1] << PHASE_BITS)
+
+
+def visit_conditional(machine: 'Machine', index: int) -> None:
+    """
+    Evaluate the condition of the `If` or `While` at `index`, then finish
+    it.
+    """
+    machine.tasks.append(index << PHASE_BITS | FINISH)
+    machine.tasks.append(machine.arguments[index][0] << PHASE_BITS)
+
+
+def visit_sequence(machine: 'Machine', index: int) -> None:
+    if len(machine.arguments[index]) == 0:
+        machine.values.append(UNIT_VALUE)
+    else:
+        visit_operator(machine, index)
+
+
+def visit_unhandled(machine: 'Machine', index: int) -> None:
+    fail_unhandled()
+
+
+def finish_print(machine: 'Machine', index: int) -> None:
+    emit(*machine.values[-1])
+
+
+def finish_sequence(machine: 'Machine', index: int) -> None:
+    # Only the value of the last expression is kept.
+    values = machine.values
+    del values[len(values) - len(machine.arguments[index]):-1]
+
+
+def finish_assign(machine: 'Machine', index: int) -> None:
+    value = machine.values[-1]
+    variable_name = machine.arguments[index][0]
+    current = machine.state.get_value(variable_name)
+    if current is not None and current[1] is not value[1]:
+        fail_assign(value[1], current[1])
+    machine.state = machine.state.set_value(variable_name, *value)
+
+
+def finish_not(machine: 'Machine', index: int) -> None:
+    value, value_type = machine.values.pop()
+    if type(value_type) is not Boolean:
+        fail_not()
+    machine.values.append((not value, value_type))
+
+
+def finish_add(machine: 'Machine', index: int) -> None:
+    values = machine.values
+    right_value, right_type = values.pop()
+    left_value, left_type = values.pop()
+    if left_type is not right_type or type(left_type) not in ADDABLE_TYPES:
+        fail_arithmetic("Add", "add", "to", left_type, right_type)
+    if left_type is STRING_TYPE:
+        values.append((concat(left_value, right_value), left_type))
+    else:
+        values.append((left_value + right_value, left_type))
+
+
+def finish_subtract(machine: 'Machine', index: int) -> None:
+    values = machine.values
+    right_value, right_type = values.pop()
+    left_value, left_type = values.pop()
+    if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+        fail_arithmetic("Subtract", "subtract", "from", left_type, right_type)
+    values.append((left_value - right_value, left_type))
+
+
+def finish_multiply(machine: 'Machine', index: int) -> None:
+    values = machine.values
+    right_value, right_type = values.pop()
+    left_value, left_type = values.pop()
+    if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+        fail_arithmetic("Multiply", "multiply", "by", left_type, right_type)
+    values.append((left_value * right_value, left_type))
+
+
+def finish_divide(machine: 'Machine', index: int) -> None:
+    values = machine.values
+    right_value, right_type = values.pop()
+    left_value, left_type = values.pop()
+    if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+        fail_arithmetic("Divide", "divide", "by", left_type, right_type)
+    if right_value == 0:
+        fail_divide_by_zero()
+    if type(left_type) is Integer:
+        values.append((left_value // right_value, left_type))
+    else:
+        values.append((left_value / right_value, left_type))
+
+
+def finish_logical(name: str, verb: str, combine: Callable[[bool, bool], bool]) -> Handler:
+    def finish(machine: 'Machine', index: int) -> None:
+        values = machine.values
+        right_value, right_type = values.pop()
+        left_value, left_type = values.pop()
+        if type(left_type) is not Boolean or type(right_type) is not Boolean:
+            fail_logical(name, verb, left_type, right_type)
+        values.append((combine(left_value, right_value), left_type))
+    return finish
+
+
+def finish_relational(name: str, symbol: str, compare: Callable[[Any, Any], bool], on_units: bool) -> Handler:
+    boolean = Boolean()
+
+    def finish(machine: 'Machine', index: int) -> None:
+        values = machine.values
+        right_value, right_type = values.pop()
+        left_value, left_type = values.pop()
+        if left_type is not right_type or \
+                (type(left_type) not in ORDERED_TYPES and type(left_type) is not Unit):
+            fail_relational(name, symbol, left_type, right_type)
+        if type(left_type) is Unit:
+            values.append((on_units, boolean))
+        else:
+            values.append((compare(left_value, right_value), boolean))
+    return finish
+
+
+def finish_if(machine: 'Machine', index: int) -> None:
+    condition_value, condition_type = machine.values.pop()
+    if type(condition_type) is not Boolean:
+        fail_condition("If", condition_type)
+    _, true, false = machine.arguments[index]
+    machine.tasks.append((true if condition_value else false) << PHASE_BITS)
+
+
+def finish_while(machine: 'Machine', index: int) -> None:
+    """
+    Check the condition of the `While` at `index`: either run its body
+    once more or produce its value.
+    """
+    condition_value, condition_type = machine.values.pop()
+    if type(condition_type) is not Boolean:
+        fail_condition("While", condition_type)
+    if condition_value:
+        machine.tasks.append(index << PHASE_BITS | LOOP)
+        machine.tasks.append(machine.arguments[index][1] << PHASE_BITS)
+    else:
+        machine.values.append(FALSE_VALUE)
+
+
+def loop_while(machine: 'Machine', index: int) -> None:
+    # The back-edge: drop the value of the body and check the condition
+    # again.
+    machine.values.pop()
+    machine.state = machine.state.maybe_compact()
+    if machine.budget is not None:
+        machine.budget.charge(machine.state)
+    visit_conditional(machine, index)
+
+
+def unreachable(machine: 'Machine', index: int) -> None:
+    raise InterpSyntaxError("Unhandled!")
+
+
+def handler_table(handlers: dict, unhandled: Handler = unreachable) -> List[Handler]:
+    """
+    `handlers` (keyed by node class) as a list indexed by kind index.
+    """
+    return [handlers.get(expression_kind, unreachable) for expression_kind in KINDS] + [unhandled]
+
+
+VISITORS = {
+    Ren: visit_ren,
+    IntLiteral: visit_constant,
+    FloatingPointLiteral: visit_constant,
+    StringLiteral: visit_constant,
+    BooleanLiteral: visit_constant,
+    Variable: visit_variable,
+    Assign: visit_assign,
+    Print: visit_operator,
+    Not: visit_operator,
+    Program: visit_sequence,
+    Sequence: visit_sequence,
+    If: visit_conditional,
+    While: visit_conditional,
+}
+for operator_kind in (And, Or, Lt, Lte, Gt, Gte, Eq, Ne, Add, Subtract, Multiply, Divide):
+    VISITORS[operator_kind] = visit_operator
+
+FINISHERS = {
+    Assign: finish_assign,
+    Print: finish_print,
+    Not: finish_not,
+    And: finish_logical("And", "and", lambda left, right: left and right),
+    Or: finish_logical("Or", "or", lambda left, right: left or right),
+    Lt: finish_relational("Lt", "<", lambda left, right: left < right, False),
+    Lte: finish_relational("Lte", "<=", lambda left, right: left <= right, True),
+    Gt: finish_relational("Gt", ">", lambda left, right: left > right, False),
+    Gte: finish_relational("Gte", ">=", lambda left, right: left >= right, True),
+    Eq: finish_relational("Eq", "==", lambda left, right: left == right, True),
+    Ne: finish_relational("Ne", "!=", lambda left, right: left != right, False),
+    Add: finish_add,
+    Subtract: finish_subtract,
+    Multiply: finish_multiply,
+    Divide: finish_divide,
+    Program: finish_sequence,
+    Sequence: finish_sequence,
+    If: finish_if,
+    While: finish_while,
+}
+
+LOOPERS = {
+    While: loop_while,
+}
+
+HANDLERS = (handler_table(VISITORS, visit_unhandled),
+            handler_table(FINISHERS),
+            handler_table(LOOPERS))
+
+"""
+The machine
+"""
+
+
+class Machine(object):
+    """
+    Evaluates `program` (or a loaded `image` of it) starting from `state`.
+    `handlers` holds one table of handlers per phase, each indexed by
+    kind index (see `handler_table`).
+    """
+    __slots__ = ("program", "image", "arguments", "handlers", "dispatch", "tasks", "values", "state",
+                 "budget")
+
+    def __init__(self, program: Expr, state: State, image: Image = None,
+                 handlers: Seq[List[Handler]] = HANDLERS) -> None:
+        if image is None:
+            image = image_for(program)
+        self.program = program
+        self.image = image
+        self.arguments = image.arguments
+        self.handlers = handlers
+        self.dispatch = image.dispatch_table(handlers)
+        self.tasks: List[int] = [image.root << PHASE_BITS]
+        self.values: List[Tuple[Any, Type]] = []
+        self.state = state
+        # The budget of the run that created the machine (see
+        # `stimpl.runtime.Budget`), charged on every back-edge.
+        self.budget = current_budget.get()
+
+    @property
+    def done(self) -> bool:
+        return not self.tasks
+
+    def run(self, steps: Optional[int] = None) -> bool:
+        """
+        Perform at most `steps` tasks (all of them, by default) and report
+        whether the program has finished.
+        """
+        tasks, dispatch = self.tasks, self.dispatch
+        pop = tasks.pop
+        if steps is None:
+            while tasks:
+                task = pop()
+                dispatch[task](self, task >> PHASE_BITS)
+            return True
+
+        for _ in range(steps):
+            if not tasks:
+                break
+            task = pop()
+            dispatch[task](self, task >> PHASE_BITS)
+        return not tasks
+
+    def run_within_budget(self) -> None:
+        """
+        Perform every task, checking the clock of the budget (if it has a
+        timeout) after every `NODE_BATCH` tasks, so that even programs
+        without loops stop soon after their time is up.
+        """
+        budget = self.budget
+        if budget is None or budget.deadline is None:
+            self.run()
+            return
+        while not self.run(NODE_BATCH):
+            budget.check_clock(self.state)
+
+    def result(self) -> Tuple[Optional[Any], Type, State]:
+        if self.tasks:
+            raise ValueError("The program has not finished running.")
+        value, value_type = self.values[-1]
+        return (value, value_type, self.state)
+
+
+"""
+Images are cached per program object, weakly, just like the closures
+built by `stimpl.compile`.
+"""
+loaded_images: 'WeakKeyDictionary[Expr, Image]' = WeakKeyDictionary()
+
+
+def image_for(program: Expr) -> Image:
+    image = loaded_images.get(program)
+    if image is None:
+        image = load(program)
+        loaded_images[program] = image
+    return image
+
+
+def evaluate_iterative(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State]:
+    machine = Machine(expression, state)
+    machine.run_within_budget()
+    return machine.result()
+
+
+"""
+Hooks
+
+A `HookedMachine` calls the callbacks of a `stimpl.hooks.Hooks` object
+around the plain handlers. Like the profiler, it pushes an exit task for
+every node that it visits, which runs once the node has its value.
+"""
+
+
+def image_nodes(program: Expr) -> List[Expr]:
+    """
+    The nodes of `program` in the order of the nodes of its image.
+    """
+    nodes: List[Expr] = []
+    pending = [(program, False)]
+    while pending:
+        expression, expanded = pending.pop()
+        if expanded:
+            nodes.append(expression)
+            continue
+        pending.append((expression, True))
+        for child in reversed(evaluated_children(expression)):
+            pending.append((child, False))
+    return nodes
+
+
+class HookedMachine(Machine):
+    __slots__ = ("hooks", "nodes")
+
+    def __init__(self, program: Expr, state: State, hooks: Hooks, image: Image = None) -> None:
+        super().__init__(program, state, image, HOOKED_HANDLERS)
+        self.hooks = hooks
+        self.nodes = image_nodes(program)
+
+
+def hook_visit(machine: HookedMachine, index: int) -> None:
+    machine.tasks.append(index << PHASE_BITS | EXIT)
+    machine.hooks.enter(machine.nodes[index])
+    HANDLERS[VISIT][machine.image.kinds[index]](machine, index)
+
+
+def hook_exit(machine: HookedMachine, index: int) -> None:
+    machine.hooks.exit(machine.nodes[index], *machine.values[-1])
+
+
+def hook_assign(machine: HookedMachine, index: int) -> None:
+    finish_assign(machine, index)
+    machine.hooks.assign(machine.nodes[index], machine.arguments[index][0], *machine.values[-1])
+
+
+def hook_decision(finish: Handler) -> Handler:
+    def finish_hooked(machine: HookedMachine, index: int) -> None:
+        condition_value = machine.values[-1][0]
+        # The plain handler checks the type of the condition.
+        finish(machine, index)
+        machine.hooks.branch(machine.nodes[index], bool(condition_value))
+    return finish_hooked
+
+
+def hook_loop(machine: HookedMachine, index: int) -> None:
+    machine.hooks.back_edge(machine.nodes[index])
+    loop_while(machine, index)
+
+
+HOOKED_HANDLERS = (
+    [hook_visit] * (len(KINDS) + 1),
+    handler_table({**FINISHERS, Assign: hook_assign,
+                   If: hook_decision(finish_if), While: hook_decision(finish_while)}),
+    handler_table({While: hook_loop}),
+    [hook_exit] * (len(KINDS) + 1),
+)
+
+
+def evaluate_iterative_hooked(expression: Expr, state: State, hooks: Hooks) -> Tuple[Optional[Any], Type, State]:
+    machine = HookedMachine(expression, state, hooks)
+    machine.run_within_budget()
+    return machine.result()
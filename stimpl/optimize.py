@@ -0,0 +1,153 @@
+from typing import List
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.runtime import EmptyState, evaluate
+from stimpl.rope import flattened
+
+"""
+Optimization
+
+`optimize` rewrites a program into one that is observably identical --
+same result, same final state, same output and the same errors, raised
+at the same point -- but that does less work when it runs:
+
+  - Operators whose operands are all constants (literals or `Ren`) are
+    folded into a constant (`Add(IntLiteral(2), IntLiteral(2))` becomes
+    `IntLiteral(4)`). Folding is done by the evaluator itself, so the
+    folded value is exactly the one the operator would produce. An
+    operator that raises when evaluated (`Divide(IntLiteral(1),
+    IntLiteral(0))`, `Add(IntLiteral(1), StringLiteral("1"))`) is left
+    in place so that it still raises when (and if) the program gets to
+    it.
+  - An `If` whose condition is a Boolean constant is replaced by the
+    branch that it takes, and a `While` whose condition is `False` by
+    that condition (its value).
+  - Sequences nested in sequences are spliced into their parents, and
+    constants whose values are thrown away (those anywhere but at the end
+    of a sequence) are dropped. A sequence of one expression is replaced
+    by that expression.
+
+Nothing with an effect is ever removed or reordered: there is no
+short-circuiting to exploit, `Print`s and `Assign`s stay where they are,
+and reading a variable (which raises if the variable has not been
+assigned) is never folded away.
+"""
+
+CONSTANT_KINDS = (Ren, IntLiteral, FloatingPointLiteral,
+                  StringLiteral, BooleanLiteral)
+
+FOLDABLE_KINDS = (Not, And, Or, Lt, Lte, Gt, Gte, Eq, Ne, Add, Subtract,
+                  Multiply, Divide)
+
+LITERALS = {Integer(): IntLiteral, FloatingPoint(): FloatingPointLiteral,
+            String(): StringLiteral, Boolean(): BooleanLiteral}
+
+
+def is_constant(expression: Expr) -> bool:
+    return kind(expression) in CONSTANT_KINDS
+
+
+def fold(expression: Expr) -> Expr:
+    """
+    The constant that `expression` (an operator whose operands are all
+    constants) evaluates to, or `expression` itself if evaluating it
+    raises.
+    """
+    try:
+        value, value_type, _ = evaluate(expression, EmptyState())
+    except InterpError:
+        return expression
+    if value_type is Unit():
+        return Ren()
+    return LITERALS[value_type](flattened(value))
+
+
+def flatten(exprs: Tuple[Expr, ...]) -> List[Expr]:
+    spliced = []
+    for position, expr in enumerate(exprs):
+        last = position == len(exprs) - 1
+        if kind(expr) in (Sequence, Program):
+            spliced.extend(expr.exprs)
+            if last and len(expr.exprs) == 0:
+                spliced.append(Ren())
+        else:
+            spliced.append(expr)
+    return [expr for position, expr in enumerate(spliced)
+            if position == len(spliced) - 1 or not is_constant(expr)]
+
+
+def rewrite(expression: Expr, rewritten: Tuple[Expr, ...]) -> Expr:
+    """
+    `expression` with its children replaced by `rewritten` (their
+    optimized versions), simplified.
+    """
+    expression_kind = kind(expression)
+
+    if expression_kind in (Sequence, Program):
+        rewritten = tuple(flatten(rewritten))
+        if expression_kind is Sequence and len(rewritten) == 1:
+            return rewritten[0]
+
+    if expression_kind is If:
+        condition, true, false = rewritten
+        if kind(condition) is BooleanLiteral:
+            return true if condition.literal else false
+
+    if expression_kind is While:
+        condition, _ = rewritten
+        if kind(condition) is BooleanLiteral and not condition.literal:
+            return condition
+
+    if len(rewritten) != len(children(expression)) or \
+            any(new is not old for new, old in zip(rewritten, children(expression))):
+        expression = expression_kind(*rewritten)
+
+    if expression_kind in FOLDABLE_KINDS and all(is_constant(child) for child in rewritten):
+        return fold(expression)
+    return expression
+
+
+def optimize(program: Expr) -> Expr:
+    """
+    An optimized, observably identical, version of `program`. Subtrees
+    that cannot be improved are shared with `program`, which is left
+    untouched.
+    """
+    # An explicit stack keeps deeply nested programs from exhausting the
+    # Python recursion limit.
+    results: List[Expr] = []
+    pending = [(program, False)]
+    while pending:
+        expression, expanded = pending.pop()
+        if not expanded:
+            pending.append((expression, True))
+            for child in reversed(children(expression)):
+                pending.append((child, False))
+            continue
+        count = len(children(expression))
+        rewritten = tuple(results[len(results) - count:])
+        del results[len(results) - count:]
+        results.append(rewrite(expression, rewritten))
+    return results[0]
+
+
+optimized_programs: 'WeakKeyDictionary[Expr, Expr]' = WeakKeyDictionary()
+
+UNCHANGED = object()
+
+
+def optimize_program(program: Expr) -> Expr:
+    """
+    `optimize(program)`, computed once per program, so that engines that
+    cache their work per program see the same optimized program on every
+    run.
+    """
+    optimized = optimized_programs.get(program)
+    if optimized is None:
+        optimized = optimize(program)
+        # A program that maps to itself would never be collected.
+        optimized_programs[program] = UNCHANGED if optimized is program else optimized
+    return program if optimized is UNCHANGED else optimized
@@ -0,0 +1,132 @@
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional, TextIO, Tuple
+
+from stimpl.types import Type, Unit
+from stimpl.rope import flattened
+
+"""
+Output
+
+Every engine hands what a `Print` prints to `emit`, which passes it on to
+the current output sink. A sink is any object with
+
+    write(printed_value, printed_type)    take one printed value
+    flush()                               push out anything held back
+
+The default sink, `StdoutOutput`, calls `print()` for every value, just
+as `evaluate` always has, so output still goes wherever `sys.stdout`
+points at the time (`redirect_stdout` keeps working). The others are
+
+    BufferedOutput    joins printed lines and writes them in blocks of at
+                      least `flush_size` characters
+    CollectedOutput   keeps the printed values themselves
+    NullOutput        drops everything (for benchmarks)
+
+All of them print a value of type unit as `Unit` and any other value as
+`f"{value}"`, one line per value, byte for byte like `print()`.
+
+The current sink is held in a context variable: `output_to(sink)` makes
+`sink` current for the duration of a `with` block (and flushes it at the
+end of the block), and `run_stimpl(..., output=sink)` does the same for
+one run. Threads and asyncio tasks each see their own current sink.
+"""
+
+
+def printed_text(printed_value: Any, printed_type: Type) -> str:
+    """
+    The line (without its newline) that printing `printed_value` shows.
+    """
+    if type(printed_type) is Unit:
+        return "Unit"
+    return f"{printed_value}"
+
+
+class StdoutOutput(object):
+    def write(self, printed_value: Any, printed_type: Type) -> None:
+        print(printed_text(printed_value, printed_type))
+
+    def flush(self) -> None:
+        pass
+
+
+class BufferedOutput(object):
+    """
+    Writes printed lines to `file` (by default, whatever `sys.stdout` is
+    when it flushes) once at least `flush_size` characters of them are
+    held back, and when it is flushed.
+    """
+
+    def __init__(self, file: Optional[TextIO] = None, flush_size: int = 1 << 16) -> None:
+        self.file = file
+        self.flush_size = flush_size
+        self.lines: List[str] = []
+        self.size = 0
+
+    def write(self, printed_value: Any, printed_type: Type) -> None:
+        line = printed_text(printed_value, printed_type) + "\n"
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.lines:
+            (sys.stdout if self.file is None else self.file).write("".join(self.lines))
+            self.lines = []
+            self.size = 0
+
+
+class CollectedOutput(object):
+    """
+    Keeps every printed value (and its type) instead of printing it.
+    """
+
+    def __init__(self) -> None:
+        self.printed: List[Tuple[Any, Type]] = []
+
+    @property
+    def values(self) -> List[Any]:
+        return [printed_value for printed_value, _ in self.printed]
+
+    def text(self) -> str:
+        """
+        What printing the collected values would have shown.
+        """
+        return "".join(printed_text(printed_value, printed_type) + "\n"
+                       for printed_value, printed_type in self.printed)
+
+    def write(self, printed_value: Any, printed_type: Type) -> None:
+        self.printed.append((printed_value, printed_type))
+
+    def flush(self) -> None:
+        pass
+
+
+class NullOutput(object):
+    def write(self, printed_value: Any, printed_type: Type) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+current_output: ContextVar = ContextVar("current_output", default=StdoutOutput())
+
+
+def emit(printed_value: Any, printed_type: Type) -> None:
+    current_output.get().write(flattened(printed_value), printed_type)
+
+
+@contextmanager
+def output_to(sink: Any) -> Iterator[Any]:
+    """
+    Send everything that is printed inside the `with` block to `sink`.
+    """
+    token = current_output.set(sink)
+    try:
+        yield sink
+    finally:
+        current_output.reset(token)
+        sink.flush()
@@ -0,0 +1,159 @@
+import io
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sized, Tuple
+
+from stimpl.expression import Expr
+from stimpl.types import Type
+from stimpl.output import BufferedOutput
+from stimpl.runtime import run_stimpl
+from stimpl.serialize import dumps, read_table
+
+"""
+Parallel execution
+
+`run_stimpl_many` runs a corpus of programs on a pool of worker
+processes, so that running them is not serialized by the GIL.
+
+Programs travel to the workers in the binary format of
+`stimpl.serialize` -- a handful of flat arrays and a literal pool, which
+are compact and are written and read without recursing, no matter how
+deeply a program is nested -- in chunks of several
+programs, so that the cost of a round trip to a worker is shared by all
+the programs of a chunk. Each program runs with its output captured on
+its own and any exception that it raises is caught, so one program can
+neither interleave its output with another's nor stop the rest of the
+run. Rather than the final `State` itself, a worker sends back a
+summary of it: its live bindings.
+"""
+
+# The size of a chunk when the number of programs is not known up front.
+DEFAULT_CHUNKSIZE = 16
+
+# How many chunks are queued for every worker at a time.
+CHUNKS_PER_WORKER = 2
+
+
+class ProgramResult(object):
+    """
+    The outcome of running the `index`th program of a corpus: its value,
+    type and final bindings (name to (value, type)) or the exception that
+    it raised, and what it printed.
+    """
+
+    def __init__(self, index: int, value: Any, value_type: Optional[Type],
+                 bindings: Optional[Dict[str, Tuple[Any, Type]]],
+                 error: Optional[BaseException], output: str) -> None:
+        self.index = index
+        self.value = value
+        self.value_type = value_type
+        self.bindings = bindings
+        self.error = error
+        self.output = output
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            return f"ProgramResult(index={self.index}, error={self.error!r})"
+        return f"ProgramResult(index={self.index}, value={self.value!r}, type={self.value_type})"
+
+
+def run_one(index: int, program: Expr, engine: str,
+            limits: Optional[Dict[str, Any]] = None) -> ProgramResult:
+    output = io.StringIO()
+    try:
+        value, value_type, state = run_stimpl(program, engine=engine, output=BufferedOutput(output),
+                                              **(limits or {}))
+    except Exception as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            # The error has to get back to the caller somehow.
+            error = RuntimeError(f"{type(error).__name__}: {error}")
+        return ProgramResult(index, None, None, None, error, output.getvalue())
+    bindings = {variable_name: (variable_value, variable_type)
+                for variable_name, variable_value, variable_type in state.bindings()}
+    return ProgramResult(index, value, value_type, bindings, None, output.getvalue())
+
+
+def run_chunk(chunk: List[Tuple[int, bytes]], engine: str,
+              limits: Optional[Dict[str, Any]] = None) -> List[ProgramResult]:
+    """
+    Run every (serialized) program of `chunk` in a worker.
+    """
+    return [run_one(index, read_table(data).to_expr(), engine, limits) for index, data in chunk]
+
+
+def chunks_of(programs: Iterable[Expr], chunksize: int) -> Iterator[List[Tuple[int, Expr]]]:
+    programs = enumerate(programs)
+    while True:
+        chunk = list(islice(programs, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def serialize_chunk(chunk: List[Tuple[int, Expr]]) -> Tuple[List[Tuple[int, bytes]], List[ProgramResult]]:
+    """
+    The serialized programs of `chunk`, and the results of those that
+    cannot be serialized.
+    """
+    serialized, failed = [], []
+    for index, program in chunk:
+        try:
+            serialized.append((index, dumps(program)))
+        except Exception as error:
+            failed.append(ProgramResult(index, None, None, None, error, ""))
+    return serialized, failed
+
+
+def run_stimpl_many(programs: Iterable[Expr], workers: Optional[int] = None, engine: str = "tree",
+                    ordered: bool = True, chunksize: Optional[int] = None,
+                    limits: Optional[Dict[str, Any]] = None) -> Iterator[ProgramResult]:
+    """
+    Run every program of `programs` with `engine` on `workers` processes
+    (by default, one per CPU) and yield a `ProgramResult` for each as soon
+    as its chunk is done: in the order of `programs` when `ordered`, and
+    chunk by chunk in the order in which the chunks finish otherwise.
+    `limits` (`max_steps`, `max_state_entries` and `timeout`, as for
+    `run_stimpl`) apply to every program on its own.
+
+    Programs are read from `programs` (and serialized) only as workers
+    need them. A program that cannot be serialized gets a result with the
+    error that serializing it raised.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        # Enough chunks to keep every worker busy until the end of the
+        # run, but no more than necessary.
+        chunksize = max(1, len(programs) // (workers * 4)) if isinstance(programs, Sized) \
+            else DEFAULT_CHUNKSIZE
+    chunks = chunks_of(programs, chunksize)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The chunks that have been submitted (in the order in which they
+        # were), with the results of their programs that could not be.
+        in_flight: Dict[Future, List[ProgramResult]] = {}
+
+        def submit() -> None:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                serialized, failed = serialize_chunk(chunk)
+                in_flight[executor.submit(run_chunk, serialized, engine, limits)] = failed
+
+        try:
+            for _ in range(workers * CHUNKS_PER_WORKER):
+                submit()
+            while in_flight:
+                done = [next(iter(in_flight))] if ordered else \
+                    wait(in_flight, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    results = future.result() + in_flight.pop(future)
+                    submit()
+                    yield from sorted(results, key=lambda result: result.index)
+        finally:
+            # Do not run what is left when the caller stops early.
+            for future in in_flight:
+                future.cancel()
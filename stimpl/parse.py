@@ -0,0 +1,331 @@
+import ast
+import io
+import re
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+
+from stimpl.expression import *
+from stimpl.errors import *
+
+"""
+Parsing
+
+STIMPL programs are written down as the (Python) expressions that build
+their trees:
+
+    Program(Assign(Variable("four"), Add(IntLiteral(2), IntLiteral(2))))
+
+`parse` and `parse_file` read that syntax without handing it to Python's
+`eval`: a tokenizer splits the text into names, literals and punctuation
+and a parser builds the nodes of `stimpl.expression` directly. Neither
+recurses (the parser keeps the calls that are still open on a stack of
+its own), so there is no limit to how deeply a program may be nested, and
+nothing but node constructors can ever be called. `parse_file` reads its
+input a chunk at a time, so the source never has to fit in memory.
+
+Literals are written as in Python: integers (in any base), floating-point
+numbers, strings (including raw and triple-quoted strings and implicit
+concatenation) and `True`, `False` and `None`. Whitespace, backslash line
+continuations, trailing commas and `#` comments are allowed anywhere
+between tokens.
+
+Malformed input raises an `InterpParseError` that gives the line and
+column (both counted from 1) of the offending token.
+"""
+
+CHUNK_SIZE = 1 << 16
+
+# The kinds of tokens, which are also the numbers of their groups in
+# `TOKEN`. A call is the name of a node constructor together with its
+# opening parenthesis; an error is a character that starts no token; the
+# end is the end of the text (after any trailing space). Space can be
+# split into its atoms in only one way, so that backtracking over a long
+# run of it stays linear.
+CALL = 1
+STRING = 2
+NAME = 3
+NUMBER = 4
+PUNCTUATION = 5
+ERROR = 6
+END = 7
+
+TOKEN = re.compile(r"""
+    (?:[ \t\r\n\f]|\\\r?\n|\#[^\r\n]*(?![^\r\n]))*
+    (?:
+        (?P<call>[A-Za-z_][A-Za-z_0-9]*)(?:[ \t\r\n\f]|\\\r?\n|\#[^\r\n]*(?![^\r\n]))*\(
+      | (?P<string>[rRuU]?(?:'''(?:[^'\\]|\\[\s\S]|'(?!''))*'''
+                          |\"\"\"(?:[^"\\]|\\[\s\S]|"(?!""))*\"\"\"
+                          |'(?!'')(?:[^'\\\r\n]|\\[\s\S])*'
+                          |"(?!"")(?:[^"\\\r\n]|\\[\s\S])*"))
+      | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+      | (?P<number>0[xX](?:_?[0-9a-fA-F])+|0[oO](?:_?[0-7])+|0[bB](?:_?[01])+
+                  |(?:\d(?:_?\d)*(?:\.(?:\d(?:_?\d)*)?)?|\.\d(?:_?\d)*)(?:[eE][+-]?\d(?:_?\d)*)?)
+      | (?P<punctuation>[(),+\-])
+      | (?P<error>[\s\S])
+      | (?P<end>\Z)
+    )
+""", re.VERBOSE)
+
+STARTS = "'\"\\"
+
+SPACE = re.compile(r"(?:[ \t\r\n\f]|\\\r?\n|\#[^\r\n]*(?![^\r\n]))*")
+
+CONSTRUCTORS = {node_class.__name__: node_class for node_class in (
+    Ren, IntLiteral, FloatingPointLiteral, StringLiteral, BooleanLiteral,
+    Variable, Assign, Print, Not, And, Or, Lt, Lte, Gt, Gte, Eq, Ne, Add,
+    Subtract, Multiply, Divide, Program, Sequence, If, While)}
+
+CONSTANTS = {"True": True, "False": False, "None": None}
+
+# A token is its kind, its text and the line and column where it starts.
+Token = Tuple[int, str, int, int]
+
+
+def tokenize(source: Union[str, TextIO], chunk_size: int = CHUNK_SIZE) -> Iterator[Token]:
+    """
+    The tokens of `source` (a string or a text file, which is read
+    `chunk_size` characters at a time).
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    match_space = SPACE.match
+    buffer = ""
+    # Where `buffer` starts in the source.
+    base = 0
+    position = 0
+    at_end = False
+    # The line that `position` is on and where that line starts in the
+    # source.
+    line, line_start = 1, 0
+
+    while not at_end:
+        chunk = source.read(chunk_size)
+        at_end = not chunk
+        base += position
+        buffer = buffer[position:] + chunk
+        position = 0
+        size = len(buffer)
+
+        for match in TOKEN.finditer(buffer):
+            token_kind = match.lastindex
+            end = match.end()
+            if not at_end and (end == size or
+                               token_kind == ERROR and buffer[end - 1] in STARTS or
+                               token_kind == NAME and match_space(buffer, end).end() == size):
+                # The token might go on in the next chunk (a stray quote
+                # or backslash here might start a string or a line
+                # continuation that ends there).
+                break
+            if token_kind == END:
+                return
+            start = match.start(token_kind)
+            if start != position and buffer.find("\n", position, start) >= 0:
+                line, line_start = advance(buffer, base, position, start, line, line_start)
+            if token_kind == ERROR:
+                raise InterpParseError(f"Unexpected character {buffer[start]!r}",
+                                       line, base + start - line_start + 1)
+            yield (token_kind, match.group(token_kind), line, base + start - line_start + 1)
+            if token_kind <= STRING and buffer.find("\n", start, end) >= 0:
+                line, line_start = advance(buffer, base, start, end, line, line_start)
+            position = end
+
+
+def advance(buffer: str, base: int, start: int, end: int, line: int, line_start: int) -> Tuple[int, int]:
+    """
+    The line after `buffer[start:end]`, which starts on `line`, and where
+    that line starts in the source.
+    """
+    newlines = buffer.count("\n", start, end)
+    if newlines:
+        return (line + newlines, base + buffer.rfind("\n", start, end) + 1)
+    return (line, line_start)
+
+
+def literal(kind: int, text: str, line: int, column: int) -> Any:
+    try:
+        if kind == STRING:
+            quotes = 3 if text[:3] in ("\"\"\"", "'''") else 1
+            if "\\" not in text and text[0] in "\"'":
+                return text[quotes:-quotes]
+            return ast.literal_eval(text)
+        if text[:2] in ("0x", "0X", "0o", "0O", "0b", "0B") or not any(c in text for c in ".eE"):
+            return int(text, 0)
+        return float(text)
+    except (ValueError, SyntaxError):
+        raise InterpParseError(f"Malformed literal {text}", line, column) from None
+
+
+class Call(object):
+    """
+    A call to a node constructor whose closing parenthesis has not been
+    read yet.
+    """
+    __slots__ = ("constructor", "arguments", "positions", "line", "column")
+
+    def __init__(self, constructor: type, line: int, column: int) -> None:
+        self.constructor = constructor
+        self.arguments: List[Any] = []
+        # The line and column where each argument starts.
+        self.positions: List[Tuple[int, int]] = []
+        self.line = line
+        self.column = column
+
+
+def construct(call: Call) -> Expr:
+    try:
+        expression = call.constructor(*call.arguments)
+    except (TypeError, InterpTypeError, InterpSyntaxError) as error:
+        raise InterpParseError(f"Malformed {call.constructor.__name__}: {error}",
+                               call.line, call.column) from None
+    # Literals check their own arguments; variables are named by strings
+    # and every other node is made of expressions.
+    if not isinstance(expression, Literal):
+        expected, description = (str, "a string") if call.constructor is Variable else (Expr, "an expression")
+        for argument, (line, column) in zip(call.arguments, call.positions):
+            if not isinstance(argument, expected):
+                raise InterpParseError(f"Malformed {call.constructor.__name__}: expected {description}, "
+                                       f"not {argument!r}", line, column)
+    return expression
+
+
+def parse_tokens(tokens: Iterator[Token]) -> Expr:
+    calls: List[Call] = []
+    result: Optional[Any] = None
+    finished = False
+    # Whether the next token has to start an argument (rather than be a
+    # comma or a closing parenthesis).
+    expecting = True
+    # Whether the last argument was a string literal (that the next
+    # string literal continues).
+    after_string = False
+    line, column = 1, 1
+
+    for kind, text, line, column in tokens:
+        if finished:
+            raise InterpParseError(f"Unexpected {text!r} after the end of the program", line, column)
+
+        if kind == PUNCTUATION and text == ")" and calls:
+            # Closes a call after an argument, right after its opening
+            # parenthesis or after a trailing comma.
+            value = construct(calls.pop())
+        elif not expecting:
+            if kind == PUNCTUATION and text == "," and calls:
+                expecting, after_string = True, False
+                continue
+            if kind == STRING and after_string:
+                calls[-1].arguments[-1] += literal(kind, text, line, column)
+                continue
+            raise InterpParseError(f"Expected ',' or ')' but found {text!r}", line, column)
+        elif kind == CALL:
+            if text not in CONSTRUCTORS:
+                raise InterpParseError(f"Unknown node {text!r}", line, column)
+            calls.append(Call(CONSTRUCTORS[text], line, column))
+            continue
+        elif kind == NAME and text in CONSTANTS:
+            value = CONSTANTS[text]
+        elif kind == NAME:
+            raise InterpParseError(f"Unknown name {text!r}", line, column)
+        elif kind == PUNCTUATION and text in "+-":
+            sign = text
+            kind, text, number_line, number_column = next(tokens, (None, "the end of the input", line, column))
+            if kind != NUMBER:
+                raise InterpParseError(f"Expected a number but found {text!r}", number_line, number_column)
+            value = literal(kind, text, number_line, number_column)
+            if sign == "-":
+                value = -value
+        elif kind == NUMBER or kind == STRING:
+            value = literal(kind, text, line, column)
+        else:
+            raise InterpParseError(f"Unexpected {text!r}", line, column)
+
+        expecting, after_string = False, kind == STRING and type(value) is str
+        if calls:
+            calls[-1].arguments.append(value)
+            calls[-1].positions.append((line, column))
+        else:
+            result, finished = value, True
+
+    if calls:
+        call = calls[-1]
+        raise InterpParseError(f"{call.constructor.__name__} is never closed", call.line, call.column)
+    if not finished:
+        raise InterpParseError("Expected a program", line, column)
+    return result
+
+
+def parse(source: str) -> Expr:
+    """
+    The program written in `source`.
+    """
+    return parse_tokens(tokenize(source))
+
+
+def parse_file(file: Union[str, TextIO], chunk_size: int = CHUNK_SIZE) -> Expr:
+    """
+    The program written in `file` (a path or a text file), which is read
+    `chunk_size` characters at a time.
+    """
+    if isinstance(file, str):
+        with open(file, "r", encoding="utf-8") as source:
+            return parse_tokens(tokenize(source, chunk_size))
+    return parse_tokens(tokenize(file, chunk_size))
+
+
+def unparse(program: Expr) -> str:
+    """
+    The source of `program`, which `parse` reads back.
+    """
+    parts: List[str] = []
+    pending: List[Any] = [program]
+    while pending:
+        expression = pending.pop()
+        if isinstance(expression, str):
+            parts.append(expression)
+            continue
+        expression_kind = kind(expression)
+        if isinstance(expression, Literal):
+            parts.append(f"{expression_kind.__name__}({expression.literal!r})")
+        elif isinstance(expression, Variable):
+            parts.append(f"Variable({expression.variable_name!r})")
+        else:
+            parts.append(f"{expression_kind.__name__}(")
+            pending.append(")")
+            for index, child in enumerate(reversed(children(expression))):
+                if index:
+                    pending.append(", ")
+                pending.append(child)
+    return "".join(parts)
+
+
+"""
+Benchmark
+"""
+
+
+def benchmark(source: str) -> Dict[str, Optional[float]]:
+    """
+    The time (in seconds) that `parse` and Python's `eval` take to read
+    `source` (None for `eval` when it cannot read it, e.g. because the
+    program is nested too deeply).
+    """
+    timings: Dict[str, Optional[float]] = {}
+    start = time.perf_counter()
+    parse(source)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        eval(source, dict(CONSTRUCTORS))
+        timings["eval"] = time.perf_counter() - start
+    except (SyntaxError, RecursionError, MemoryError):
+        timings["eval"] = None
+    return timings
+
+
+def generated_source(statements: int) -> str:
+    return ",\n".join(
+        ["Program(Assign(Variable('total'), FloatingPointLiteral(0.0))"] +
+        [f"Assign(Variable('total'), Add(Variable('total'), "
+         f"Multiply(IntLiteral({index}), FloatingPointLiteral(1.5))))" for index in range(statements)]) + ")"
+
@@ -0,0 +1,263 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from stimpl.expression import *
+from stimpl.types import Type
+from stimpl.runtime import State, state_length
+from stimpl.table import KINDS
+from stimpl.iterative import VISIT, EXIT, PHASE_BITS, UNHANDLED, HANDLERS, FINISHERS, \
+    Image, Machine, finish_assign, handler_table, loop_while
+
+"""
+Profiling
+
+`run_stimpl(program, profile=True)` runs `program` on a `ProfilingMachine`
+-- the iterative machine of `stimpl.iterative` with its handler tables
+swapped for ones that observe every task before (or after) doing exactly
+what the plain handlers do -- and returns a `ProfileReport` along with
+the usual result:
+
+  - per kind of node (`Add`, `Assign`, `While`, ...): how often nodes of
+    that kind were evaluated and the time spent evaluating them, both
+    cumulative (including the nodes below them) and self (excluding
+    them). Nodes nested in nodes of the same kind count towards the
+    cumulative time of the kind only once.
+  - per node, identified by its path from the root (see `node_paths`): the
+    same counts and times.
+  - per `While` loop: how often it was entered and how many iterations
+    it ran.
+  - the largest number of bindings that the `State` held.
+
+A visited node pushes an exit task (in the phase that the plain machine
+leaves unused) before the tasks that evaluate it, so the exit task runs
+exactly when the node has produced its value, however many tasks that
+took. Times are wall-clock times and include the profiler's own
+overhead, so they are best compared with each other rather than with
+unprofiled runs.
+"""
+
+
+def node_paths(image: Image) -> Tuple[List[str], List[bool]]:
+    """
+    The path of every node of `image` -- the kinds of the nodes from the
+    root down to it, each after the position of the node among the
+    `children` of its parent, like `Program/1:While/1:Sequence/0:Assign`
+    -- and whether it is nested in no node of its own kind.
+    """
+    paths: List[str] = [""] * len(image)
+    outermost: List[bool] = [True] * len(image)
+    # How many nodes of every kind are on the path to the current node.
+    active: Dict[str, int] = {}
+    paths[image.root] = kind_name(image, image.root)
+    pending = [(image.root, False)]
+    while pending:
+        index, leaving = pending.pop()
+        name = kind_name(image, index)
+        if leaving:
+            active[name] -= 1
+            continue
+        outermost[index] = not active.get(name)
+        active[name] = active.get(name, 0) + 1
+        pending.append((index, True))
+        for position, child in child_positions(image, index):
+            paths[child] = f"{paths[index]}/{position}:{kind_name(image, child)}"
+            pending.append((child, False))
+    return paths, outermost
+
+
+def kind_name(image: Image, index: int) -> str:
+    expression_kind = image.kinds[index]
+    return "Unhandled" if expression_kind == UNHANDLED else KINDS[expression_kind].__name__
+
+
+def child_positions(image: Image, index: int) -> List[Tuple[int, int]]:
+    expression_kind = image.kinds[index]
+    if expression_kind == UNHANDLED:
+        return []
+    if KINDS[expression_kind] is Assign:
+        # Position 0 is the variable, which is not evaluated.
+        return [(1, image.arguments[index][1])]
+    if not isinstance(image.arguments[index], tuple) or \
+            KINDS[expression_kind] in (IntLiteral, FloatingPointLiteral, StringLiteral, BooleanLiteral):
+        return []
+    return list(enumerate(image.arguments[index]))
+
+
+class NodeProfile(object):
+    """
+    The counts and times of a node (or of every node of a kind).
+    `iterations` is the number of iterations that a `While` ran.
+    """
+
+    def __init__(self, path: str, kind: str, count: int, cumulative: float,
+                 self_time: float, iterations: Optional[int] = None) -> None:
+        self.path = path
+        self.kind = kind
+        self.count = count
+        self.cumulative = cumulative
+        self.self_time = self_time
+        self.iterations = iterations
+
+    def as_dict(self) -> Dict[str, Any]:
+        profile = {"kind": self.kind, "count": self.count,
+                   "cumulative": self.cumulative, "self": self.self_time}
+        if self.path is not None:
+            profile["path"] = self.path
+        if self.iterations is not None:
+            profile["iterations"] = self.iterations
+        return profile
+
+    def __repr__(self) -> str:
+        return f"NodeProfile({self.path or self.kind}, count={self.count}, " \
+               f"cumulative={self.cumulative:.6f}, self={self.self_time:.6f})"
+
+
+class ProfileReport(object):
+    SORT_KEYS = {"cumulative": lambda profile: profile.cumulative,
+                 "self": lambda profile: profile.self_time,
+                 "count": lambda profile: profile.count}
+
+    def __init__(self, kinds: List[NodeProfile], nodes: List[NodeProfile],
+                 max_state_length: int, total: float) -> None:
+        self.kinds = kinds
+        self.nodes = nodes
+        self.max_state_length = max_state_length
+        self.total = total
+
+    @property
+    def loops(self) -> List[NodeProfile]:
+        return [profile for profile in self.nodes if profile.iterations is not None]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"total": self.total,
+                "max_state_length": self.max_state_length,
+                "kinds": [profile.as_dict() for profile in self.kinds],
+                "nodes": [profile.as_dict() for profile in self.nodes],
+                "loops": [{"path": profile.path, "entries": profile.count,
+                           "iterations": profile.iterations} for profile in self.loops]}
+
+    def to_json(self, **options: Any) -> str:
+        return json.dumps(self.as_dict(), **options)
+
+    def table(self, sort: str = "self", limit: Optional[int] = None, nodes: bool = True) -> str:
+        """
+        The profile of every node (of every kind, unless `nodes`) as a text
+        table, sorted by `sort` ("self", "cumulative" or "count"), largest
+        first, and cut off after `limit` rows.
+        """
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Cannot sort a profile by {sort}.")
+        profiles = sorted(self.nodes if nodes else self.kinds, key=self.SORT_KEYS[sort], reverse=True)
+        if limit is not None:
+            profiles = profiles[:limit]
+        rows = [(f"{profile.count}", f"{profile.cumulative:.6f}", f"{profile.self_time:.6f}",
+                 "" if profile.iterations is None else f"{profile.iterations}",
+                 profile.path if nodes else profile.kind) for profile in profiles]
+        header = ("count", "cumulative", "self", "iterations", "node" if nodes else "kind")
+        widths = [max(len(row[column]) for row in rows + [header]) for column in range(4)]
+        lines = [f"total {self.total:.6f}s, at most {self.max_state_length} bindings"]
+        for row in [header] + rows:
+            lines.append("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) + "  " + row[4])
+        return "\n".join(lines)
+
+    def __str__(self) -> str:
+        return self.table()
+
+
+"""
+The profiling machine
+"""
+
+
+class ProfilingMachine(Machine):
+    """
+    A `Machine` that keeps, per node, how often it was evaluated, the time
+    spent evaluating it (cumulative and self) and, for `While`s, how many
+    iterations ran.
+    """
+    __slots__ = ("counts", "cumulative", "self_times", "iterations", "open",
+                 "max_state_length")
+
+    def __init__(self, program: Expr, state: State, image: Image = None) -> None:
+        super().__init__(program, state, image, PROFILING_HANDLERS)
+        size = len(self.image)
+        self.counts = [0] * size
+        self.cumulative = [0.0] * size
+        self.self_times = [0.0] * size
+        self.iterations = [0] * size
+        # The start time of every node that has not produced its value
+        # yet, and the time spent so far in the nodes below it.
+        self.open: List[List[float]] = []
+        self.max_state_length = state_length(state)
+
+    def report(self, total: float) -> ProfileReport:
+        image = self.image
+        paths, outermost = node_paths(image)
+        nodes = []
+        nested = []
+        for index in range(len(image)):
+            if not self.counts[index]:
+                continue
+            name = kind_name(image, index)
+            nodes.append(NodeProfile(paths[index], name, self.counts[index], self.cumulative[index],
+                                     self.self_times[index],
+                                     self.iterations[index] if name == "While" else None))
+            nested.append(not outermost[index])
+
+        # A kind's cumulative time only counts nodes that are not nested
+        # in nodes of the same kind.
+        kinds: Dict[str, NodeProfile] = {}
+        for profile, is_nested in zip(nodes, nested):
+            kind_profile = kinds.get(profile.kind)
+            if kind_profile is None:
+                kind_profile = kinds[profile.kind] = NodeProfile(None, profile.kind, 0, 0.0, 0.0)
+            kind_profile.count += profile.count
+            kind_profile.self_time += profile.self_time
+            if not is_nested:
+                kind_profile.cumulative += profile.cumulative
+        return ProfileReport(list(kinds.values()), nodes, self.max_state_length, total)
+
+
+def profile_visit(machine: ProfilingMachine, index: int) -> None:
+    machine.tasks.append(index << PHASE_BITS | EXIT)
+    machine.open.append([time.perf_counter(), 0.0])
+    HANDLERS[VISIT][machine.image.kinds[index]](machine, index)
+
+
+def profile_exit(machine: ProfilingMachine, index: int) -> None:
+    start, below = machine.open.pop()
+    elapsed = time.perf_counter() - start
+    machine.counts[index] += 1
+    machine.cumulative[index] += elapsed
+    machine.self_times[index] += elapsed - below
+    if machine.open:
+        machine.open[-1][1] += elapsed
+
+
+def profile_assign(machine: ProfilingMachine, index: int) -> None:
+    finish_assign(machine, index)
+    length = state_length(machine.state)
+    if length > machine.max_state_length:
+        machine.max_state_length = length
+
+
+def profile_loop(machine: ProfilingMachine, index: int) -> None:
+    machine.iterations[index] += 1
+    loop_while(machine, index)
+
+
+PROFILING_HANDLERS = (
+    [profile_visit] * (len(KINDS) + 1),
+    handler_table({**FINISHERS, Assign: profile_assign}),
+    handler_table({While: profile_loop}),
+    [profile_exit] * (len(KINDS) + 1),
+)
+
+
+def evaluate_profiled(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State, ProfileReport]:
+    machine = ProfilingMachine(expression, state)
+    start = time.perf_counter()
+    machine.run_within_budget()
+    total = time.perf_counter() - start
+    return machine.result() + (machine.report(total),)
@@ -0,0 +1,183 @@
+from typing import Any, List, Optional
+
+"""
+Ropes
+
+Adding two strings copies both of them, so a loop that builds a string
+by appending to it,
+
+    While(..., Assign(Variable("s"), Add(Variable("s"), StringLiteral("ab"))))
+
+takes time quadratic in the length of the result: every iteration copies
+everything appended so far. (CPython only appends in place to a string
+that nothing else refers to, and a string bound in a `State` is always
+referred to by the `State`.)
+
+Every engine adds strings with `concat`, which returns a plain `str` as
+long as the result is shorter than `ROPE_LENGTH` and a `Rope` otherwise.
+A rope keeps the pieces of a string in a list instead of copying them
+into one, so appending to it takes constant time (amortized). Ropes are
+values like any other -- they never change once made -- but several of
+them share one list of pieces: appending to the rope that ends where the
+list ends adds a piece to the list and returns a new rope that covers
+one more piece, leaving the old one as it was. Only appending to a rope
+that the list has grown past copies (its share of) the list. Strings
+added at the front are kept the same way, in a second list that grows
+(in reverse) as they are prepended.
+
+A rope is turned into a `str` (once, and then kept) when its text is
+needed: when it is compared, printed, hashed or formatted. Ropes never
+leave the engines: `run_stimpl` returns plain strings, in its value and
+in its state, and so do the hooks and output sinks.
+"""
+
+# Below this length, copying a string costs less than appending to a rope.
+ROPE_LENGTH = 1 << 14
+
+
+class Rope(object):
+    __slots__ = ("parts", "count", "front", "front_count", "length", "text")
+
+    # How many ropes have been started from plain strings, so that
+    # `run_stimpl` can tell cheaply whether a run may have made any.
+    started = 0
+
+    def __init__(self, parts: List[str], count: int, length: int,
+                 front: Optional[List[str]] = None, front_count: int = 0) -> None:
+        # The rope is the first `front_count` strings of `front`, in
+        # reverse, followed by the first `count` strings of `parts`; it
+        # may share either list with other ropes.
+        self.parts = parts
+        self.count = count
+        self.front = front
+        self.front_count = front_count
+        self.length = length
+        self.text = None
+
+    def pieces(self) -> List[str]:
+        """
+        The strings that the rope is made of, in order.
+        """
+        parts = self.parts[:self.count]
+        if self.front_count:
+            return self.front[self.front_count - 1::-1] + parts
+        return parts
+
+    def append(self, right: Any) -> 'Rope':
+        parts = self.parts
+        if len(parts) != self.count:
+            # Another rope has already grown the list past this one.
+            parts = parts[:self.count]
+        if type(right) is Rope:
+            parts.extend(right.pieces())
+            return Rope(parts, len(parts), self.length + right.length, self.front, self.front_count)
+        parts.append(right)
+        return Rope(parts, self.count + 1, self.length + len(right), self.front, self.front_count)
+
+    def prepend(self, left: str) -> 'Rope':
+        # Prepended strings go on the end of a list of their own, which
+        # is shared just like `parts`.
+        front = self.front
+        if front is None:
+            front = []
+        elif len(front) != self.front_count:
+            front = front[:self.front_count]
+        front.append(left)
+        return Rope(self.parts, self.count, len(left) + self.length, front, len(front))
+
+    def flatten(self) -> str:
+        text = self.text
+        if text is None:
+            parts = self.parts
+            if self.front_count or len(parts) != self.count:
+                parts = self.pieces()
+            text = self.text = "".join(parts)
+        return text
+
+    def __str__(self) -> str:
+        return self.flatten()
+
+    def __repr__(self) -> str:
+        return repr(self.flatten())
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self.flatten(), format_spec)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __hash__(self) -> int:
+        return hash(self.flatten())
+
+    def __add__(self, right: Any) -> Any:
+        if type(right) is str or type(right) is Rope:
+            return self.append(right)
+        return NotImplemented
+
+    def __radd__(self, left: Any) -> Any:
+        if type(left) is str:
+            return self.prepend(left)
+        return NotImplemented
+
+    def __eq__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() == other
+
+    def __ne__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() != other
+
+    def __lt__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() < other
+
+    def __le__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() <= other
+
+    def __gt__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() > other
+
+    def __ge__(self, other: Any) -> Any:
+        other = comparable(other)
+        return NotImplemented if other is None else self.flatten() >= other
+
+
+def comparable(other: Any) -> Any:
+    if type(other) is str:
+        return other
+    if type(other) is Rope:
+        return other.flatten()
+    return None
+
+
+def concat(left: Any, right: Any) -> Any:
+    """
+    `left + right` for two strings (or ropes).
+    """
+    if type(left) is Rope:
+        return left.append(right)
+    if type(right) is Rope:
+        return right.prepend(left)
+    length = len(left) + len(right)
+    if length < ROPE_LENGTH:
+        return left + right
+    Rope.started += 1
+    return Rope([left, right], 2, length)
+
+
+def flattened(value: Any) -> Any:
+    """
+    `value`, as a `str` if it is a rope.
+    """
+    return value.flatten() if type(value) is Rope else value
+
+
+def add_values(left: Any, right: Any) -> Any:
+    """
+    `left + right` for two numbers or two strings of the same type.
+    """
+    if type(left) is str or type(left) is Rope:
+        return concat(left, right)
+    return left + right
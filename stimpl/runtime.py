@@ -1,19 +1,52 @@
-from typing import Any, Tuple, Optional
+import time
+from contextvars import ContextVar
+from typing import Any, Iterator, Tuple, Optional
 
 from stimpl.expression import *
 from stimpl.types import *
 from stimpl.errors import *
+from stimpl.output import emit, output_to
+from stimpl.hooks import current_hooks, select_hooked_engine
+from stimpl.rope import Rope, concat, flattened
 
 """
 Interpreter State
 """
 
 
+def state_length(state: 'State') -> int:
+    """
+    The number of bindings that `state` holds (shadowed ones included).
+    """
+    length = getattr(state, "length", None)
+    return len(state) if length is None else length
+
+
 class State(object):
+    """
+    A (persistent) linked list of bindings: `set_value` prepends a new
+    binding and leaves the state that it was called on untouched.
+
+    Every assignment adds a binding, even one that shadows an older binding
+    of the same variable, so long-running loops grow the list without
+    bound. `maybe_compact` rebuilds the list with only its live bindings
+    once more than `compaction_limit` bindings (and more bindings than
+    there were live ones at the last compaction) have been added. The
+    rebuilt state has exactly the same values as the old one; the old one
+    simply becomes garbage once nothing refers to it any longer.
+    """
+    __slots__ = ("variable_name", "value", "next_state", "length", "base_length", "live")
+
+    compaction_limit = 1024
+
     def __init__(self, variable_name: str, variable_value: Expr, variable_type: Type, next_state: 'State') -> None:
         self.variable_name = variable_name
         self.value = (variable_value, variable_type)
         self.next_state = next_state
+        self.length = next_state.length + 1
+        self.base_length = next_state.base_length
+        # The number of live bindings, once `live_length` has counted them.
+        self.live = None
 
     def copy(self) -> 'State':
         variable_value, variable_type = self.value
@@ -23,14 +56,75 @@ class State(object):
         return State(variable_name, variable_value, variable_type, self)
 
     def get_value(self, variable_name: str) -> Any:
-        """ TODO: Implement. """
+        state = self
+        while not isinstance(state, EmptyState):
+            if state.variable_name == variable_name:
+                return state.value
+            state = state.next_state
         return None
 
+    def bindings(self) -> Iterator[Tuple[str, Any, Type]]:
+        """
+        The live (unshadowed) bindings in this state, most recent first.
+        """
+        seen = set()
+        state = self
+        while not isinstance(state, EmptyState):
+            if state.variable_name not in seen:
+                seen.add(state.variable_name)
+                variable_value, variable_type = state.value
+                yield (state.variable_name, variable_value, variable_type)
+            state = state.next_state
+
+    def live_length(self) -> int:
+        """
+        The number of live (unshadowed) bindings in this state. Every
+        binding is only counted once: counting again after a few more
+        assignments only looks at the new bindings.
+        """
+        pending = []
+        state = self
+        while state.live is None:
+            pending.append(state)
+            state = state.next_state
+        live = state.live
+        for state in reversed(pending):
+            if state.next_state.get_value(state.variable_name) is None:
+                live += 1
+            state.live = live
+        return live
+
+    def compact(self) -> 'State':
+        live = list(self.bindings())
+        compacted = EmptyState()
+        for variable_name, variable_value, variable_type in reversed(live):
+            compacted = State(variable_name, variable_value,
+                              variable_type, compacted)
+
+        state = compacted
+        while not isinstance(state, EmptyState):
+            state.base_length = compacted.length
+            state.live = state.length
+            state = state.next_state
+        return compacted
+
+    def maybe_compact(self) -> 'State':
+        grown = self.length - self.base_length
+        if grown > self.compaction_limit and grown > self.base_length:
+            return self.compact()
+        return self
+
     def __repr__(self) -> str:
         return f"{self.variable_name}: {self.value}, " + repr(self.next_state)
 
 
 class EmptyState(State):
+    __slots__ = ()
+
+    length = 0
+    base_length = 0
+    live = 0
+
     def __init__(self):
         pass
 
@@ -40,17 +134,103 @@ class EmptyState(State):
     def get_value(self, variable_name: str) -> None:
         return None
 
+    def live_length(self) -> int:
+        return 0
+
+    def compact(self) -> 'EmptyState':
+        return self
+
+    def maybe_compact(self) -> 'EmptyState':
+        return self
+
     def __repr__(self) -> str:
         return ""
 
 
+"""
+Resource limits
+
+A `Budget` limits how many loop iterations a run may take, how many live
+bindings (variables) its `State` may hold and for how long it may run. Only loops
+can make a run take longer than the size of its program, so every engine
+charges its budget on the back-edge of every loop -- after each
+iteration -- rather than for every node: that is where the number of
+iterations and the size of the state are checked, and the clock is only
+read every `CLOCK_INTERVAL` iterations (and, on the iterative machine,
+after every batch of tasks). Shadowed bindings do not count towards
+`max_state_entries`, so that the limit means the same on every engine
+and every `State`: engines that keep a `State` charge it (see
+`State.live_length`), and engines that keep their variables outside of
+one (the generated Python code and the virtual machine) count the
+variables they bind as they go and charge that count.
+
+The budget of the current run is held in a context variable, which the
+engines read once per loop rather than once per iteration; when there is
+none, a loop costs a single comparison per iteration more.
+"""
+
+
+class Budget(object):
+    __slots__ = ("max_steps", "max_state_entries", "timeout", "start", "deadline", "steps", "countdown")
+
+    CLOCK_INTERVAL = 256
+
+    def __init__(self, max_steps: Optional[int] = None, max_state_entries: Optional[int] = None,
+                 timeout: Optional[float] = None) -> None:
+        self.max_steps = max_steps
+        self.max_state_entries = max_state_entries
+        self.timeout = timeout
+        self.start = time.monotonic()
+        self.deadline = None if timeout is None else self.start + timeout
+        self.steps = 0
+        self.countdown = self.CLOCK_INTERVAL
+
+    def affords(self, steps: int) -> bool:
+        """
+        Whether `steps` more iterations stay within the step limit.
+        """
+        return self.max_steps is None or self.steps + steps <= self.max_steps
+
+    def charge(self, state: Optional[State] = None, steps: int = 1, entries: Optional[int] = None) -> None:
+        """
+        Account for `steps` loop iterations that left the run in `state`
+        (if the engine keeps one) with `entries` live bindings (if the
+        engine counts them instead).
+        """
+        self.steps += steps
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exceeded(f"max_steps={self.max_steps}", state, entries)
+        if self.max_state_entries is not None:
+            if entries is None and state is not None:
+                entries = state.live_length()
+            if entries is not None and entries > self.max_state_entries:
+                self.exceeded(f"max_state_entries={self.max_state_entries}", state, entries)
+        if self.deadline is not None:
+            self.countdown -= steps
+            if self.countdown <= 0:
+                self.check_clock(state)
+
+    def check_clock(self, state: Optional[State] = None) -> None:
+        self.countdown = self.CLOCK_INTERVAL
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.exceeded(f"timeout={self.timeout}s", state)
+
+    def exceeded(self, limit: str, state: Optional[State], entries: Optional[int] = None):
+        if entries is None and state is not None:
+            entries = state.live_length()
+        raise InterpResourceError(limit, self.steps, time.monotonic() - self.start, entries)
+
+
+current_budget: ContextVar = ContextVar("current_budget", default=None)
+
+
 """
 Main evaluation logic!
 """
 def evaluate(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State]:
     match expression:
         case Ren():
-            return ((), Unit(), state)
+            return (None, Unit(), state)
 
         case IntLiteral(literal=l):
             return (l, Integer(), state)
@@ -68,17 +248,15 @@ def evaluate(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State
             printable_value, printable_type, new_state = evaluate(
                 to_print, state)
 
-            match printable_type:
-                case Unit():
-                    print("Unit")
-                case _:
-                    print(f"{printable_value}")
+            emit(printable_value, printable_type)
 
             return (printable_value, printable_type, new_state)
 
         case Sequence(exprs=exprs) | Program(exprs=exprs):
-            """ TODO: Implement. """
-            pass
+            result, result_type, new_state = None, Unit(), state
+            for expr in exprs:
+                result, result_type, new_state = evaluate(expr, new_state)
+            return (result, result_type, new_state)
 
         case Variable(variable_name=variable_name):
             value = state.get_value(variable_name)
@@ -117,24 +295,70 @@ def evaluate(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State
             Cannot add {left_type} to {right_type}""")
 
             match left_type:
-                case Integer() | String() | FloatingPoint():
+                case Integer() | FloatingPoint():
                     result = left_result + right_result
+                case String():
+                    result = concat(left_result, right_result)
                 case _:
                     raise InterpTypeError(f"""Cannot add {left_type}s""")
 
             return (result, left_type, new_state)
 
         case Subtract(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            result = 0
+            left_result, left_type, new_state = evaluate(left, state)
+            right_result, right_type, new_state = evaluate(right, new_state)
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Subtract:
+            Cannot subtract {left_type} from {right_type}""")
+
+            match left_type:
+                case Integer() | FloatingPoint():
+                    result = left_result - right_result
+                case _:
+                    raise InterpTypeError(f"""Cannot subtract {left_type}s""")
+
+            return (result, left_type, new_state)
 
         case Multiply(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            result = 0
+            left_result, left_type, new_state = evaluate(left, state)
+            right_result, right_type, new_state = evaluate(right, new_state)
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Multiply:
+            Cannot multiply {left_type} by {right_type}""")
+
+            match left_type:
+                case Integer() | FloatingPoint():
+                    result = left_result * right_result
+                case _:
+                    raise InterpTypeError(f"""Cannot multiply {left_type}s""")
+
+            return (result, left_type, new_state)
 
         case Divide(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            result = 0
+            left_result, left_type, new_state = evaluate(left, state)
+            right_result, right_type, new_state = evaluate(right, new_state)
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Divide:
+            Cannot divide {left_type} by {right_type}""")
+
+            match left_type:
+                case Integer() | FloatingPoint():
+                    if right_result == 0:
+                        raise InterpMathError("Cannot divide by zero.")
+                    if left_type == Integer():
+                        result = left_result // right_result
+                    else:
+                        result = left_result / right_result
+                case _:
+                    raise InterpTypeError(f"""Cannot divide {left_type}s""")
+
+            return (result, left_type, new_state)
 
         case And(left=left, right=right):
             left_value, left_type, new_state = evaluate(left, state)
@@ -153,16 +377,45 @@ def evaluate(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State
             return (result, left_type, new_state)
 
         case Or(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Or:
+            Cannot evaluate {left_type} or {right_type}""")
+            match left_type:
+                case Boolean():
+                    result = left_value or right_value
+                case _:
+                    raise InterpTypeError(
+                        "Cannot perform logical or on non-boolean operands.")
+
+            return (result, left_type, new_state)
 
         case Not(expr=expr):
-            """ TODO: Implement. """
-            pass
+            value, value_type, new_state = evaluate(expr, state)
+
+            match value_type:
+                case Boolean():
+                    result = not value
+                case _:
+                    raise InterpTypeError(
+                        "Cannot perform logical not on non-boolean operand.")
+
+            return (result, value_type, new_state)
 
         case If(condition=condition, true=true, false=false):
-            """ TODO: Implement. """
-            pass
+            condition_value, condition_type, new_state = evaluate(
+                condition, state)
+
+            match condition_type:
+                case Boolean():
+                    if condition_value:
+                        return evaluate(true, new_state)
+                    return evaluate(false, new_state)
+                case _:
+                    raise InterpTypeError(
+                        f"If condition must be Boolean, not {condition_type}.")
 
         case Lt(left=left, right=right):
             left_value, left_type, new_state = evaluate(left, state)
@@ -186,41 +439,260 @@ def evaluate(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State
             return (result, Boolean(), new_state)
 
         case Lte(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            result = None
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Lte:
+            Cannot compare {left_type} and {right_type}""")
+
+            match left_type:
+                case Integer() | Boolean() | String() | FloatingPoint():
+                    result = left_value <= right_value
+                case Unit():
+                    result = True
+                case _:
+                    raise InterpTypeError(
+                        f"Cannot perform <= on {left_type} type.")
+
+            return (result, Boolean(), new_state)
 
         case Gt(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            result = None
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Gt:
+            Cannot compare {left_type} and {right_type}""")
+
+            match left_type:
+                case Integer() | Boolean() | String() | FloatingPoint():
+                    result = left_value > right_value
+                case Unit():
+                    result = False
+                case _:
+                    raise InterpTypeError(
+                        f"Cannot perform > on {left_type} type.")
+
+            return (result, Boolean(), new_state)
 
         case Gte(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            result = None
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Gte:
+            Cannot compare {left_type} and {right_type}""")
+
+            match left_type:
+                case Integer() | Boolean() | String() | FloatingPoint():
+                    result = left_value >= right_value
+                case Unit():
+                    result = True
+                case _:
+                    raise InterpTypeError(
+                        f"Cannot perform >= on {left_type} type.")
+
+            return (result, Boolean(), new_state)
 
         case Eq(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            result = None
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Eq:
+            Cannot compare {left_type} and {right_type}""")
+
+            match left_type:
+                case Integer() | Boolean() | String() | FloatingPoint():
+                    result = left_value == right_value
+                case Unit():
+                    result = True
+                case _:
+                    raise InterpTypeError(
+                        f"Cannot perform == on {left_type} type.")
+
+            return (result, Boolean(), new_state)
 
         case Ne(left=left, right=right):
-            """ TODO: Implement. """
-            pass
+            left_value, left_type, new_state = evaluate(left, state)
+            right_value, right_type, new_state = evaluate(right, new_state)
+
+            result = None
+
+            if left_type != right_type:
+                raise InterpTypeError(f"""Mismatched types for Ne:
+            Cannot compare {left_type} and {right_type}""")
+
+            match left_type:
+                case Integer() | Boolean() | String() | FloatingPoint():
+                    result = left_value != right_value
+                case Unit():
+                    result = False
+                case _:
+                    raise InterpTypeError(
+                        f"Cannot perform != on {left_type} type.")
+
+            return (result, Boolean(), new_state)
 
         case While(condition=condition, body=body):
-            """ TODO: Implement. """
-            pass
+            new_state = state
+            budget = current_budget.get()
+            while True:
+                condition_value, condition_type, new_state = evaluate(
+                    condition, new_state)
+
+                match condition_type:
+                    case Boolean():
+                        pass
+                    case _:
+                        raise InterpTypeError(
+                            f"While condition must be Boolean, not {condition_type}.")
+
+                if not condition_value:
+                    break
+                _, _, new_state = evaluate(body, new_state)
+                new_state = new_state.maybe_compact()
+                if budget is not None:
+                    budget.charge(new_state)
+
+            return (False, Boolean(), new_state)
 
         case _:
             raise InterpSyntaxError("Unhandled!")
     pass
 
 
-def run_stimpl(program, debug=False):
-    state = EmptyState()
-    program_value, program_type, program_state = evaluate(program, state)
+def select_engine(engine: str):
+    match engine:
+        case "tree":
+            return evaluate
+        case "closure":
+            from stimpl.compile import evaluate_compiled
+            return evaluate_compiled
+        case "python":
+            from stimpl.codegen import evaluate_generated
+            return evaluate_generated
+        case "vm":
+            from stimpl.vm import evaluate_vm
+            return evaluate_vm
+        case "iterative":
+            from stimpl.iterative import evaluate_iterative
+            return evaluate_iterative
+        case _:
+            raise ValueError(f"Unknown STIMPL engine: {engine}")
+
+
+def flattened_state(state: State) -> State:
+    """
+    `state` with every live binding to a rope (see `stimpl.rope`) bound
+    to the string that it stands for instead.
+    """
+    if type(state) is State:
+        # A rope and its string are the same value, so rather than
+        # shadowing the ropes, the bindings down to the last live one are
+        # copied with strings in their place and the rest is shared. The
+        # state itself is left alone: others may hold it.
+        seen = set()
+        copied = []
+        last = 0
+        binding = state
+        while not isinstance(binding, EmptyState):
+            live_rope = binding.variable_name not in seen and type(binding.value[0]) is Rope
+            seen.add(binding.variable_name)
+            copied.append((binding, live_rope))
+            if live_rope:
+                last = len(copied)
+            binding = binding.next_state
+        if not last:
+            return state
+        rebuilt = copied[last - 1][0].next_state
+        for binding, live_rope in reversed(copied[:last]):
+            variable_value, variable_type = binding.value
+            rebuilt = State(binding.variable_name, variable_value.flatten() if live_rope else variable_value,
+                            variable_type, rebuilt)
+            rebuilt.base_length = binding.base_length
+        return rebuilt
+    ropes = [(variable_name, variable_value, variable_type)
+             for variable_name, variable_value, variable_type in state.bindings()
+             if type(variable_value) is Rope]
+    for variable_name, variable_value, variable_type in ropes:
+        state = state.set_value(variable_name, variable_value.flatten(), variable_type)
+    return state
+
+
+def run_stimpl(program, debug=False, engine="tree", state=None, optimized=False, output=None,
+               profile=False, hooks=None, max_steps=None, max_state_entries=None, timeout=None):
+    """
+    Run `program` with `engine` starting from `state` (an `EmptyState`
+    unless another initial state -- or another `State` implementation,
+    like `stimpl.hamt.PersistentState` -- is given). When `optimized`,
+    run the `stimpl.optimize`d version of `program` instead. What the
+    program prints goes to the `output` sink (see `stimpl.output`), if one
+    is given, and to the current sink otherwise.
+
+    When `profile`, run `program` on the profiling machine of
+    `stimpl.profile` and return its `ProfileReport` after the value, type
+    and state.
+
+    `hooks` (by default, the current hooks, if any; see `stimpl.hooks`)
+    are called as `program` runs. Without any callbacks, they cost
+    nothing. The profiling machine calls no hooks: a run cannot both be
+    profiled and have hooks (or another `engine`), and asking for both
+    raises a `ValueError`.
+
+    `max_steps` (loop iterations), `max_state_entries` (live bindings in
+    the `State`) and `timeout` (seconds) limit the run (see `Budget`); going
+    over any of them raises an `InterpResourceError`.
+    """
+    if state is None:
+        state = EmptyState()
+    if optimized:
+        from stimpl.optimize import optimize_program
+        program = optimize_program(program)
+    if hooks is None:
+        hooks = current_hooks.get()
+    if profile:
+        if hooks:
+            raise ValueError("Cannot call hooks while profiling.")
+        if engine != "tree":
+            raise ValueError(f"Cannot profile on the {engine} engine: profiling has its own machine.")
+        from stimpl.profile import evaluate_profiled
+        evaluate_program = evaluate_profiled
+    else:
+        evaluate_program = select_engine(engine)
+        if hooks:
+            evaluate_program = select_hooked_engine(engine, hooks)
+    budget = None
+    if max_steps is not None or max_state_entries is not None or timeout is not None:
+        budget = Budget(max_steps, max_state_entries, timeout)
+    budget_token = current_budget.set(budget)
+    ropes_started = Rope.started
+    try:
+        if output is None:
+            result = evaluate_program(program, state)
+        else:
+            with output_to(output):
+                result = evaluate_program(program, state)
+    finally:
+        current_budget.reset(budget_token)
+    program_value, program_type, program_state = result[:3]
+    if Rope.started != ropes_started:
+        program_value, program_state = flattened(program_value), flattened_state(program_state)
 
     if debug:
         print(f"program: {program}")
         print(f"final_value: ({program_value}, {program_type})")
         print(f"final_state: {program_state}")
 
+    if profile:
+        return program_value, program_type, program_state, result[3]
     return program_value, program_type, program_state
@@ -0,0 +1,192 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import Any, BinaryIO, Dict, List, Union
+
+from stimpl.expression import Expr
+from stimpl.table import ProgramTable, TableBuilder
+
+"""
+Serialization
+
+`dump` writes a program in a compact, versioned binary format and `load`
+reads it back. The format is a `ProgramTable` laid out on disk:
+
+    header      magic, format version, and the number of nodes, operands
+                and pool entries
+    kinds       one byte per node
+    first       one little-endian int32 per node, plus one
+    operands    one little-endian int32 per operand
+    offsets     one little-endian uint64 per pool entry: where the entry
+                starts in the pool
+    pool        the literal values and variable names, each a tag byte
+                followed by its encoding
+
+Every section starts at a multiple of eight bytes. Kinds are indices into
+`stimpl.table.KINDS`, so changing `KINDS` means a new format version.
+
+`load` maps the file into memory instead of reading it and hands back a
+view of the program's root (see `stimpl.table`). Nothing is decoded
+until it is used: a view decodes its children when they are first read
+and a pool entry is decoded when its literal or name is first read. So
+loading even a very large program takes next to no time, and running it
+only ever decodes the parts of it that the run reaches.
+"""
+
+MAGIC = b"STIMPL\x00\x00"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<8sHHIQQQ")
+
+INTEGER_TAG = b"i"
+FLOAT_TAG = b"f"
+STRING_TAG = b"s"
+BOOLEAN_TAG = b"b"
+
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def encode_entry(value: Any) -> bytes:
+    if type(value) is bool:
+        return BOOLEAN_TAG + (b"\x01" if value else b"\x00")
+    if type(value) is int:
+        length = (value.bit_length() + 8) // 8
+        return INTEGER_TAG + struct.pack("<I", length) + value.to_bytes(length, "little", signed=True)
+    if type(value) is float:
+        return FLOAT_TAG + struct.pack("<d", value)
+    if type(value) is str:
+        encoded = value.encode("utf-8", "surrogatepass")
+        return STRING_TAG + struct.pack("<I", len(encoded)) + encoded
+    raise ValueError(f"Cannot serialize a literal of type {type(value).__name__}.")
+
+
+def decode_entry(buffer: memoryview, offset: int) -> Any:
+    tag = bytes(buffer[offset:offset + 1])
+    offset += 1
+    if tag == BOOLEAN_TAG:
+        return buffer[offset] != 0
+    if tag == FLOAT_TAG:
+        return struct.unpack_from("<d", buffer, offset)[0]
+    (length,) = struct.unpack_from("<I", buffer, offset)
+    offset += 4
+    if tag == INTEGER_TAG:
+        return int.from_bytes(buffer[offset:offset + length], "little", signed=True)
+    if tag == STRING_TAG:
+        return str(buffer[offset:offset + length], "utf-8", "surrogatepass")
+    raise ValueError(f"Unknown pool entry tag {tag!r}.")
+
+
+def little_endian(column: array) -> bytes:
+    if not LITTLE_ENDIAN:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def dumps(program: Expr) -> bytes:
+    table = TableBuilder().build(program)
+    entries = [encode_entry(value) for value in table.pool]
+    offsets = array("Q")
+    position = 0
+    for entry in entries:
+        offsets.append(position)
+        position += len(entry)
+
+    sections = [table.kinds.tobytes(), little_endian(table.first),
+                little_endian(table.operands), little_endian(offsets), b"".join(entries)]
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0,
+                         len(table.kinds), len(table.operands), len(table.pool))]
+    size = HEADER.size
+    for section in sections:
+        padding = aligned(size) - size
+        parts.append(b"\x00" * padding)
+        parts.append(section)
+        size += padding + len(section)
+    return b"".join(parts)
+
+
+def dump(program: Expr, file: Union[str, BinaryIO]) -> None:
+    """
+    Write `program` to `file` (a path or a binary file object).
+    """
+    data = dumps(program)
+    if isinstance(file, str):
+        with open(file, "wb") as output:
+            output.write(data)
+    else:
+        file.write(data)
+
+
+class Pool(object):
+    """
+    The pool of a serialized program, decoded an entry at a time.
+    """
+
+    def __init__(self, buffer: memoryview, offsets: Any, start: int) -> None:
+        self.buffer = buffer
+        self.offsets = offsets
+        self.start = start
+        self.decoded: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> Any:
+        decoded = self.decoded
+        if index not in decoded:
+            decoded[index] = decode_entry(self.buffer, self.start + self.offsets[index])
+        return decoded[index]
+
+
+def column(buffer: memoryview, offset: int, typecode: str, count: int) -> Any:
+    itemsize = array(typecode).itemsize
+    section = buffer[offset:offset + count * itemsize]
+    if LITTLE_ENDIAN:
+        return section.cast(typecode)
+    swapped = array(typecode, section.tobytes())
+    swapped.byteswap()
+    return swapped
+
+
+def read_table(buffer: Union[bytes, memoryview, mmap.mmap]) -> ProgramTable:
+    """
+    The `ProgramTable` serialized in `buffer`, backed by `buffer` itself.
+    """
+    buffer = memoryview(buffer).cast("B")
+    if len(buffer) < HEADER.size:
+        raise ValueError("Not a serialized STIMPL program.")
+    magic, version, _, _, nodes, operands, entries = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a serialized STIMPL program.")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported STIMPL program format version {version}.")
+
+    offset = aligned(HEADER.size)
+    kinds = column(buffer, offset, "B", nodes)
+    offset = aligned(offset + nodes)
+    first = column(buffer, offset, "i", nodes + 1)
+    offset = aligned(offset + (nodes + 1) * 4)
+    operand_column = column(buffer, offset, "i", operands)
+    offset = aligned(offset + operands * 4)
+    offsets = column(buffer, offset, "Q", entries)
+    offset = aligned(offset + entries * 8)
+    return ProgramTable(kinds, first, operand_column, Pool(buffer, offsets, offset))
+
+
+def loads(data: bytes) -> Expr:
+    return read_table(data).expr()
+
+
+def load(path: str) -> Expr:
+    """
+    The program serialized in the file at `path`, decoded lazily from a
+    memory map of the file.
+    """
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return read_table(mapped).expr()
@@ -0,0 +1,216 @@
+import marshal
+import os
+import threading
+from typing import Any, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import Expr
+from stimpl.types import *
+from stimpl.hamt import PersistentState
+from stimpl.iterative import HANDLERS, Machine
+from stimpl.output import current_output
+from stimpl.rope import flattened
+from stimpl.runtime import EmptyState, State, flattened_state
+from stimpl.serialize import dumps, loads
+
+"""
+Snapshots
+
+The iterative machine of `stimpl.iterative` keeps everything that a
+running program has left to do in three places: its task stack (which
+node it is at, and the `Sequence`s, `If`s and `While`s waiting on it),
+its value stack (the operands evaluated so far) and its state. Between
+two calls of `Machine.run(steps)` those are all there is, so `snapshot`
+can capture a running program and `resume` can carry on with it later --
+in another process, after a restart -- exactly where it stopped.
+
+A snapshot is a `marshal`ed tuple:
+
+    magic, format version
+    program     the program, in the format of `stimpl.serialize`
+    tasks       the task stack (tasks are indices into the image of the
+                program, which loading the program rebuilds identically)
+    values      the value stack, as (value, type code) pairs
+    state       the kind of `State` (linked or persistent) and its live
+                bindings, as (name, value, type code) triples
+
+Types are coded by their position in `SNAPSHOT_TYPES`, so changing it
+means a new format version. Ropes are written as the strings they stand
+for. The serialized program is cached per program, so only the first
+snapshot of a run pays for it.
+
+`SnapshotWriter` writes snapshots to a file from a thread of its own, so
+a running program only ever waits for a snapshot to be taken, not for it
+to be written; `run_with_snapshots` runs a program to the end, writing a
+snapshot every `every` tasks, and resumes from the snapshot it finds
+when it starts.
+"""
+
+SNAPSHOT_MAGIC = b"STIMPLSN"
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_TYPES = (Unit(), Integer(), FloatingPoint(), String(), Boolean())
+TYPE_CODES = {id(value_type): code for code, value_type in enumerate(SNAPSHOT_TYPES)}
+
+LINKED_STATE = 0
+PERSISTENT_STATE = 1
+
+serialized_programs: 'WeakKeyDictionary[Expr, bytes]' = WeakKeyDictionary()
+
+
+def serialized(program: Expr) -> bytes:
+    data = serialized_programs.get(program)
+    if data is None:
+        data = serialized_programs[program] = dumps(program)
+    return data
+
+
+def type_code(value_type: Type) -> int:
+    code = TYPE_CODES.get(id(value_type))
+    if code is None:
+        raise ValueError(f"Cannot snapshot a value of type {value_type}.")
+    return code
+
+
+def snapshot(machine: Machine) -> bytes:
+    """
+    Everything that `resume` needs to carry on running `machine`.
+    """
+    if machine.handlers is not HANDLERS:
+        raise ValueError("Only plain machines can be snapshot.")
+    if machine.program is None:
+        raise ValueError("Cannot snapshot a machine without its program.")
+    state = machine.state
+    if isinstance(state, PersistentState):
+        state_kind = PERSISTENT_STATE
+    elif type(state) is State or type(state) is EmptyState:
+        state_kind = LINKED_STATE
+    else:
+        raise ValueError(f"Cannot snapshot a {type(state).__name__}.")
+
+    values = [(flattened(value), type_code(value_type)) for value, value_type in machine.values]
+    bindings = [(variable_name, flattened(variable_value), type_code(variable_type))
+                for variable_name, variable_value, variable_type in state.bindings()]
+    return marshal.dumps((SNAPSHOT_MAGIC, SNAPSHOT_VERSION, serialized(machine.program),
+                          machine.tasks, values, state_kind, bindings), 4)
+
+
+def resume(data: bytes, program: Optional[Expr] = None) -> Machine:
+    """
+    A machine that carries on from where the machine that `data` is a
+    snapshot of stopped. When `program` is given, the snapshot has to be
+    one of it (and the machine runs `program` itself rather than the
+    copy in the snapshot).
+    """
+    try:
+        magic, version, program_data, tasks, values, state_kind, bindings = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        raise ValueError("Not a STIMPL snapshot.") from None
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a STIMPL snapshot.")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported STIMPL snapshot version {version}.")
+    if program is not None and serialized(program) != bytes(program_data):
+        raise ValueError("The snapshot is of another program.")
+
+    state = PersistentState() if state_kind == PERSISTENT_STATE else EmptyState()
+    # Bindings are listed most recent first.
+    for variable_name, variable_value, code in reversed(bindings):
+        state = state.set_value(variable_name, variable_value, SNAPSHOT_TYPES[code])
+
+    machine = Machine(loads(program_data) if program is None else program, state)
+    machine.tasks[:] = tasks
+    machine.values[:] = [(value, SNAPSHOT_TYPES[code]) for value, code in values]
+    return machine
+
+
+def write_snapshot(data: bytes, path: str) -> None:
+    # Written next to `path` and then renamed over it, so that `path`
+    # always holds a whole snapshot.
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str, program: Optional[Expr] = None) -> Machine:
+    with open(path, "rb") as file:
+        return resume(file.read(), program)
+
+
+class SnapshotWriter(object):
+    """
+    Writes snapshots to `path` from a background thread. When snapshots
+    come faster than they can be written, only the latest one is written.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.pending: Optional[bytes] = None
+        self.error: Optional[BaseException] = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.write_pending, daemon=True)
+        self.thread.start()
+
+    def write(self, data: bytes) -> None:
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.pending = data
+            self.condition.notify()
+
+    def write_pending(self) -> None:
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                data, self.pending = self.pending, None
+            try:
+                write_snapshot(data, self.path)
+            except BaseException as error:
+                with self.condition:
+                    self.error = error
+                return
+
+    def close(self) -> None:
+        """
+        Wait until the last snapshot has been written.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def run_with_snapshots(program: Expr, path: str, every: int = 1 << 20,
+                       state: Optional[State] = None) -> Tuple[Optional[Any], Type, State]:
+    """
+    Run `program` from `state` on the iterative machine -- or, when `path`
+    holds a snapshot, carry on from it -- writing a snapshot to `path`
+    after every `every` tasks. The snapshot is removed once the program
+    has finished.
+    """
+    if os.path.exists(path):
+        machine = read_snapshot(path, program)
+    else:
+        machine = Machine(program, EmptyState() if state is None else state)
+    writer = SnapshotWriter(path)
+    try:
+        while not machine.run(every):
+            # What was printed before the snapshot must not be lost if
+            # the run is cut short after it.
+            current_output.get().flush()
+            writer.write(snapshot(machine))
+    finally:
+        writer.close()
+    if os.path.exists(path):
+        os.remove(path)
+    value, value_type, final_state = machine.result()
+    return (flattened(value), value_type, flattened_state(final_state))
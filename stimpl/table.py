@@ -0,0 +1,211 @@
+from array import array
+from typing import Any, Dict, List, Sequence as Seq, Tuple
+
+from stimpl.expression import *
+
+"""
+Program tables
+
+A `ProgramTable` stores a whole expression tree as parallel typed arrays
+instead of as one Python object per node:
+
+  - `kinds[i]` is the kind of node `i` (an index into `KINDS`),
+  - `first[i]` and `first[i + 1]` delimit node `i`'s operands in
+    `operands`,
+  - `operands` holds, for each node, the indices of its children or, for
+    literals and variables, the index of its literal value or name in
+    `pool`.
+
+Nodes are stored in post-order, so children always precede their parents
+and the root is the last node.
+
+`ProgramTable.expr` hands back an `Expr` view of any node. A view is an
+instance of (a subclass of) the node's ordinary class -- `isinstance`,
+`match` and therefore `evaluate` treat it exactly like the node itself --
+that decodes its children from the table only when they are first read.
+"""
+
+KINDS = (Ren, IntLiteral, FloatingPointLiteral, StringLiteral, BooleanLiteral,
+         Variable, Assign, Print, Not, And, Or, Lt, Lte, Gt, Gte, Eq, Ne, Add,
+         Subtract, Multiply, Divide, Program, Sequence, If, While)
+
+KIND_INDICES = {kind: index for index, kind in enumerate(KINDS)}
+
+LITERAL_KINDS = (IntLiteral, FloatingPointLiteral,
+                 StringLiteral, BooleanLiteral)
+
+
+def operands_of(expression: Expr, table: 'TableBuilder') -> Tuple[int, ...]:
+    match expression:
+        case Literal(literal=literal):
+            return (table.intern(literal),)
+        case Variable(variable_name=variable_name):
+            return (table.intern(variable_name),)
+        case _:
+            return ()
+
+
+class TableBuilder(object):
+    def __init__(self) -> None:
+        self.kinds = array('B')
+        self.first = array('i', [0])
+        self.operands = array('i')
+        self.pool: List[Any] = []
+        self.pool_indices: Dict[Tuple[type, str], int] = {}
+
+    def intern(self, value: Any) -> int:
+        # repr() keeps values that compare equal but are not the same
+        # (0.0 and -0.0, 1 and True) apart.
+        key = (type(value), repr(value))
+        if key not in self.pool_indices:
+            self.pool_indices[key] = len(self.pool)
+            self.pool.append(value)
+        return self.pool_indices[key]
+
+    def add(self, expression: Expr, child_indices: Seq[int]) -> int:
+        if kind(expression) not in KIND_INDICES:
+            raise InterpSyntaxError(
+                f"Cannot store {kind(expression).__name__} in a program table.")
+        self.kinds.append(KIND_INDICES[kind(expression)])
+        self.operands.extend(operands_of(expression, self))
+        self.operands.extend(child_indices)
+        self.first.append(len(self.operands))
+        return len(self.kinds) - 1
+
+    def build(self, program: Expr) -> 'ProgramTable':
+        # An explicit stack keeps deeply nested programs from exhausting
+        # the Python recursion limit.
+        results: List[int] = []
+        pending = [(program, False)]
+        while pending:
+            expression, expanded = pending.pop()
+            if not expanded:
+                pending.append((expression, True))
+                for child in reversed(children(expression)):
+                    pending.append((child, False))
+                continue
+            count = len(children(expression))
+            child_indices = results[len(results) - count:]
+            del results[len(results) - count:]
+            results.append(self.add(expression, child_indices))
+        return ProgramTable(self.kinds, self.first, self.operands, self.pool)
+
+
+class ProgramTable(object):
+    def __init__(self, kinds: Seq[int], first: Seq[int], operands: Seq[int], pool: Seq[Any]) -> None:
+        self.kinds = kinds
+        self.first = first
+        self.operands = operands
+        self.pool = pool
+
+    @staticmethod
+    def from_expr(program: Expr) -> 'ProgramTable':
+        return TableBuilder().build(program)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @property
+    def root(self) -> int:
+        return len(self.kinds) - 1
+
+    def nbytes(self) -> int:
+        """
+        The size of the table's arrays (not counting its literal pool).
+        """
+        return sum(len(column) * column.itemsize
+                   for column in (self.kinds, self.first, self.operands))
+
+    def kind(self, index: int) -> type:
+        return KINDS[self.kinds[index]]
+
+    def node_operands(self, index: int) -> Seq[int]:
+        return self.operands[self.first[index]:self.first[index + 1]]
+
+    def expr(self, index: int = None) -> Expr:
+        """
+        A view of node `index` (by default, of the root).
+        """
+        if index is None:
+            index = self.root
+        view = object.__new__(VIEWS[self.kinds[index]])
+        view.static_type = None
+        view._table = self
+        view._index = index
+        view._children = None
+        return view
+
+    def to_expr(self, index: int = None) -> Expr:
+        """
+        An ordinary (fully materialized) copy of the subtree at `index`.
+        """
+        if index is None:
+            index = self.root
+        built: Dict[int, Expr] = {}
+        pending = [(index, False)]
+        while pending:
+            current, expanded = pending.pop()
+            kind = self.kind(current)
+            operands = self.node_operands(current)
+            if kind in LITERAL_KINDS:
+                built[current] = kind(self.pool[operands[0]])
+            elif kind is Variable:
+                built[current] = Variable(self.pool[operands[0]])
+            elif not expanded:
+                pending.append((current, True))
+                pending.extend((child, False) for child in operands)
+            else:
+                built[current] = kind(*(built[child] for child in operands))
+        return built[index]
+
+
+"""
+Views
+"""
+
+
+class View(object):
+    __slots__ = ()
+
+    def _child(self, position: int) -> Expr:
+        decoded = self._children
+        if decoded is None:
+            table = self._table
+            decoded = self._children = tuple(
+                table.expr(child) for child in table.node_operands(self._index))
+        return decoded[position]
+
+    def _pooled(self) -> Any:
+        table = self._table
+        return table.pool[table.operands[table.first[self._index]]]
+
+
+def child_property(position: int) -> property:
+    return property(lambda self: self._child(position))
+
+
+def exprs_property() -> property:
+    def exprs(self):
+        if len(self._table.node_operands(self._index)) == 0:
+            return ()
+        self._child(0)
+        return self._children
+    return property(exprs)
+
+
+def make_view(kind: type) -> type:
+    namespace: Dict[str, Any] = {
+        "__slots__": ("_table", "_index", "_children")}
+    if kind in LITERAL_KINDS:
+        namespace["literal"] = property(View._pooled)
+    elif kind is Variable:
+        namespace["variable_name"] = property(View._pooled)
+    elif kind in (Program, Sequence):
+        namespace["exprs"] = exprs_property()
+    else:
+        for position, field in enumerate(kind.__match_args__):
+            namespace[field] = child_property(position)
+    return type(f"{kind.__name__}View", (View, kind), namespace)
+
+
+VIEWS = tuple(make_view(kind) for kind in KINDS)
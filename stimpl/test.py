@@ -23,9 +23,9 @@ def check_equal(expected, actual):
         raise TestingError(expected, actual)
 
 
-def check_program_raises(raise_type, program):
+def check_program_raises(raise_type, program, engine="tree"):
     try:
-        run_stimpl(program)
+        run_stimpl(program, engine=engine)
     except Exception as e:
         # This is supposed to raise something
         # with the same type as `raise_type`.
@@ -47,6 +47,107 @@ def check_run_result(expected, actual):
                            (actual_value, actual_type))
 
 
+def check_engine_agrees(program, engine, variables=()):
+    """
+    Run `program` with the reference (tree-walking) evaluator and with
+    `engine` and make sure that they agree: either both produce the same
+    value, type and bindings for `variables` or both raise the same kind
+    of error.
+    """
+    try:
+        expected = run_stimpl(program)
+    except InterpError as e:
+        check_program_raises(e, program, engine)
+        return
+    actual = run_stimpl(program, engine=engine)
+    check_run_result(expected, actual)
+    for variable in variables:
+        check_equal(expected[2].get_value(variable),
+                    actual[2].get_value(variable))
+
+
+# Every engine that `run_stimpl` can select.
+ENGINES = ("tree", "closure", "python", "vm", "iterative")
+
+
+def engine_test_programs():
+    """
+    A small corpus of programs (paired with the variables whose final
+    values are worth comparing) that exercises every kind of expression.
+    """
+    counter = Program(
+        Assign(Variable("i"), IntLiteral(0)),
+        Assign(Variable("sum"), IntLiteral(0)),
+        While(Lt(Variable("i"), IntLiteral(100)),
+              Sequence(
+            Assign(Variable("sum"), Add(Variable("sum"), Variable("i"))),
+            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))),
+        )),
+    )
+    fibonacci = Program(
+        Assign(Variable("a"), IntLiteral(0)),
+        Assign(Variable("b"), IntLiteral(1)),
+        Assign(Variable("n"), IntLiteral(0)),
+        While(Lte(Variable("n"), IntLiteral(30)),
+              Sequence(
+            Assign(Variable("t"), Add(Variable("a"), Variable("b"))),
+            Assign(Variable("a"), Variable("b")),
+            Assign(Variable("b"), Variable("t")),
+            Assign(Variable("n"), Add(Variable("n"), IntLiteral(1))),
+        )),
+        Variable("a"),
+    )
+    strings = Program(
+        Assign(Variable("s"), StringLiteral("")),
+        Assign(Variable("i"), IntLiteral(0)),
+        While(Ne(Variable("i"), IntLiteral(5)),
+              Sequence(
+            Assign(Variable("s"), Add(Variable("s"), StringLiteral("ab"))),
+            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))),
+        )),
+        Gt(Variable("s"), StringLiteral("abab")),
+    )
+    branches = Program(
+        Assign(Variable("x"), FloatingPointLiteral(7.5)),
+        Assign(Variable("y"), If(Gte(Variable("x"), FloatingPointLiteral(2.0)),
+                                 Divide(Variable("x"), FloatingPointLiteral(2.0)),
+                                 Multiply(Variable("x"), FloatingPointLiteral(2.0)))),
+        Assign(Variable("z"), Divide(IntLiteral(-7), IntLiteral(2))),
+        Assign(Variable("b"), Or(Not(Eq(Ren(), Ren())),
+                                 And(BooleanLiteral(True), Lt(BooleanLiteral(False), BooleanLiteral(True))))),
+        Print(Variable("y")),
+        Print(Ren()),
+        Sequence(),
+    )
+    return [
+        (counter, ("i", "sum")),
+        (fibonacci, ("a", "b", "n", "t")),
+        (strings, ("s", "i")),
+        (branches, ("x", "y", "z", "b")),
+        (Subtract(Assign(Variable("i"), IntLiteral(10)),
+                  Add(Variable("i"), Assign(Variable("j"), IntLiteral(11)))), ("i", "j")),
+        (Program(Assign(Variable("i"), IntLiteral(10)),
+                 Assign(Variable("i"), FloatingPointLiteral(10.0))), ()),
+        (Program(Variable("undefined")), ()),
+        (Divide(IntLiteral(1), Subtract(IntLiteral(1), IntLiteral(1))), ()),
+        (Divide(FloatingPointLiteral(1.0), FloatingPointLiteral(0.0)), ()),
+        (Add(BooleanLiteral(True), BooleanLiteral(True)), ()),
+        (And(IntLiteral(1), BooleanLiteral(True)), ()),
+        (Not(Ren()), ()),
+        (Lt(IntLiteral(1), StringLiteral("1")), ()),
+        (If(IntLiteral(1), Ren(), Ren()), ()),
+        (While(StringLiteral("forever"), Ren()), ()),
+        (Program(Assign(Variable("i"), Ren()),
+                 If(Lte(Variable("i"), Ren()), Variable("i"), Variable("j"))), ("i",)),
+        (While(BooleanLiteral(False), Variable("never")), ()),
+    ]
+
+
+def check_engine(engine):
+    for program, variables in engine_test_programs():
+        check_engine_agrees(program, engine, variables)
+
+
 def run_stimpl_sanity_tests():
     try:
         # Mathematical Expressions (5 pts)
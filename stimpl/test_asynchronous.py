@@ -0,0 +1,77 @@
+import asyncio
+
+from stimpl.asynchronous import run_stimpl_async
+from stimpl.errors import InterpResourceError
+from stimpl.expression import *
+from stimpl.hooks import Hooks
+from stimpl.output import CollectedOutput
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def counting(name, count):
+    return Program(Assign(Variable("i"), IntLiteral(0)),
+                   While(Lt(Variable("i"), IntLiteral(count)),
+                         Sequence(Print(Add(StringLiteral(name), StringLiteral(""))),
+                                  Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                   Variable("i"))
+
+
+def test_run_stimpl_async():
+    # The same results, output and errors as `run_stimpl`.
+    async def compare():
+        for program, _ in engine_test_programs():
+            for yield_every in (1, 5, 1000):
+                expected_output, output = CollectedOutput(), CollectedOutput()
+                try:
+                    expected = run_stimpl(program, output=expected_output)[:2]
+                except Exception as e:
+                    expected = (type(e), str(e))
+                try:
+                    actual = (await run_stimpl_async(program, output=output, yield_every=yield_every))[:2]
+                except Exception as e:
+                    actual = (type(e), str(e))
+                check_equal(expected, actual)
+                check_equal(expected_output.printed, output.printed)
+    asyncio.run(compare())
+
+    # Programs run side by side in one thread, each with its own output
+    # and limits.
+    async def interleave():
+        finished = []
+        outputs = {name: CollectedOutput() for name in "abc"}
+
+        async def run(name, count, **options):
+            result = await run_stimpl_async(counting(name, count), output=outputs[name], yield_every=10, **options)
+            finished.append(name)
+            return result
+
+        results = await asyncio.gather(run("a", 300), run("b", 30), run("c", 10 ** 9, max_steps=200),
+                                       return_exceptions=True)
+        check_equal((300, Integer()), results[0][:2])
+        check_equal((30, Integer()), results[1][:2])
+        check_equal(InterpResourceError, type(results[2]))
+        check_equal(["b", "a"], finished)
+        check_equal((["a"] * 300, ["b"] * 30, 201), (outputs["a"].values, outputs["b"].values,
+                                                    len(outputs["c"].values)))
+    asyncio.run(interleave())
+
+    # A cancelled run stops, and the loop carries on.
+    async def cancel():
+        entered = []
+        hooks = Hooks()
+        hooks.register("back_edge", lambda node: entered.append(node))
+        forever = asyncio.create_task(run_stimpl_async(counting("x", 10 ** 9), output=CollectedOutput(),
+                                                       hooks=hooks, yield_every=100))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        forever.cancel()
+        try:
+            await forever
+            check_equal(asyncio.CancelledError, None)
+        except asyncio.CancelledError:
+            pass
+        check_equal(True, 0 < len(entered) < 100)
+        check_equal((3, Integer()), (await run_stimpl_async(counting("y", 3), output=CollectedOutput()))[:2])
+    asyncio.run(cancel())
@@ -0,0 +1,73 @@
+import io
+from contextlib import redirect_stdout
+
+from stimpl.errors import InterpError, InterpMathError
+from stimpl.expression import *
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import *
+
+
+def run_alone(program, state):
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            value, value_type, state = run_stimpl(program, state=state)
+        return (value, value_type, sorted(state.bindings()), None, output.getvalue())
+    except InterpError as e:
+        return (None, None, None, (type(e), str(e)), output.getvalue())
+
+
+def summarize(result):
+    error = (type(result.error), str(result.error)) if result.error is not None else None
+    bindings = sorted(result.state.bindings()) if result.state is not None else None
+    return (result.value, result.value_type, bindings, error, result.output)
+
+
+def check_batch_agrees(program, states):
+    from stimpl.batch import run_stimpl_batch
+    results = run_stimpl_batch(program, states)
+    check_equal(len(states), len(results))
+    for state, result in zip(states, results):
+        check_equal(run_alone(program, state if state is not None else EmptyState()),
+                    summarize(result))
+    return results
+
+
+def test_batch():
+    import pytest
+    # Batch execution is only available with NumPy.
+    pytest.importorskip("numpy")
+
+    for program, _ in engine_test_programs():
+        check_batch_agrees(program, [None, None])
+
+    # Lanes diverge, print and fail independently of each other.
+    program = Program(
+        Assign(Variable("s"), IntLiteral(0)),
+        While(Lt(Variable("i"), Variable("n")), Sequence(
+            If(Eq(Divide(Variable("i"), IntLiteral(2)), IntLiteral(1)), Print(Variable("i")), Ren()),
+            Assign(Variable("s"), Add(Variable("s"), Divide(IntLiteral(100), Subtract(Variable("i"), IntLiteral(3))))),
+            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+        Variable("s"))
+    states = [EmptyState().set_value("i", 0, Integer()).set_value("n", n, Integer()) for n in range(6)]
+    states += [EmptyState().set_value("i", 0.0, FloatingPoint()).set_value("n", 3.0, FloatingPoint()),
+               EmptyState().set_value("i", 2 ** 62, Integer()).set_value("n", 2 ** 62 + 2, Integer()),
+               EmptyState().set_value("n", 3, Integer())]
+    results = check_batch_agrees(program, states)
+    check_equal(InterpMathError, type(results[4].error))
+    check_equal("2\n3\n", results[4].output)
+    check_equal((-184, Integer()), (results[3].value, results[3].value_type))
+
+    # Integers that outgrow 64 bits become Python integers.
+    program = Program(Assign(Variable("y"), Multiply(Variable("x"), Variable("x"))),
+                      Multiply(Variable("y"), Variable("y")))
+    check_batch_agrees(program, [EmptyState().set_value("x", x, Integer())
+                                 for x in (3, 2 ** 20, 2 ** 40, -2 ** 63)])
+
+    # A variable bound to different types in different lanes.
+    program = Program(If(Variable("c"), Assign(Variable("x"), IntLiteral(1)),
+                         Assign(Variable("x"), StringLiteral("one"))),
+                      Add(Variable("x"), Variable("x")))
+    check_batch_agrees(program, [EmptyState().set_value("c", c, Boolean())
+                                 for c in (True, False, True)])
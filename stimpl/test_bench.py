@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+from stimpl.bench import WORKLOADS, compare, load_baseline, run_suite, save_baseline
+from stimpl.bench.__main__ import main
+from stimpl.compile import accumulations, counted_loop
+from stimpl.expression import While, children
+from stimpl.output import NullOutput
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal
+
+
+def test_bench():
+    # Every workload builds a program that runs, and that every engine
+    # runs all the loops of: none of them has a closed form.
+    for workload in WORKLOADS.values():
+        program = workload.build(3)
+        run_stimpl(program, engine="iterative", output=NullOutput())
+        pending = [program]
+        while pending:
+            expression = pending.pop()
+            if isinstance(expression, While):
+                loop = counted_loop(expression.condition, expression.body)
+                check_equal(True, loop is None or accumulations(loop) is None)
+            pending.extend(children(expression))
+
+    measurements = run_suite(["counted_loop", "deep_nesting"], ["tree", "iterative"], repeat=1, scale=0.01)
+    check_equal(["counted_loop/tree", "counted_loop/iterative", "deep_nesting/iterative"],
+                [measurement.key for measurement in measurements])
+    check_equal(measurements[0].value, measurements[1].value)
+    check_equal(measurements[0].ops, measurements[1].ops)
+    for measurement in measurements:
+        check_equal(True, measurement.ops > 0 and measurement.ops_per_second > 0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "baseline.json")
+        save_baseline(measurements, path)
+        baseline = load_baseline(path)
+        check_equal([], compare(measurements, baseline))
+
+        # Recorded on a machine that runs everything (the calibration
+        # workload included) three times as fast.
+        for measurement in baseline.values():
+            measurement.seconds /= 3
+            measurement.calibration /= 3
+        check_equal([], compare(measurements, baseline))
+        baseline = load_baseline(path)
+
+        # Twice as fast as now, with a different result.
+        baseline["counted_loop/tree"].seconds /= 2
+        baseline["counted_loop/iterative"].value = "0"
+        regressions = compare(measurements, baseline)
+        check_equal(2, len(regressions))
+        check_equal(True, regressions[0].startswith("counted_loop/tree: "))
+        check_equal(True, regressions[1].startswith("counted_loop/iterative: value "))
+        check_equal([], compare(measurements, baseline, threshold=1.0)[1:])
+
+        save_baseline(measurements[:1], path)
+        check_equal(0, main(["--workloads", "fibonacci", "--engines", "closure", "--repeat", "1",
+                             "--scale", "0.01", "--baseline", path]))
@@ -0,0 +1,38 @@
+from stimpl.codegen import dump_source, generate_program
+from stimpl.expression import *
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_engine, check_equal
+from stimpl.types import Integer
+
+
+def test_python_engine():
+    check_engine("python")
+
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(3)),
+                            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))),
+                      Variable("i"))
+    check_equal(generate_program(program), generate_program(program))
+    source = dump_source(program)
+    check_equal(True, "while True:" in source)
+    check_equal(True, "# k0 = 0" in source)
+
+    # Operands are evaluated into temporaries, so an assignment in the
+    # right operand cannot change the value already read on the left.
+    program = Program(Assign(Variable("i"), IntLiteral(1)),
+                      Add(Variable("i"), Assign(Variable("i"), IntLiteral(10))))
+    value, value_type, state = run_stimpl(program, engine="python")
+    check_equal((11, Integer()), (value, value_type))
+    check_equal((10, Integer()), state.get_value("i"))
+
+    # Loops nested deeper than CPython allows still run.
+    program = IntLiteral(0)
+    for _ in range(120):
+        program = While(BooleanLiteral(False), program)
+    check_equal(False, run_stimpl(program, engine="python")[0])
+
+    # So do expressions nested deeper than the code generator can recurse.
+    program = IntLiteral(1)
+    for _ in range(10000):
+        program = Add(program, IntLiteral(1))
+    check_equal((10001, Integer()), run_stimpl(program, engine="python")[:2])
@@ -0,0 +1,63 @@
+from stimpl.compile import compile_program
+from stimpl.expression import *
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.test import check_engine, check_engine_agrees, check_equal
+from stimpl.types import Integer
+
+
+def test_closure_engine():
+    check_engine("closure")
+
+    # Compiling the same program twice hands back the cached closure and
+    # running it again starts from scratch.
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(3)),
+                            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))),
+                      Variable("i"))
+    compiled = compile_program(program)
+    check_equal(compiled, compile_program(program))
+    for _ in range(2):
+        value, value_type, _ = compiled(EmptyState())
+        check_equal((3, Integer()), (value, value_type))
+
+
+def test_counted_loops():
+    def counted(prefix, start=IntLiteral(0), bound=IntLiteral(10), accumulator=IntLiteral(0)):
+        increment = Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))
+        return Program(Assign(Variable("i"), start),
+                       Assign(Variable("s"), accumulator),
+                       While(Lt(Variable("i"), bound), Sequence(*prefix, increment)),
+                       Variable("s"))
+
+    summing = Assign(Variable("s"), Add(Variable("s"), Variable("i")))
+    counting = Assign(Variable("s"), Add(Variable("s"), IntLiteral(3)))
+    programs = [
+        # Closed forms.
+        counted([summing]),
+        counted([counting]),
+        counted([summing], start=IntLiteral(-7), bound=IntLiteral(12)),
+        counted([summing], start=IntLiteral(20)),
+        # Range loops.
+        counted([Print(Variable("i")), summing]),
+        counted([Assign(Variable("s"), Add(Variable("s"), Multiply(Variable("i"), Variable("i"))))]),
+        counted([]),
+        # Loops that only look counted, and counted loops whose
+        # assumptions do not hold when they run.
+        counted([summing, Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))]),
+        counted([summing], accumulator=FloatingPointLiteral(0.0)),
+        counted([summing], start=StringLiteral("0")),
+        counted([Assign(Variable("t"), Add(Variable("t"), Variable("i")))]),
+        Program(Assign(Variable("s"), IntLiteral(0)),
+                While(Lt(Variable("i"), IntLiteral(10)),
+                      Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+    ]
+    for program in programs:
+        check_engine_agrees(program, "closure", ("i", "s", "t"))
+    # `Lte` loops count up to and including their bound.
+    program = Program(Assign(Variable("i"), IntLiteral(1)),
+                      Assign(Variable("s"), IntLiteral(0)),
+                      While(Lte(Variable("i"), IntLiteral(100)),
+                            Sequence(summing, Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Variable("s"))
+    check_engine_agrees(program, "closure", ("i", "s"))
+    check_equal(5050, run_stimpl(program, engine="closure")[0])
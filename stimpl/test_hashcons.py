@@ -0,0 +1,57 @@
+import sys
+
+from stimpl.compile import compile_program
+from stimpl.expression import *
+from stimpl.hashcons import ExprFactory, hash_cons
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+
+
+def test_hash_consing():
+    factory = ExprFactory()
+    condition = factory.make(Lt, Variable("i"), IntLiteral(10))
+    check_equal(True, condition is factory.make(Lt, Variable("i"), IntLiteral(10)))
+    check_equal(True, condition.left is factory.make(Variable, "i"))
+    check_equal(False, factory.make(IntLiteral, 1) is factory.make(BooleanLiteral, True))
+    check_equal(False, factory.make(FloatingPointLiteral, 0.0) == factory.make(FloatingPointLiteral, -0.0))
+
+    # Identical subtrees share one node.
+    increment = Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(10)), Sequence(increment, increment)),
+                      Lt(Variable("i"), IntLiteral(10)))
+    consed = factory.intern(program)
+    check_equal(True, consed.exprs[1].condition is consed.exprs[2])
+    check_equal(True, consed.exprs[1].condition is condition)
+    check_equal(repr(program), repr(consed))
+    check_equal(True, factory.intern(consed) is consed)
+
+    # Nodes hash and compare structurally, even across factories, so
+    # equal programs share cache entries.
+    other = hash_cons(program)
+    check_equal(False, other is consed)
+    check_equal(consed, other)
+    check_equal(hash(consed), hash(other))
+    check_equal(True, consed != hash_cons(Program(IntLiteral(0))))
+    check_equal(True, compile_program(consed) is compile_program(other))
+
+    # Shared programs run exactly like the originals, on every engine.
+    for program, _ in engine_test_programs():
+        consed = factory.intern(program)
+        for engine in ("tree", "closure", "python", "vm", "iterative"):
+            try:
+                expected = run_stimpl(program)[:2]
+            except Exception as e:
+                expected = type(e)
+            try:
+                actual = run_stimpl(consed, engine=engine)[:2]
+            except Exception as e:
+                actual = type(e)
+            check_equal(expected, actual)
+
+    # Neither consing nor comparing recurse.
+    depth = sys.getrecursionlimit() * 2
+    program = IntLiteral(0)
+    for _ in range(depth):
+        program = Add(program, IntLiteral(1))
+    check_equal(hash_cons(program), ExprFactory().intern(program))
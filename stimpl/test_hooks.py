@@ -0,0 +1,91 @@
+from collections import Counter
+
+from stimpl.expression import *
+from stimpl.hooks import Hooks, hooked
+from stimpl.runtime import run_stimpl
+from stimpl.test import ENGINES, check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def recording_hooks(events):
+    hooks = Hooks()
+    hooks.register("enter", lambda node: events.append(("enter", id(node))))
+    hooks.register("exit", lambda node, value, value_type: events.append(("exit", id(node), value)))
+    hooks.register("assign", lambda node, variable_name, value, value_type:
+                   events.append(("assign", variable_name, value)))
+    hooks.register("back_edge", lambda node: events.append(("back_edge", id(node))))
+    hooks.register("branch", lambda node, taken: events.append(("branch", id(node), taken)))
+    return hooks
+
+
+def run_recorded(program, engine):
+    events = []
+    try:
+        result = run_stimpl(program, engine=engine, hooks=recording_hooks(events))[:2]
+    except Exception as e:
+        result = type(e)
+    return result, events
+
+
+def test_hooks():
+    # Every engine calls the hooks in the same order, and hooks do not
+    # change what a program does.
+    for program, _ in engine_test_programs():
+        try:
+            expected = run_stimpl(program)[:2]
+        except Exception as e:
+            expected = type(e)
+        expected_events = run_recorded(program, "iterative")
+        check_equal(expected, expected_events[0])
+        for engine in ENGINES:
+            check_equal(expected_events, run_recorded(program, engine))
+
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      Assign(Variable("odd"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(10)),
+                            Sequence(If(Eq(Subtract(Variable("i"), Multiply(Divide(Variable("i"), IntLiteral(2)),
+                                                                               IntLiteral(2))),
+                                           IntLiteral(1)),
+                                        Assign(Variable("odd"), Add(Variable("odd"), IntLiteral(1))),
+                                        Ren()),
+                                     Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Variable("odd"))
+    for engine in ENGINES:
+        hooks = Hooks()
+        assignments = Counter()
+        iterations = Counter()
+        branches = Counter()
+        hooks.register("assign", lambda node, variable_name, value, value_type:
+                       assignments.update([variable_name]))
+        hooks.register("back_edge", lambda node: iterations.update([type(node).__name__]))
+
+        @hooks.on("branch")
+        def count_branch(node, taken):
+            branches.update([(type(node).__name__, taken)])
+
+        check_equal((5, Integer()), run_stimpl(program, engine=engine, hooks=hooks)[:2])
+        check_equal({"i": 11, "odd": 6}, dict(assignments))
+        check_equal({"While": 10}, dict(iterations))
+        check_equal({("While", True): 10, ("While", False): 1, ("If", True): 5, ("If", False): 5},
+                    dict(branches))
+
+    # The current hooks apply to every run inside a `with` block.
+    events = []
+    with hooked(recording_hooks(events)):
+        run_stimpl(Assign(Variable("x"), IntLiteral(1)), engine="closure")
+    run_stimpl(Assign(Variable("x"), IntLiteral(2)))
+    check_equal([("assign", "x", 1)], [event for event in events if event[0] == "assign"])
+
+    # Hooks without callbacks are not hooks at all, and callbacks can be
+    # removed again.
+    hooks = Hooks()
+    check_equal(False, bool(hooks))
+    callback = hooks.register("enter", lambda node: None)
+    check_equal(True, bool(hooks))
+    hooks.unregister("enter", callback)
+    check_equal(False, bool(hooks))
+    try:
+        hooks.register("leave", lambda node: None)
+        raise Exception("Should have raised ValueError")
+    except ValueError:
+        pass
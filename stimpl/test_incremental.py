@@ -0,0 +1,82 @@
+from stimpl.errors import InterpTypeError
+from stimpl.expression import *
+from stimpl.incremental import IncrementalRunner
+from stimpl.output import CollectedOutput
+from stimpl.runtime import run_stimpl
+from stimpl.test import ENGINES, check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def script(*tail):
+    return Program(Assign(Variable("i"), IntLiteral(0)),
+                   Assign(Variable("s"), IntLiteral(0)),
+                   While(Lt(Variable("i"), IntLiteral(100)),
+                         Sequence(Assign(Variable("s"), Add(Variable("s"), Variable("i"))),
+                                  Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                   Print(Variable("s")),
+                   *tail)
+
+
+def test_incremental_runner():
+    # Incremental runs give exactly what running from scratch gives.
+    for engine in ENGINES:
+        runner = IncrementalRunner(engine)
+        for program, _ in engine_test_programs():
+            for _ in range(2):
+                expected_output, output = CollectedOutput(), CollectedOutput()
+                try:
+                    expected = run_stimpl(program, engine=engine, output=expected_output)[:2]
+                except Exception as e:
+                    expected = type(e)
+                try:
+                    actual = runner.run(program, output=output)[:2]
+                except Exception as e:
+                    actual = type(e)
+                check_equal(expected, actual)
+                check_equal(expected_output.printed, output.printed)
+
+    # Only the changed tail of an edited program runs again, and what the
+    # unchanged prefix printed is printed again.
+    runner = IncrementalRunner()
+    output = CollectedOutput()
+    value, value_type, state = runner.run(script(Add(Variable("s"), IntLiteral(1))), output=output)
+    check_equal((4951, Integer(), [4950]), (value, value_type, output.values))
+    check_equal((0, 5), (runner.reused, runner.evaluated))
+
+    output = CollectedOutput()
+    value, _, state = runner.run(script(Print(Variable("i")), Variable("i")), output=output)
+    check_equal((100, [4950, 100]), (value, output.values))
+    check_equal((4, 2), (runner.reused, runner.evaluated))
+    check_equal((4950, Integer()), state.get_value("s"))
+
+    # Structurally equal programs share checkpoints, however they were
+    # built; an edit early on runs everything after it again.
+    runner.run(script(Print(Variable("i")), Variable("i")), output=CollectedOutput())
+    check_equal((6, 0), (runner.reused, runner.evaluated))
+    edited = script(Variable("i"))
+    edited = Program(Assign(Variable("i"), IntLiteral(50)), *edited.exprs[1:])
+    value = runner.run(edited, output=CollectedOutput())[0]
+    check_equal((100, 0, 5), (value, runner.reused, runner.evaluated))
+
+    # Replayed output can be suppressed.
+    output = CollectedOutput()
+    runner.run(script(Print(StringLiteral("tail"))), output=output, replay_output=False)
+    check_equal((["tail"], 4, 1), (output.values, runner.reused, runner.evaluated))
+
+    # An expression that raises leaves no checkpoint, but the ones before
+    # it are kept.
+    failing = script(Add(Variable("s"), StringLiteral("x")))
+    for _ in range(2):
+        try:
+            runner.run(failing, output=CollectedOutput())
+            check_equal(InterpTypeError, None)
+        except InterpTypeError:
+            pass
+        check_equal((4, 1), (runner.reused, runner.evaluated))
+
+    # The least recently used checkpoints go first.
+    runner = IncrementalRunner(max_checkpoints=3)
+    runner.run(script(), output=CollectedOutput())
+    check_equal(3, len(runner))
+    runner.run(script(), output=CollectedOutput())
+    check_equal((0, 4), (runner.reused, runner.evaluated))
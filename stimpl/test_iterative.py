@@ -0,0 +1,41 @@
+import sys
+
+from stimpl.expression import *
+from stimpl.iterative import Machine
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.test import check_engine, check_equal
+from stimpl.types import Integer
+
+
+def test_iterative_engine():
+    check_engine("iterative")
+
+    # The machine never recurses: neither deeply nested sequences nor long
+    # chains of left-nested operators reach the Python recursion limit.
+    depth = sys.getrecursionlimit() * 5
+    program = Assign(Variable("i"), IntLiteral(0))
+    for _ in range(depth):
+        program = Sequence(program, Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))
+    value, value_type, state = run_stimpl(program, engine="iterative")
+    check_equal((depth, Integer()), (value, value_type))
+    check_equal((depth, Integer()), state.get_value("i"))
+
+    program = IntLiteral(0)
+    for _ in range(depth):
+        program = Add(program, IntLiteral(1))
+    value, value_type, _ = run_stimpl(program, engine="iterative")
+    check_equal((depth, Integer()), (value, value_type))
+
+    # A machine can be run a few steps at a time.
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(10)),
+                            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))),
+                      Variable("i"))
+    machine = Machine(program, EmptyState())
+    runs = 1
+    while not machine.run(7):
+        runs += 1
+    check_equal(True, runs > 1)
+    value, value_type, state = machine.result()
+    check_equal((10, Integer()), (value, value_type))
+    check_equal((10, Integer()), state.get_value("i"))
@@ -0,0 +1,92 @@
+import pickle
+
+from stimpl.errors import InterpResourceError
+from stimpl.expression import *
+from stimpl.hamt import PersistentState
+from stimpl.hooks import Hooks
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.test import ENGINES, check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def limit_error(program, **options):
+    try:
+        run_stimpl(program, **options)
+    except InterpResourceError as error:
+        return error
+    return None
+
+
+def test_resource_limits():
+    forever = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(BooleanLiteral(True),
+                            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))))
+    counting = Program(Assign(Variable("i"), IntLiteral(0)),
+                       While(Lt(Variable("i"), IntLiteral(2000)),
+                             Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))))
+    hooks = Hooks()
+    hooks.register("enter", lambda node: None)
+    for engine in ENGINES:
+        error = limit_error(forever, engine=engine, max_steps=1000)
+        check_equal("max_steps=1000", error.limit)
+        check_equal(1001, error.steps)
+        error = limit_error(forever, engine=engine, timeout=0.05)
+        check_equal("timeout=0.05s", error.limit)
+        check_equal(True, error.elapsed >= 0.05 and error.steps > 0)
+        check_equal(1001, limit_error(forever, engine=engine, hooks=hooks, max_steps=1000).steps)
+    check_equal(1001, limit_error(forever, profile=True, max_steps=1000).steps)
+
+    # Only live bindings count towards max_state_entries, so every engine
+    # (and every State) stops at the same point: a loop that keeps
+    # assigning the same variable never adds to them.
+    for state in (EmptyState(), PersistentState()):
+        for engine in ENGINES:
+            check_equal(None, limit_error(counting, engine=engine, state=state, max_state_entries=50))
+            error = limit_error(forever, engine=engine, state=state, max_state_entries=1, max_steps=1000)
+            check_equal(("max_steps=1000", 1001, 1), (error.limit, error.steps, error.state_entries))
+    crowded = EmptyState()
+    for index in range(100):
+        crowded = crowded.set_value(f"x{index}", index, Integer())
+        crowded = crowded.set_value(f"x{index}", index, Integer())
+    for state in (crowded, PersistentState()):
+        for variable_name, variable_value, variable_type in crowded.bindings():
+            state = state.set_value(variable_name, variable_value, variable_type)
+        for engine in ENGINES:
+            error = limit_error(forever, engine=engine, state=state, max_state_entries=100)
+            check_equal(("max_state_entries=100", 1, 101), (error.limit, error.steps, error.state_entries))
+            error = limit_error(forever, engine=engine, state=state, max_state_entries=101, max_steps=1000)
+            check_equal(("max_steps=1000", 1001), (error.limit, error.steps))
+
+    # Runs within their limits are left alone.
+    for program, _ in engine_test_programs():
+        for engine in ENGINES:
+            try:
+                expected = run_stimpl(program, engine=engine)[:2]
+            except Exception as e:
+                expected = type(e)
+            try:
+                actual = run_stimpl(program, engine=engine, max_steps=10 ** 6, timeout=60)[:2]
+            except Exception as e:
+                actual = type(e)
+            check_equal(expected, actual)
+
+    # A counted loop with a closed form is charged every iteration, and
+    # runs for real when it would not fit.
+    summing = Program(Assign(Variable("i"), IntLiteral(0)),
+                      Assign(Variable("s"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(10000)),
+                            Sequence(Assign(Variable("s"), Add(Variable("s"), Variable("i"))),
+                                     Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Variable("s"))
+    for engine in ENGINES:
+        check_equal((49995000, Integer()), run_stimpl(summing, engine=engine, max_steps=10000)[:2])
+        check_equal(1000, limit_error(summing, engine=engine, max_steps=999).steps)
+
+    # The limits apply to a run, not to the runs nested in its callbacks.
+    nested = Hooks()
+    nested.register("back_edge", lambda node: run_stimpl(summing, engine="tree"))
+    check_equal(11, limit_error(summing, hooks=nested, max_steps=10).steps)
+
+    error = pickle.loads(pickle.dumps(limit_error(forever, engine="tree", state=crowded, max_state_entries=10)))
+    check_equal(("max_state_entries=10", 1, 101), (error.limit, error.steps, error.state_entries))
+    check_equal(True, str(error).startswith("Exceeded max_state_entries=10 after 1 loop iterations in "))
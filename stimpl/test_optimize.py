@@ -0,0 +1,64 @@
+import io
+from contextlib import redirect_stdout
+
+from stimpl.errors import InterpMathError, InterpTypeError
+from stimpl.expression import *
+from stimpl.optimize import optimize, optimize_program
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, check_program_raises, engine_test_programs
+
+
+def run_printing(program, engine="tree", optimized=False):
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            value, value_type, state = run_stimpl(
+                program, engine=engine, optimized=optimized)
+        return (value, value_type, sorted(state.bindings()), output.getvalue())
+    except Exception as e:
+        return (type(e), output.getvalue())
+
+
+def test_optimize():
+    # Optimizing never changes what a program does, with any engine.
+    for program, _ in engine_test_programs():
+        expected = run_printing(program)
+        for engine in ("tree", "closure", "python", "vm", "iterative"):
+            check_equal(expected, run_printing(program, engine, optimized=True))
+
+    check_equal(repr(IntLiteral(4)),
+                repr(optimize(Add(IntLiteral(2), IntLiteral(2)))))
+    check_equal(repr(BooleanLiteral(True)),
+                repr(optimize(Lt(Multiply(IntLiteral(2), IntLiteral(3)), IntLiteral(7)))))
+    check_equal(repr(Ren()), repr(optimize(If(Eq(Ren(), Ren()), Ren(), IntLiteral(1)))))
+    check_equal(repr(BooleanLiteral(False)),
+                repr(optimize(While(BooleanLiteral(False), Print(IntLiteral(1))))))
+
+    # Errors are left for the program to raise when it gets to them.
+    for program, error in ((Divide(IntLiteral(1), Subtract(IntLiteral(1), IntLiteral(1))), InterpMathError()),
+                           (Add(IntLiteral(1), StringLiteral("1")), InterpTypeError()),
+                           (If(IntLiteral(1), Ren(), Ren()), InterpTypeError())):
+        check_program_raises(error, optimize(program))
+    check_equal((InterpMathError, "before\n"),
+                run_printing(Program(Print(StringLiteral("before")),
+                                     Divide(IntLiteral(1), IntLiteral(0))), optimized=True))
+
+    # Nested sequences are spliced, constants whose values are discarded
+    # are dropped and effects stay in order.
+    program = Program(IntLiteral(1),
+                      Sequence(Print(IntLiteral(1)), Sequence(Ren(), Print(IntLiteral(2)))),
+                      If(BooleanLiteral(True), Sequence(), Print(IntLiteral(3))))
+    optimized = optimize(program)
+    check_equal(repr(Program(Print(IntLiteral(1)), Print(IntLiteral(2)), Ren())),
+                repr(optimized))
+    check_equal(run_printing(program), run_printing(optimized))
+
+    # Subtrees that cannot be improved are shared, not copied, and
+    # optimizing is done once per program.
+    loop = While(Lt(Variable("i"), IntLiteral(3)),
+                 Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))
+    program = Program(Assign(Variable("i"), Add(IntLiteral(0), IntLiteral(0))), loop)
+    optimized = optimize_program(program)
+    check_equal(True, optimized.exprs[1] is loop)
+    check_equal(True, optimize_program(program) is optimized)
+    check_equal(True, optimize_program(loop) is loop)
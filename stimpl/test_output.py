@@ -0,0 +1,68 @@
+import io
+from contextlib import redirect_stdout
+
+from stimpl.expression import *
+from stimpl.output import BufferedOutput, CollectedOutput, NullOutput, output_to
+from stimpl.runtime import run_stimpl
+from stimpl.test import ENGINES, check_equal
+from stimpl.types import Boolean
+
+
+def test_output():
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(3)),
+                            Sequence(Print(Variable("i")),
+                                     Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Print(Ren()), Print(FloatingPointLiteral(0.5)), Print(StringLiteral("done")),
+                      Print(BooleanLiteral(True)))
+    expected = "0\n1\n2\nUnit\n0.5\ndone\nTrue\n"
+
+    for engine in ENGINES:
+        # By default, values are printed to (whatever is) `sys.stdout`.
+        printed = io.StringIO()
+        with redirect_stdout(printed):
+            run_stimpl(program, engine=engine)
+        check_equal(expected, printed.getvalue())
+
+        collected = CollectedOutput()
+        run_stimpl(program, engine=engine, output=collected)
+        check_equal([0, 1, 2, None, 0.5, "done", True], collected.values)
+        check_equal(expected, collected.text())
+
+        written = io.StringIO()
+        run_stimpl(program, engine=engine, output=BufferedOutput(written, flush_size=4))
+        check_equal(expected, written.getvalue())
+
+        printed = io.StringIO()
+        with redirect_stdout(printed):
+            check_equal((True, Boolean()), run_stimpl(program, engine=engine, output=NullOutput())[:2])
+        check_equal("", printed.getvalue())
+
+    # A buffered sink holds lines back until it has enough of them, and
+    # is flushed at the end of a run, even one that fails.
+    written = io.StringIO()
+    buffered = BufferedOutput(written, flush_size=100)
+    with output_to(buffered):
+        run_stimpl(Print(IntLiteral(1)))
+        check_equal("", written.getvalue())
+        run_stimpl(Print(StringLiteral("x" * 100)))
+        check_equal("1\n" + "x" * 100 + "\n", written.getvalue())
+        run_stimpl(Print(IntLiteral(2)))
+    check_equal("1\n" + "x" * 100 + "\n2\n", written.getvalue())
+
+    written = io.StringIO()
+    try:
+        run_stimpl(Program(Print(IntLiteral(1)), Divide(IntLiteral(1), IntLiteral(0))),
+                   output=BufferedOutput(written))
+    except Exception:
+        pass
+    check_equal("1\n", written.getvalue())
+
+    # Sinks nest: a run with a sink of its own does not print to the
+    # current one.
+    outer, inner = CollectedOutput(), CollectedOutput()
+    with output_to(outer):
+        run_stimpl(Print(IntLiteral(1)))
+        run_stimpl(Print(IntLiteral(2)), output=inner)
+        run_stimpl(Print(IntLiteral(3)))
+    check_equal(([1, 3], [2]), (outer.values, inner.values))
@@ -0,0 +1,59 @@
+from stimpl.errors import InterpMathError
+from stimpl.expression import *
+from stimpl.parallel import run_stimpl_many
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import *
+
+
+def test_run_stimpl_many():
+    programs = [Program(Print(IntLiteral(index)), Multiply(IntLiteral(index), IntLiteral(index)))
+                for index in range(20)]
+    programs.append(Program(Print(StringLiteral("before")),
+                            Divide(IntLiteral(1), IntLiteral(0))))
+    programs += [program for program, _ in engine_test_programs()]
+
+    results = list(run_stimpl_many(programs, workers=2, chunksize=3))
+    check_equal(list(range(len(programs))), [result.index for result in results])
+    for index in range(20):
+        check_equal((index * index, Integer(), f"{index}\n", None),
+                    (results[index].value, results[index].value_type,
+                     results[index].output, results[index].error))
+
+    # An exception stays with the program that raised it.
+    check_equal(InterpMathError, type(results[20].error))
+    check_equal("before\n", results[20].output)
+
+    for program, result in zip(programs[21:], results[21:]):
+        try:
+            value, value_type, state = run_stimpl(program)
+        except Exception as e:
+            check_equal(type(e), type(result.error))
+            continue
+        check_equal((value, value_type), (result.value, result.value_type))
+        check_equal({variable_name: (variable_value, variable_type)
+                     for variable_name, variable_value, variable_type in state.bindings()},
+                    result.bindings)
+
+    # Results can also come back as soon as they are ready.
+    unordered = list(run_stimpl_many(programs, workers=2, ordered=False, engine="closure"))
+    check_equal(list(range(len(programs))),
+                sorted(result.index for result in unordered))
+
+    # Programs are only read as they are needed, one that cannot be
+    # serialized fails on its own, and stopping early stops reading.
+    unserializable = Program(StringLiteral("unserializable"))
+    unserializable.exprs[0].literal = object()
+    read = []
+
+    def corpus():
+        for index in range(1000):
+            read.append(index)
+            yield unserializable if index == 1 else programs[index % 20]
+    results = run_stimpl_many(corpus(), workers=2, chunksize=2)
+    check_equal(0, next(results).index)
+    failed = next(results)
+    check_equal((1, ValueError), (failed.index, type(failed.error)))
+    check_equal(True, len(read) < 20)
+    results.close()
+    check_equal(True, len(read) < 20)
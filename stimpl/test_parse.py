@@ -0,0 +1,98 @@
+import io
+import os
+import pickle
+import re
+import sys
+import tempfile
+
+from stimpl.errors import InterpParseError
+from stimpl.expression import *
+from stimpl.parse import CONSTRUCTORS, parse, parse_file, tokenize, unparse
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def check_parse_error(source, line, column):
+    try:
+        parse(source)
+        raise Exception(f"Should have raised InterpParseError parsing {source!r}")
+    except InterpParseError as error:
+        check_equal((line, column), (error.line, error.column))
+
+
+def test_parse():
+    # Every program in the README reads the same as when Python evaluates
+    # it.
+    readme = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "README.md")
+    if os.path.exists(readme):
+        with open(readme, encoding="utf-8") as readme_file:
+            blocks = re.findall(r"```\n((?:Program|Sequence)\(.*?)```", readme_file.read(), re.DOTALL)
+        check_equal(True, len(blocks) > 0)
+        for block in blocks:
+            try:
+                expected = repr(eval(block, dict(CONSTRUCTORS)))
+            except Exception:
+                continue
+            check_equal(expected, repr(parse(block)))
+
+    check_equal((4, Integer()),
+                run_stimpl(parse('Program(Assign(Variable("four"), Add(IntLiteral(2), IntLiteral(2))))'))[:2])
+
+    for program, _ in engine_test_programs():
+        check_equal(repr(program), repr(parse(unparse(program))))
+
+    # Literals are written as in Python.
+    literals = parse("""Program(  # A comment.
+        IntLiteral(-0x1F), IntLiteral(+1_000), IntLiteral(0b101), FloatingPointLiteral(-2.5e3),
+        FloatingPointLiteral(.5), StringLiteral('a\\tb' "c"), StringLiteral(r'\\n'),
+        StringLiteral('''x
+y'''), StringLiteral(""), BooleanLiteral(False), Ren(),)""")
+    check_equal([-31, 1000, 5, -2500.0, 0.5, "a\tbc", "\\n", "x\ny", "", False],
+                [expression.literal for expression in literals.exprs[:-1]])
+
+    # Parsing does not recurse.
+    depth = sys.getrecursionlimit() * 2
+    source = "Add(" * depth + "IntLiteral(0)" + ", IntLiteral(1))" * depth
+    check_equal((depth, Integer()), run_stimpl(parse(source), engine="iterative")[:2])
+
+    # Long runs of space (and of comments) after a name that does not
+    # start a call are still scanned in linear time.
+    for space in (" " * 10000, "\\\n" * 10000, "#" * 10000 + "\n", " #" * 5000 + "\n"):
+        check_equal(repr(Program(Variable("x"), BooleanLiteral(True))),
+                    repr(parse('Program(Variable("x"), BooleanLiteral(True' + space + '))')))
+
+    # Files are read a chunk at a time, and tokens may span chunks.
+    source = 'Program(\\\n  Assign(Variable("i"), IntLiteral(12345)),  # one\n' \
+             "  Print(StringLiteral('''two\nthree''')), Variable ( 'i' ))\n"
+    for chunk_size in range(1, 8):
+        check_equal(list(tokenize(source)), list(tokenize(io.StringIO(source), chunk_size)))
+        check_equal(repr(parse(source)), repr(parse_file(io.StringIO(source), chunk_size)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.stimpl")
+        with open(path, "w", encoding="utf-8") as source_file:
+            source_file.write(source)
+        check_equal(repr(parse(source)), repr(parse_file(path)))
+
+    # Errors give the line and column of the offending token.
+    check_parse_error("Program(\n  IntLiteral(1)\n  IntLiteral(2))", 3, 3)
+    check_parse_error("Program(Foo(1))", 1, 9)
+    check_parse_error("Program(IntLiteral(1), $)", 1, 24)
+    check_parse_error("Program(Variable(x))", 1, 18)
+    check_parse_error("Program(,)", 1, 9)
+    check_parse_error("Program(IntLiteral(1))\nRen()", 2, 1)
+    check_parse_error("Program(\n  Not(IntLiteral(1),", 2, 3)
+    check_parse_error("Program(StringLiteral('''a\nb'''), Not(1, 2))", 2, 8)
+    check_parse_error("", 1, 1)
+    # Arguments that are not expressions (or names, for variables) give
+    # their own line and column.
+    check_parse_error("Program(Add(1, 2))", 1, 13)
+    check_parse_error("Program(Variable(3))", 1, 18)
+    check_parse_error("Program(\n  Sequence(Ren(), True))", 2, 19)
+    check_parse_error("Program(If(BooleanLiteral(True), Ren(), -1))", 1, 41)
+    # So do the errors of node constructors, and they survive pickling.
+    check_parse_error("Program(\n  IntLiteral(1.5))", 2, 3)
+    check_parse_error("Program(Assign(IntLiteral(1), IntLiteral(2)))", 1, 9)
+    error = InterpParseError("Unexpected character '$'", 3, 7)
+    copy = pickle.loads(pickle.dumps(error))
+    check_equal((str(error), 3, 7), (str(copy), copy.line, copy.column))
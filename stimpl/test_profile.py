@@ -0,0 +1,86 @@
+import json
+
+from stimpl.expression import *
+from stimpl.hamt import PersistentState
+from stimpl.hooks import Hooks, hooked
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def test_profile():
+    # Profiling does not change what a program does.
+    for program, _ in engine_test_programs():
+        try:
+            expected = run_stimpl(program)[:2]
+        except Exception as e:
+            expected = type(e)
+        try:
+            actual = run_stimpl(program, profile=True)[:2]
+        except Exception as e:
+            actual = type(e)
+        check_equal(expected, actual)
+
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      Assign(Variable("s"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(10)),
+                            Sequence(Assign(Variable("j"), IntLiteral(0)),
+                                     While(Lt(Variable("j"), Variable("i")),
+                                           Sequence(Assign(Variable("s"), Add(Variable("s"), IntLiteral(1))),
+                                                    Assign(Variable("j"), Add(Variable("j"), IntLiteral(1))))),
+                                     Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Variable("s"))
+    value, value_type, state, report = run_stimpl(program, profile=True)
+    check_equal((45, Integer()), (value, value_type))
+
+    kinds = {profile.kind: profile for profile in report.kinds}
+    check_equal(1, kinds["Program"].count)
+    check_equal(11, kinds["While"].count)
+    check_equal(10 + 2 + 10 + 45 + 45, kinds["Assign"].count)
+    # Nested Whiles only count once towards the cumulative time of While.
+    outer = [profile for profile in report.loops if profile.path == "Program/2:While"][0]
+    check_equal(outer.cumulative, kinds["While"].cumulative)
+    check_equal(True, kinds["Program"].cumulative >= outer.cumulative)
+
+    loops = {profile.path: (profile.count, profile.iterations) for profile in report.loops}
+    check_equal({"Program/2:While": (1, 10),
+                 "Program/2:While/1:Sequence/1:While": (10, 45)}, loops)
+    nodes = {profile.path: profile for profile in report.nodes}
+    check_equal(45, nodes["Program/2:While/1:Sequence/1:While/1:Sequence/0:Assign/1:Add"].count)
+    for profile in report.nodes:
+        check_equal(True, 0 <= profile.self_time <= profile.cumulative + 1e-9)
+
+    # Two bindings, then two more per iteration of either loop (the state
+    # is never long enough to be compacted).
+    check_equal(2 + 10 * 2 + 45 * 2, report.max_state_length)
+    check_equal(3, run_stimpl(program, state=PersistentState(), profile=True)[3].max_state_length)
+
+    exported = json.loads(report.to_json())
+    check_equal(report.max_state_length, exported["max_state_length"])
+    check_equal(len(report.nodes), len(exported["nodes"]))
+    check_equal(sorted(loops.items()),
+                sorted((loop["path"], (loop["entries"], loop["iterations"])) for loop in exported["loops"]))
+
+    table = report.table(sort="count", limit=3).splitlines()
+    check_equal(5, len(table))
+    counts = [int(line.split()[0]) for line in table[2:]]
+    check_equal(sorted(counts, reverse=True), counts)
+    check_equal(max(profile.count for profile in report.nodes), counts[0])
+    check_equal(True, "While" in report.table(nodes=False))
+
+    # Profiling runs on its own machine, which neither calls hooks nor
+    # stands in for another engine.
+    hooks = Hooks()
+    hooks.register("enter", lambda node: None)
+    for options in ({"hooks": hooks}, {"engine": "vm"}):
+        try:
+            run_stimpl(program, profile=True, **options)
+            raise Exception("Should have raised ValueError")
+        except ValueError:
+            pass
+    with hooked(hooks):
+        try:
+            run_stimpl(program, profile=True)
+            raise Exception("Should have raised ValueError")
+        except ValueError:
+            pass
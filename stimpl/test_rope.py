@@ -0,0 +1,97 @@
+import pickle
+
+from stimpl.expression import *
+from stimpl.hamt import PersistentState
+from stimpl.hooks import Hooks
+from stimpl.optimize import optimize_program
+from stimpl.output import CollectedOutput
+from stimpl.rope import ROPE_LENGTH, Rope, concat, flattened
+from stimpl.runtime import flattened_state, run_stimpl, state_length
+from stimpl.test import ENGINES, check_equal
+from stimpl.types import Boolean, Integer, String
+
+
+def test_ropes():
+    # Short strings stay strings; long ones become ropes that stand for
+    # the same text.
+    check_equal("ab", concat("a", "b"))
+    long = "x" * ROPE_LENGTH
+    rope = concat(long, "a")
+    check_equal(Rope, type(rope))
+    check_equal(long + "a", rope.flatten())
+    check_equal((ROPE_LENGTH + 1, long + "a", repr(long + "a")), (len(rope), str(rope), repr(rope)))
+
+    # Ropes never change: appending to one that has been appended to
+    # already does not disturb the other.
+    left = concat(rope, "b")
+    right = concat(rope, "c")
+    check_equal((long + "a", long + "ab", long + "ac"), (str(rope), str(left), str(right)))
+    check_equal(long + "acd", str(concat(right, "d")))
+    check_equal("y" + long + "ab" + long + "a", str(concat("y", concat(left, rope))))
+
+    # Prepending shares a list of its own the same way, so repeated
+    # prepends add one piece each rather than copying the rope.
+    front = concat("<", rope)
+    check_equal(("<<" + long + "a", "><" + long + "a"), (str(concat("<", front)), str(concat(">", front))))
+    built = rope
+    for _ in range(1000):
+        built = concat(">", concat(built, "<"))
+    check_equal((1000, 1002), (len(built.front), len(built.parts)))
+    check_equal(">" * 1000 + long + "a" + "<" * 1000, str(built))
+    check_equal(">" * 1000 + long + "a" + "<" * 1000 + str(built), str(concat(built, built)))
+
+    # They compare, hash and format like the strings that they stand for.
+    check_equal(True, left == long + "ab" and long + "ab" == left and left != right)
+    check_equal(True, left < right and right > left and left <= left and "z" > left)
+    check_equal({long + "ab": 1}, {left: 1})
+    check_equal(f"{long}ab", f"{left}")
+    check_equal(long + "ab", flattened(left))
+    check_equal(long + "ab", pickle.loads(pickle.dumps(left)))
+
+    # A loop that appends to a string gives plain strings back, in its
+    # value, its state and its output, on every engine.
+    piece = "ab" * 16
+    program = Program(Assign(Variable("s"), StringLiteral("")),
+                      Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(1000)),
+                            Sequence(Assign(Variable("s"), Add(Variable("s"), StringLiteral(piece))),
+                                     Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))),
+                      Print(Add(StringLiteral(">"), Variable("s"))),
+                      Assign(Variable("t"), Add(Variable("s"), Variable("s"))),
+                      Eq(Variable("t"), StringLiteral(piece * 2000)))
+    expected = piece * 1000
+    for engine in ENGINES:
+        for state in (None, PersistentState()):
+            output = CollectedOutput()
+            value, value_type, final_state = run_stimpl(program, engine=engine, state=state, output=output)
+            check_equal((True, Boolean()), (value, value_type))
+            check_equal((expected, String()), final_state.get_value("s"))
+            check_equal(str, type(final_state.get_value("s")[0]))
+            check_equal(str, type(final_state.get_value("t")[0]))
+            check_equal([">" + expected], output.values)
+            check_equal(str, type(output.values[0]))
+
+    returned = Program(Assign(Variable("s"), StringLiteral(long)),
+                       Add(Variable("s"), Variable("s")))
+    for engine in ENGINES:
+        value = run_stimpl(returned, engine=engine)[0]
+        check_equal((str, long + long), (type(value), value))
+
+    # Hooks see strings too, and folded constants are string literals.
+    assigned = []
+    hooks = Hooks()
+    hooks.register("assign", lambda node, variable_name, value, value_type: assigned.append(type(value))
+                   if value_type is String() else None)
+    run_stimpl(program, hooks=hooks, output=CollectedOutput())
+    check_equal({str}, set(assigned))
+    folded = optimize_program(Program(Add(StringLiteral(long), StringLiteral(long))))
+    check_equal(str, type(folded.exprs[0].literal))
+
+    # Flattening a result leaves the states that it shares alone.
+    state = run_stimpl(Program(Assign(Variable("s"), Add(StringLiteral(long), StringLiteral("a")))),
+                       engine="closure")[2]
+    shared = state.set_value("s", concat(long, "b"), String()).set_value("i", 0, Integer())
+    flat = flattened_state(shared)
+    check_equal((Rope, str), (type(shared.get_value("s")[0]), type(flat.get_value("s")[0])))
+    check_equal((long + "b", 3, 3), (flat.get_value("s")[0], state_length(shared), state_length(flat)))
+    check_equal(True, flat.next_state.next_state is shared.next_state.next_state)
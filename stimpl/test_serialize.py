@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+from stimpl.expression import *
+from stimpl.runtime import run_stimpl
+from stimpl.serialize import FORMAT_VERSION, HEADER, MAGIC, dump, dumps, load, loads, read_table
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import Integer
+
+
+def test_serialize():
+    literals = Program(IntLiteral(2 ** 100), IntLiteral(-1), IntLiteral(0),
+                       FloatingPointLiteral(-0.0), FloatingPointLiteral(0.1),
+                       StringLiteral("snow ☃"), StringLiteral(""),
+                       BooleanLiteral(True), BooleanLiteral(False), Variable("x"))
+    check_equal(repr(literals), repr(loads(dumps(literals))))
+    check_equal(True, type(read_table(dumps(literals)).to_expr().exprs[0]) is IntLiteral)
+
+    for program, _ in engine_test_programs():
+        loaded = loads(dumps(program))
+        check_equal(repr(program), repr(loaded))
+        for engine in ("tree", "closure", "iterative"):
+            try:
+                expected = run_stimpl(program)[:2]
+            except Exception as e:
+                expected = type(e)
+            try:
+                actual = run_stimpl(loads(dumps(program)), engine=engine)[:2]
+            except Exception as e:
+                actual = type(e)
+            check_equal(expected, actual)
+
+    # Loading maps the file and decodes nothing until it is needed.
+    program = Program(Assign(Variable("i"), IntLiteral(1)),
+                      If(BooleanLiteral(True), Variable("i"), StringLiteral("never read")))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.stimpl")
+        dump(program, path)
+        loaded = load(path)
+        pool = loaded._table.pool
+        check_equal(0, len(pool.decoded))
+        check_equal((1, Integer()), run_stimpl(loaded)[:2])
+        check_equal(False, "never read" in pool.decoded.values())
+        del loaded, pool
+
+    # Neither dumping nor loading recurse.
+    depth = sys.getrecursionlimit() * 2
+    program = IntLiteral(0)
+    for _ in range(depth):
+        program = Add(program, IntLiteral(1))
+    check_equal((depth, Integer()),
+                run_stimpl(read_table(dumps(program)).to_expr(), engine="iterative")[:2])
+
+    # Only the current version of the format can be loaded.
+    data = dumps(Ren())
+    for bad in (b"not a program", HEADER.pack(MAGIC, FORMAT_VERSION + 1, 0, 0, 0, 0, 0) + data[HEADER.size:]):
+        try:
+            loads(bad)
+            raise Exception("Should have raised ValueError")
+        except ValueError:
+            pass
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from stimpl.expression import *
+from stimpl.hamt import PersistentState
+from stimpl.iterative import Machine
+from stimpl.output import CollectedOutput, output_to
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.serialize import dumps
+from stimpl.snapshot import resume, run_with_snapshots, snapshot
+from stimpl.test import check_equal, engine_test_programs
+from stimpl.types import Integer, String
+
+PROGRAM = Program(Assign(Variable("i"), IntLiteral(0)),
+                  Assign(Variable("s"), StringLiteral("")),
+                  While(Lt(Variable("i"), IntLiteral(300)),
+                        Sequence(Assign(Variable("s"), Add(Variable("s"), StringLiteral("x" * 100))),
+                                 If(Eq(Variable("i"), IntLiteral(150)), Print(Variable("i")), Ren()),
+                                 Assign(Variable("i"), Add(Variable("i"), Multiply(IntLiteral(1), IntLiteral(1)))))),
+                  Add(Variable("i"), IntLiteral(0)))
+
+
+def test_snapshots():
+    # Snapshots taken after any number of tasks resume to the same result
+    # and output, from either kind of state.
+    for state in (EmptyState(), PersistentState()):
+        expected_output = CollectedOutput()
+        expected = run_stimpl(PROGRAM, state=state, engine="iterative", output=expected_output)
+        for steps in (1, 7, 1000, 5001):
+            output = CollectedOutput()
+            with output_to(output):
+                machine = Machine(PROGRAM, state)
+                machine.run(steps)
+                data = snapshot(machine)
+                machine = resume(data)
+                machine.run()
+            value, value_type, final_state = machine.result()
+            check_equal(expected[:2], (value, value_type))
+            check_equal(expected[2].get_value("s"), final_state.get_value("s"))
+            check_equal(isinstance(state, PersistentState), isinstance(final_state, PersistentState))
+            check_equal(expected_output.printed, output.printed)
+            # A snapshot of a resumed machine is the same snapshot.
+            check_equal(data, snapshot(resume(data, PROGRAM)))
+
+    # Every program can be snapshot at every step.
+    for program, _ in engine_test_programs():
+        try:
+            dumps(program)
+        except ValueError:
+            continue
+        try:
+            expected = run_stimpl(program, engine="iterative", output=CollectedOutput())[:2]
+        except Exception as e:
+            expected = type(e)
+        machine = Machine(program, EmptyState())
+        try:
+            with output_to(CollectedOutput()):
+                while not machine.run(3):
+                    machine = resume(snapshot(machine))
+            actual = machine.result()[:2]
+        except Exception as e:
+            actual = type(e)
+        check_equal(expected, actual)
+
+    for data, message in ((b"", "Not a STIMPL snapshot."),
+                          (snapshot(Machine(PROGRAM, EmptyState())).replace(b"STIMPLSN", b"STIMPLXX"),
+                           "Not a STIMPL snapshot.")):
+        try:
+            resume(data)
+            check_equal(ValueError, None)
+        except ValueError as error:
+            check_equal(message, str(error))
+    try:
+        resume(snapshot(Machine(PROGRAM, EmptyState())), Program(IntLiteral(1)))
+        check_equal(ValueError, None)
+    except ValueError as error:
+        check_equal("The snapshot is of another program.", str(error))
+
+    # A run cut short resumes from its last snapshot, in another process.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "run.snapshot")
+        machine = Machine(PROGRAM, EmptyState())
+        machine.run(4000)
+        with open(path, "wb") as file:
+            file.write(snapshot(machine))
+        script = ("import sys\n"
+                  "from stimpl.snapshot import run_with_snapshots\n"
+                  "from stimpl.test_snapshot import PROGRAM\n"
+                  "print(run_with_snapshots(PROGRAM, sys.argv[1], every=500)[:2])\n")
+        completed = subprocess.run([sys.executable, "-c", script, path], capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        check_equal("", completed.stderr)
+        check_equal("150\n(300, Integer)\n", completed.stdout)
+        check_equal(False, os.path.exists(path))
+
+        output = CollectedOutput()
+        with output_to(output):
+            value, value_type, state = run_with_snapshots(PROGRAM, path, every=100)
+        check_equal((300, Integer(), [150]), (value, value_type, output.values))
+        check_equal(("x" * 30000, String()), state.get_value("s"))
+        check_equal(str, type(state.get_value("s")[0]))
+        check_equal([], os.listdir(directory))
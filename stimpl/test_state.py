@@ -1,9 +1,11 @@
-from stimpl.runtime import EmptyState
-from stimpl.types import Boolean, Integer
-from stimpl.test import check_equal
+from stimpl.expression import *
+from stimpl.hamt import PersistentState
+from stimpl.runtime import EmptyState, State, run_stimpl
+from stimpl.types import Boolean, Integer, String
+from stimpl.test import check_equal, engine_test_programs
 
-def test_state_implementation():
-    state = EmptyState()
+
+def check_state_implementation(state):
     check_equal(None, state.get_value("x")) 
     state2 = state.set_value("x", 5, Integer())
     check_equal((5, Integer()), state2.get_value("x")) 
@@ -12,4 +14,64 @@ def test_state_implementation():
     state4 = state3.set_value("x", 7, Integer())
     check_equal((7, Integer()),state4.get_value("x"))
     check_equal((5, Integer()), state2.get_value("x"))
-    check_equal(None,state4.get_value("y"))
\ No newline at end of file
+    check_equal(None,state4.get_value("y"))
+
+def test_state_implementation():
+    check_state_implementation(EmptyState())
+
+def test_persistent_state_implementation():
+    check_state_implementation(PersistentState())
+
+    # Enough variables to need several levels of the trie; every older
+    # state keeps seeing exactly the bindings it had.
+    states = [PersistentState()]
+    for i in range(2000):
+        states.append(states[-1].set_value(f"v{i}", i, Integer()))
+    states.append(states[-1].set_value("v0", -1, Integer()))
+    check_equal(2000, len(states[-1]))
+    check_equal((-1, Integer()), states[-1].get_value("v0"))
+    check_equal((0, Integer()), states[-2].get_value("v0"))
+    check_equal((1999, Integer()), states[-1].get_value("v1999"))
+    check_equal(None, states[1000].get_value("v1000"))
+    check_equal((999, Integer()), states[1000].get_value("v999"))
+
+    for program, variables in engine_test_programs():
+        try:
+            expected = run_stimpl(program)
+        except Exception:
+            continue
+        for engine in ("tree", "closure", "python", "vm"):
+            actual = run_stimpl(program, engine=engine, state=PersistentState())
+            check_equal(expected[:2], actual[:2])
+            for variable in variables:
+                check_equal(expected[2].get_value(variable),
+                            actual[2].get_value(variable))
+
+def test_state_compaction():
+    state = EmptyState().set_value("k", "keep", String())
+    for i in range(10):
+        state = state.set_value("x", i, Integer())
+    compacted = state.compact()
+    check_equal(2, compacted.length)
+    check_equal((9, Integer()), compacted.get_value("x"))
+    check_equal(("keep", String()), compacted.get_value("k"))
+    check_equal(11, state.length)
+    check_equal(state, state.maybe_compact())
+
+    # A long loop keeps the state proportional to its live variables
+    # rather than to the number of assignments that it makes.
+    iterations = State.compaction_limit * 10
+    program = Program(
+        Assign(Variable("i"), IntLiteral(0)),
+        Assign(Variable("sum"), IntLiteral(0)),
+        While(Lt(Variable("i"), IntLiteral(iterations)),
+              Sequence(
+            Assign(Variable("sum"), Add(Variable("sum"), Variable("i"))),
+            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))),
+        )),
+    )
+    for engine in ("tree", "closure"):
+        _, _, state = run_stimpl(program, engine=engine)
+        check_equal((iterations, Integer()), state.get_value("i"))
+        check_equal((sum(range(iterations)), Integer()), state.get_value("sum"))
+        check_equal(True, state.length <= 2 * State.compaction_limit + 4)
@@ -0,0 +1,52 @@
+from stimpl.expression import *
+from stimpl.runtime import run_stimpl
+from stimpl.table import ProgramTable
+from stimpl.test import check_equal, engine_test_programs
+
+
+def test_slotted_expressions():
+    program = Add(IntLiteral(1), Variable("x"))
+    check_equal(False, hasattr(program, "__dict__"))
+    match program:
+        case Add(IntLiteral(value), Variable(name)):
+            check_equal((1, "x"), (value, name))
+        case _:
+            raise Exception("Positional match failed.")
+
+
+def test_program_table():
+    for program, variables in engine_test_programs():
+        table = ProgramTable.from_expr(program)
+        check_equal(repr(program), repr(table.expr()))
+        check_equal(repr(program), repr(table.to_expr()))
+        for engine in ("tree", "closure", "python", "vm", "iterative"):
+            try:
+                expected = run_stimpl(program)
+            except Exception as e:
+                expected = type(e)
+            try:
+                actual = run_stimpl(table.expr(), engine=engine)
+            except Exception as e:
+                actual = type(e)
+            if isinstance(expected, tuple):
+                check_equal(expected[:2], actual[:2])
+                for variable in variables:
+                    check_equal(expected[2].get_value(variable),
+                                actual[2].get_value(variable))
+            else:
+                check_equal(expected, actual)
+
+    # Views are instances of the node classes and only decode the
+    # children that are actually read.
+    table = ProgramTable.from_expr(
+        If(BooleanLiteral(True), StringLiteral("a"), Ren()))
+    view = table.expr()
+    check_equal(True, isinstance(view, If))
+    check_equal(None, view._children)
+    match view:
+        case If(BooleanLiteral(True), StringLiteral(literal), _):
+            check_equal("a", literal)
+        case _:
+            raise Exception("Positional match failed.")
+    check_equal(3, len(view._children))
+    check_equal(4, len(table))
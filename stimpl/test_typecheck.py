@@ -0,0 +1,96 @@
+from stimpl.errors import InterpTypeError
+from stimpl.expression import *
+from stimpl.incremental import IncrementalRunner
+from stimpl.output import CollectedOutput
+from stimpl.runtime import EmptyState, run_stimpl
+from stimpl.test import check_equal, check_program_raises
+from stimpl.typecheck import typecheck
+from stimpl.types import *
+
+
+def test_typecheck():
+    # `i` is only ever assigned integers, so every read of it is an
+    # integer, even inside the loop.
+    condition = Lt(Variable("i"), IntLiteral(10))
+    increment = Add(Variable("i"), IntLiteral(1))
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(condition, Assign(Variable("i"), increment)),
+                      Variable("i"))
+    report = typecheck(program)
+    check_equal({"i": Integer()}, report.variables)
+    check_equal([], report.errors)
+    check_equal(Integer(), increment.static_type)
+    check_equal(Boolean(), condition.static_type)
+    check_equal(Integer(), program.static_type)
+
+    # `x` is assigned both integers and strings: its reads are unknown.
+    read = Variable("x")
+    program = Program(Assign(Variable("x"), IntLiteral(0)),
+                      If(BooleanLiteral(True), Ren(), Assign(Variable("x"), StringLiteral("x"))),
+                      Add(read, read))
+    report = typecheck(program)
+    check_equal({}, report.variables)
+    check_equal(None, read.static_type)
+    check_equal(None, program.static_type)
+
+    # Errors are reported (or raised when strict) but never thrown away:
+    # running the program still raises them.
+    program = Program(Assign(Variable("s"), StringLiteral("s")),
+                      Subtract(Variable("s"), Variable("s")))
+    report = typecheck(program)
+    check_equal(1, len(report.errors))
+    check_equal(InterpTypeError, type(report.errors[0]))
+    try:
+        typecheck(program, strict=True)
+        raise Exception("Should have raised InterpTypeError")
+    except InterpTypeError:
+        pass
+    check_program_raises(InterpTypeError(), program, "closure")
+
+    # When the initial state disagrees with the inferred types, the
+    # closure engine falls back to checking types dynamically.
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      Add(Variable("i"), IntLiteral(1)))
+    check_equal(True, typecheck(program).consistent_with(EmptyState()))
+    state = EmptyState().set_value("i", "zero", String())
+    check_equal(False, typecheck(program).consistent_with(state))
+    try:
+        run_stimpl(program, engine="closure", state=state)
+        raise Exception("Should have raised InterpTypeError")
+    except InterpTypeError:
+        pass
+
+    # Variables that are read but never assigned get their types from the
+    # initial state, so nothing is proven about them -- whether the state
+    # is passed in or is a checkpoint of an earlier run.
+    read = Variable("y")
+    tail = Add(If(BooleanLiteral(True), read, IntLiteral(1)), IntLiteral(2))
+    typecheck(tail)
+    check_equal((None, None), (read.static_type, tail.static_type))
+    try:
+        run_stimpl(tail, engine="closure", state=EmptyState().set_value("y", "y", String()))
+        raise Exception("Should have raised InterpTypeError")
+    except InterpTypeError:
+        pass
+    runner = IncrementalRunner("closure")
+    runner.run(Program(Assign(Variable("y"), IntLiteral(0)), tail), output=CollectedOutput())
+    try:
+        runner.run(Program(Assign(Variable("y"), StringLiteral("y")), tail), output=CollectedOutput())
+        raise Exception("Should have raised InterpTypeError")
+    except InterpTypeError:
+        pass
+
+    # Variables whose assignments are all ill-typed have no proven type;
+    # binding them in the initial state must not let their reads be
+    # treated as anything in particular.
+    program = Program(If(BooleanLiteral(False), Assign(Variable("x"), Variable("x")), Ren()),
+                      Add(If(BooleanLiteral(True), Variable("x"), IntLiteral(1)), IntLiteral(1)))
+    report = typecheck(program)
+    check_equal(frozenset({"x"}), report.unproven)
+    state = EmptyState().set_value("x", "s", String())
+    check_equal(False, report.consistent_with(state))
+    try:
+        run_stimpl(program, engine="closure", state=state)
+        raise Exception("Should have raised InterpTypeError")
+    except InterpTypeError:
+        pass
@@ -0,0 +1,22 @@
+import copy
+import pickle
+
+from stimpl.test import check_equal
+from stimpl.types import *
+
+
+def test_type_singletons():
+    for type_class in (Unit, Integer, FloatingPoint, String, Boolean):
+        instance = type_class()
+        check_equal(True, instance is type_class())
+        check_equal(True, instance == type_class())
+        check_equal(True, pickle.loads(pickle.dumps(instance)) is instance)
+        check_equal(True, copy.deepcopy(instance) is instance)
+        check_equal(hash(instance), hash(type_class()))
+        check_equal(object.__hash__(instance), hash(instance))
+
+    check_equal(False, Integer() == FloatingPoint())
+    check_equal(True, Integer() != FloatingPoint())
+    check_equal(5, len({Unit(): 0, Integer(): 1, FloatingPoint(): 2,
+                        String(): 3, Boolean(): 4}))
+    check_equal(True, isinstance(Integer(), Type))
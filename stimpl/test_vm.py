@@ -0,0 +1,29 @@
+import sys
+
+from stimpl.expression import *
+from stimpl.runtime import run_stimpl
+from stimpl.test import check_engine, check_equal
+from stimpl.types import Integer
+from stimpl.vm import compile_bytecode, disassemble
+
+
+def test_vm_engine():
+    check_engine("vm")
+
+    program = Program(Assign(Variable("i"), IntLiteral(0)),
+                      While(Lt(Variable("i"), IntLiteral(3)),
+                            Assign(Variable("i"), Add(Variable("i"), IntLiteral(1)))),
+                      Variable("i"))
+    bytecode = compile_bytecode(program)
+    check_equal(["i"], bytecode.names)
+    check_equal(True, "WHILE_FALSE" in disassemble(bytecode))
+
+    # Neither the compiler nor the machine recurse, so nesting far beyond
+    # the Python recursion limit is fine.
+    depth = sys.getrecursionlimit() * 2
+    program = Assign(Variable("i"), IntLiteral(0))
+    for _ in range(depth):
+        program = Sequence(program, Assign(Variable("i"), Add(Variable("i"), IntLiteral(1))))
+    value, value_type, state = run_stimpl(program, engine="vm")
+    check_equal((depth, Integer()), (value, value_type))
+    check_equal((depth, Integer()), state.get_value("i"))
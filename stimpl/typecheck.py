@@ -0,0 +1,236 @@
+from typing import Dict, FrozenSet, Iterator, List, Optional
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+
+"""
+Static type checking
+
+STIMPL binds a variable's type at its first assignment and never changes
+it. So, every value a variable ever holds has the type of some expression
+that is assigned to it. If every expression assigned to a variable has
+the same type, the type of the variable itself is known before the
+program runs -- and so is the type of almost every expression that reads
+it.
+
+`typecheck` infers, for every node of a program, the type that the node
+produces whenever it evaluates successfully and records it on the node as
+`static_type` (None where inference is inconclusive). It is a
+flow-insensitive analysis: it assumes nothing about the order in which
+expressions execute and iterates until the types of all variables stop
+changing. Engines can use the annotations to skip the runtime type checks
+of operations whose operand types are proven.
+
+Type errors that are certain to happen whenever the offending expression
+is evaluated (e.g., `Add(IntLiteral(1), StringLiteral("1"))`) are
+reported, but not raised: the expression might never be evaluated.
+Engines that use the annotations still raise them at runtime.
+
+The analysis assumes that the variables a program assigns are not already
+bound in the state it starts from; `TypeReport.consistent_with` checks
+that assumption for a given initial state. Variables that the program
+reads but never assigns can only be bound by the initial state, so their
+type is unknown.
+"""
+
+
+class Bottom(object):
+    """
+    The type of an expression that never evaluates successfully.
+    """
+
+    def __repr__(self) -> str:
+        return "Bottom"
+
+
+class Unknown(object):
+    """
+    The type of an expression whose type cannot be determined statically.
+    """
+
+    def __repr__(self) -> str:
+        return "Unknown"
+
+
+BOTTOM = Bottom()
+UNKNOWN = Unknown()
+
+ARITHMETIC_TYPES = (Integer, FloatingPoint)
+ADDABLE_TYPES = (Integer, FloatingPoint, String)
+
+
+def join(left, right):
+    if left is BOTTOM:
+        return right
+    if right is BOTTOM or left is right:
+        return left
+    return UNKNOWN
+
+
+def is_known(inferred) -> bool:
+    return inferred is not BOTTOM and inferred is not UNKNOWN
+
+
+class TypeReport(object):
+    def __init__(self, variables: Dict[str, Type], errors: List[InterpTypeError],
+                 unproven: FrozenSet[str] = frozenset()) -> None:
+        self.variables = variables
+        self.errors = errors
+        # Variables that the program assigns but whose type is not proven
+        # (e.g., every value assigned to them is ill-typed).
+        self.unproven = unproven
+
+    def consistent_with(self, state) -> bool:
+        """
+        Whether starting from `state` keeps the inferred types valid.
+        """
+        for variable_name, variable_type in self.variables.items():
+            value = state.get_value(variable_name)
+            if value is not None and type(value[1]) is not type(variable_type):
+                return False
+        # The analysis assumed that reads of these variables only see the
+        # values the program assigns to them.
+        for variable_name in self.unproven:
+            if state.get_value(variable_name) is not None:
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return f"TypeReport(variables={self.variables}, errors={self.errors}, unproven={set(self.unproven)})"
+
+
+def postorder(program: Expr) -> List[Expr]:
+    order = []
+    pending = [(program, False)]
+    while pending:
+        expression, expanded = pending.pop()
+        if expanded:
+            order.append(expression)
+        else:
+            pending.append((expression, True))
+            for child in reversed(children(expression)):
+                pending.append((child, False))
+    return order
+
+
+def infer(expression: Expr, inferred: Dict[int, object], variables: Dict[str, object]):
+    def of(child):
+        return inferred[id(child)]
+
+    match expression:
+        case Ren():
+            return Unit
+        case IntLiteral():
+            return Integer
+        case FloatingPointLiteral():
+            return FloatingPoint
+        case StringLiteral():
+            return String
+        case BooleanLiteral():
+            return Boolean
+        case Print(to_print=to_print):
+            return of(to_print)
+        case Sequence(exprs=exprs) | Program(exprs=exprs):
+            return of(exprs[-1]) if len(exprs) else Unit
+        case Variable(variable_name=variable_name):
+            # Variables that the program never assigns hold whatever the
+            # initial state binds them to.
+            return variables.get(variable_name, UNKNOWN)
+        case Assign(value=value):
+            return of(value)
+        case Add(left=left, right=right) | Subtract(left=left, right=right) | \
+                Multiply(left=left, right=right) | Divide(left=left, right=right):
+            left_type, right_type = of(left), of(right)
+            if left_type is BOTTOM or right_type is BOTTOM:
+                return BOTTOM
+            if left_type is UNKNOWN or right_type is UNKNOWN:
+                return UNKNOWN
+            allowed = ADDABLE_TYPES if isinstance(
+                expression, Add) else ARITHMETIC_TYPES
+            if left_type is not right_type or left_type not in allowed:
+                return BOTTOM
+            return left_type
+        case And() | Or() | Not() | Lt() | Lte() | Gt() | Gte() | Eq() | Ne() | While():
+            return Boolean
+        case If(true=true, false=false):
+            return join(of(true), of(false))
+        case _:
+            return BOTTOM
+
+
+def check(expression: Expr) -> Optional[InterpTypeError]:
+    """
+    The type error that evaluating `expression` is certain to raise once
+    its operands have been evaluated, if any.
+    """
+    match expression:
+        case BinaryOperator(left=left, right=right):
+            left_type, right_type = left.static_type, right.static_type
+            if left_type is None or right_type is None:
+                return None
+            name = kind(expression).__name__
+            if left_type != right_type:
+                return InterpTypeError(f"""Mismatched types for {name}:
+            Cannot combine {left_type} and {right_type}""")
+            match expression:
+                case Add():
+                    allowed = ADDABLE_TYPES
+                case Subtract() | Multiply() | Divide():
+                    allowed = ARITHMETIC_TYPES
+                case And() | Or():
+                    allowed = (Boolean,)
+                case _:
+                    allowed = None
+            if allowed is not None and type(left_type) not in allowed:
+                return InterpTypeError(f"Cannot perform {name} on {left_type}s")
+        case Not(expr=expr):
+            if expr.static_type is not None and expr.static_type != Boolean():
+                return InterpTypeError(
+                    "Cannot perform logical not on non-boolean operand.")
+        case If(condition=condition) | While(condition=condition):
+            if condition.static_type is not None and condition.static_type != Boolean():
+                return InterpTypeError(
+                    f"{kind(expression).__name__} condition must be Boolean, not {condition.static_type}.")
+    return None
+
+
+def typecheck(program: Expr, strict: bool = False) -> TypeReport:
+    """
+    Annotate every node of `program` with its `static_type` and report the
+    type errors that are certain to happen if the offending expressions
+    are evaluated. When `strict`, raise the first of them instead.
+    """
+    order = postorder(program)
+    variables: Dict[str, object] = {expression.variable.variable_name: BOTTOM for expression in order
+                                    if isinstance(expression, Assign)}
+    while True:
+        inferred: Dict[int, object] = {}
+        assigned: Dict[str, object] = {}
+        for expression in order:
+            inferred[id(expression)] = infer(expression, inferred, variables)
+            if isinstance(expression, Assign):
+                variable_name = expression.variable.variable_name
+                assigned[variable_name] = join(assigned.get(variable_name, BOTTOM),
+                                               inferred[id(expression.value)])
+        if assigned == variables:
+            break
+        variables = assigned
+
+    for expression in order:
+        inferred_type = inferred[id(expression)]
+        expression.static_type = inferred_type() if is_known(
+            inferred_type) else None
+
+    errors = []
+    for expression in order:
+        error = check(expression)
+        if error is not None:
+            if strict:
+                raise error
+            errors.append(error)
+
+    return TypeReport({variable_name: variable_type() for variable_name, variable_type in variables.items()
+                       if is_known(variable_type)}, errors,
+                      frozenset(variable_name for variable_name, variable_type in variables.items()
+                                if not is_known(variable_type)))
@@ -1,83 +1,72 @@
 """
 Types
+
+Every type is a singleton: `Integer()` always returns the same, canonical
+`Integer` instance. That makes type equality an identity check, lets
+types serve as dictionary keys and keeps evaluation from allocating a new
+type object for every value it produces. Pickling a type and loading it
+back also produces the canonical instance.
 """
 
 
 class Type(object):
-    def __init__(self):
-        pass
+    __slots__ = ()
+
+    _instance = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._instance = None
+
+    def __new__(cls):
+        instance = cls._instance
+        if instance is None:
+            instance = cls._instance = object.__new__(cls)
+        return instance
+
+    # Equality and hashing are by object identity, inherited from
+    # `object` (and so evaluated without calling back into Python).
+
+    def __reduce__(self):
+        return (type(self), ())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
 
 class Unit(Type):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __repr__(self):
         return "Unit"
 
-    def __eq__(self, other):
-        match other:
-            case Unit():
-                return True
-            case _:
-                return False
-
 
 class Integer(Type):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __repr__(self):
         return "Integer"
 
-    def __eq__(self, other):
-        match other:
-            case Integer():
-                return True
-            case _:
-                return False
-
 
 class FloatingPoint(Type):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __repr__(self):
         return "FloatingPoint"
 
-    def __eq__(self, other):
-        match other:
-            case FloatingPoint():
-                return True
-            case _:
-                return False
-
 
 class String(Type):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __repr__(self):
         return "String"
 
-    def __eq__(self, other):
-        match other:
-            case String():
-                return True
-            case _:
-                return False
-
 
 class Boolean(Type):
-    def __init__(self):
-        pass
+    __slots__ = ()
 
     def __repr__(self):
         return "Boolean"
-
-    def __eq__(self, other):
-        match other:
-            case Boolean():
-                return True
-            case _:
-                return False
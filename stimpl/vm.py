@@ -0,0 +1,403 @@
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from stimpl.expression import *
+from stimpl.types import *
+from stimpl.errors import *
+from stimpl.runtime import State, current_budget
+from stimpl.rope import concat
+from stimpl.codegen import ARITHMETIC_TYPES, ADDABLE_TYPES, ORDERED_TYPES, \
+    emit, fail_read, fail_assign, fail_arithmetic, fail_divide_by_zero, \
+    fail_logical, fail_not, fail_relational, fail_condition, fail_unhandled
+
+"""
+Bytecode virtual machine
+
+The bytecode compiler flattens an expression tree into a stream of
+fixed-width instructions -- an opcode followed by a single integer
+argument -- stored in an `array('i')`, so a program costs eight bytes per
+instruction. Literal values live in a constant pool and variables are
+resolved to integer slots at compile time. Both the compiler and the
+machine are loops over explicit stacks: neither depends on the Python
+recursion limit, no matter how deeply the program is nested.
+
+The machine is a stack machine. Every instruction consumes its operands
+from the top of the stack and pushes its result, a (value, type) pair.
+"""
+
+CONST = 0
+LOAD = 1
+STORE = 2
+POP = 3
+PRINT = 4
+NOT = 5
+ADD = 6
+SUBTRACT = 7
+MULTIPLY = 8
+DIVIDE = 9
+AND = 10
+OR = 11
+LT = 12
+LTE = 13
+GT = 14
+GTE = 15
+EQ = 16
+NE = 17
+JUMP = 18
+IF_FALSE = 19
+WHILE_FALSE = 20
+UNHANDLED = 21
+
+OPCODE_NAMES = ["CONST", "LOAD", "STORE", "POP", "PRINT", "NOT", "ADD",
+                "SUBTRACT", "MULTIPLY", "DIVIDE", "AND", "OR", "LT", "LTE",
+                "GT", "GTE", "EQ", "NE", "JUMP", "IF_FALSE", "WHILE_FALSE",
+                "UNHANDLED"]
+
+RELATIONAL_SYMBOLS = ("<", "<=", ">", ">=", "==", "!=")
+
+BINARY_OPCODES = {
+    Add: ADD, Subtract: SUBTRACT, Multiply: MULTIPLY, Divide: DIVIDE,
+    And: AND, Or: OR, Lt: LT, Lte: LTE, Gt: GT, Gte: GTE, Eq: EQ, Ne: NE,
+}
+
+
+class Bytecode(object):
+    def __init__(self, code: array, constants: List[Tuple[Any, Type]], names: List[str]) -> None:
+        self.code = code
+        self.constants = constants
+        self.names = names
+
+    def __len__(self) -> int:
+        return len(self.code) // 2
+
+    def __repr__(self) -> str:
+        return disassemble(self)
+
+
+"""
+Compiler
+"""
+
+# Compiler work items.
+VISIT = 0
+EMIT = 1
+EMIT_JUMP = 2
+LABEL = 3
+
+
+class BytecodeCompiler(object):
+    def __init__(self) -> None:
+        self.code = array('i')
+        self.constants: List[Tuple[Any, Type]] = []
+        self.constant_slots: Dict[Tuple[type, type, str], int] = {}
+        self.names: List[str] = []
+        self.slots: Dict[str, int] = {}
+        self.labels = 0
+
+    def constant(self, value: Any, value_type: Type) -> int:
+        # repr() keeps values that compare equal but are not the same
+        # (0.0 and -0.0, 1 and True) in separate constants.
+        key = (type(value_type), type(value), repr(value))
+        if key not in self.constant_slots:
+            self.constant_slots[key] = len(self.constants)
+            self.constants.append((value, value_type))
+        return self.constant_slots[key]
+
+    def slot(self, variable_name: str) -> int:
+        if variable_name not in self.slots:
+            self.slots[variable_name] = len(self.names)
+            self.names.append(variable_name)
+        return self.slots[variable_name]
+
+    def label(self) -> int:
+        self.labels += 1
+        return self.labels
+
+    def expand(self, expression: Expr) -> List[Tuple]:
+        """
+        The work items that compile `expression`, in the order that they
+        are to be performed.
+        """
+        match expression:
+            case Ren():
+                return [(EMIT, CONST, self.constant(None, Unit()))]
+
+            case IntLiteral(literal=l):
+                return [(EMIT, CONST, self.constant(l, Integer()))]
+
+            case FloatingPointLiteral(literal=l):
+                return [(EMIT, CONST, self.constant(l, FloatingPoint()))]
+
+            case StringLiteral(literal=l):
+                return [(EMIT, CONST, self.constant(l, String()))]
+
+            case BooleanLiteral(literal=l):
+                return [(EMIT, CONST, self.constant(l, Boolean()))]
+
+            case Print(to_print=to_print):
+                return [(VISIT, to_print), (EMIT, PRINT, 0)]
+
+            case Sequence(exprs=exprs) | Program(exprs=exprs):
+                if len(exprs) == 0:
+                    return [(EMIT, CONST, self.constant(None, Unit()))]
+                items = []
+                for expr in exprs[:-1]:
+                    items.append((VISIT, expr))
+                    items.append((EMIT, POP, 0))
+                items.append((VISIT, exprs[-1]))
+                return items
+
+            case Variable(variable_name=variable_name):
+                return [(EMIT, LOAD, self.slot(variable_name))]
+
+            case Assign(variable=variable, value=value):
+                return [(VISIT, value), (EMIT, STORE, self.slot(variable.variable_name))]
+
+            case Not(expr=expr):
+                return [(VISIT, expr), (EMIT, NOT, 0)]
+
+            case BinaryOperator(left=left, right=right) if kind(expression) in BINARY_OPCODES:
+                return [(VISIT, left), (VISIT, right),
+                        (EMIT, BINARY_OPCODES[kind(expression)], 0)]
+
+            case If(condition=condition, true=true, false=false):
+                false_label, end_label = self.label(), self.label()
+                return [(VISIT, condition), (EMIT_JUMP, IF_FALSE, false_label),
+                        (VISIT, true), (EMIT_JUMP, JUMP, end_label),
+                        (LABEL, false_label), (VISIT, false),
+                        (LABEL, end_label)]
+
+            case While(condition=condition, body=body):
+                top_label, end_label = self.label(), self.label()
+                return [(LABEL, top_label), (VISIT, condition),
+                        (EMIT_JUMP, WHILE_FALSE, end_label),
+                        (VISIT, body), (EMIT, POP, 0),
+                        (EMIT_JUMP, JUMP, top_label), (LABEL, end_label),
+                        (EMIT, CONST, self.constant(False, Boolean()))]
+
+            case _:
+                return [(EMIT, UNHANDLED, 0),
+                        (EMIT, CONST, self.constant(None, Unit()))]
+
+    def compile(self, program: Expr) -> Bytecode:
+        positions: Dict[int, int] = {}
+        jumps: List[Tuple[int, int]] = []
+        work = [(VISIT, program)]
+        while work:
+            item = work.pop()
+            match item[0]:
+                case 0:  # VISIT
+                    work.extend(reversed(self.expand(item[1])))
+                case 1:  # EMIT
+                    self.code.append(item[1])
+                    self.code.append(item[2])
+                case 2:  # EMIT_JUMP
+                    jumps.append((len(self.code) + 1, item[2]))
+                    self.code.append(item[1])
+                    self.code.append(0)
+                case 3:  # LABEL
+                    positions[item[1]] = len(self.code)
+
+        for position, label in jumps:
+            self.code[position] = positions[label]
+        return Bytecode(self.code, self.constants, self.names)
+
+
+def compile_bytecode(program: Expr) -> Bytecode:
+    return BytecodeCompiler().compile(program)
+
+
+def disassemble(bytecode: Bytecode) -> str:
+    code, constants, names = bytecode.code, bytecode.constants, bytecode.names
+    lines = []
+    for pc in range(0, len(code), 2):
+        opcode, argument = code[pc], code[pc + 1]
+        match opcode:
+            case 0:  # CONST
+                value, value_type = constants[argument]
+                comment = f"({value!r}, {value_type})"
+            case 1 | 2:  # LOAD | STORE
+                comment = f"({names[argument]})"
+            case 18 | 19 | 20:  # JUMP | IF_FALSE | WHILE_FALSE
+                comment = f"(to {argument})"
+            case _:
+                comment = ""
+        lines.append(
+            f"{pc:>6}  {OPCODE_NAMES[opcode]:<12}{argument:>6}  {comment}".rstrip())
+    return "\n".join(lines)
+
+
+"""
+Machine
+"""
+
+
+def execute(bytecode: Bytecode, state: State) -> Tuple[Optional[Any], Type, State]:
+    code, constants, names = bytecode.code, bytecode.constants, bytecode.names
+    initial = [state.get_value(variable_name) for variable_name in names]
+    slots = list(initial)
+    stack: List[Tuple[Any, Type]] = []
+    push, pop = stack.append, stack.pop
+    boolean = Boolean()
+    string = String()
+    budget = current_budget.get()
+    # The number of live bindings in the state that the machine would
+    # hand back, counted when the budget limits it.
+    bound = state.live_length() if budget is not None and budget.max_state_entries is not None else 0
+
+    pc = 0
+    end = len(code)
+    while pc < end:
+        opcode = code[pc]
+        argument = code[pc + 1]
+        pc += 2
+
+        if opcode == LOAD:
+            value = slots[argument]
+            if value is None:
+                fail_read(names[argument])
+            push(value)
+
+        elif opcode == CONST:
+            push(constants[argument])
+
+        elif opcode == STORE:
+            value = stack[-1]
+            current = slots[argument]
+            if current is None:
+                bound += 1
+            elif current[1] is not value[1]:
+                fail_assign(value[1], current[1])
+            slots[argument] = value
+
+        elif opcode == POP:
+            pop()
+
+        elif opcode == JUMP:
+            # Only the end of a loop jumps backwards.
+            if argument < pc and budget is not None:
+                budget.charge(entries=bound)
+            pc = argument
+
+        elif opcode == WHILE_FALSE or opcode == IF_FALSE:
+            condition_value, condition_type = pop()
+            if type(condition_type) is not Boolean:
+                fail_condition("While" if opcode == WHILE_FALSE else "If",
+                               condition_type)
+            if not condition_value:
+                pc = argument
+
+        elif ADD <= opcode <= MULTIPLY:
+            right_value, right_type = pop()
+            left_value, left_type = pop()
+            if opcode == ADD:
+                if left_type is not right_type or type(left_type) not in ADDABLE_TYPES:
+                    fail_arithmetic("Add", "add", "to", left_type, right_type)
+                if left_type is string:
+                    push((concat(left_value, right_value), left_type))
+                else:
+                    push((left_value + right_value, left_type))
+            elif opcode == SUBTRACT:
+                if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+                    fail_arithmetic("Subtract", "subtract",
+                                    "from", left_type, right_type)
+                push((left_value - right_value, left_type))
+            else:
+                if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+                    fail_arithmetic("Multiply", "multiply",
+                                    "by", left_type, right_type)
+                push((left_value * right_value, left_type))
+
+        elif LT <= opcode <= NE:
+            right_value, right_type = pop()
+            left_value, left_type = pop()
+            if left_type is not right_type or \
+                    (type(left_type) not in ORDERED_TYPES and type(left_type) is not Unit):
+                fail_relational(OPCODE_NAMES[opcode].capitalize(),
+                                RELATIONAL_SYMBOLS[opcode - LT], left_type, right_type)
+            if type(left_type) is Unit:
+                result = opcode == LTE or opcode == GTE or opcode == EQ
+            elif opcode == LT:
+                result = left_value < right_value
+            elif opcode == LTE:
+                result = left_value <= right_value
+            elif opcode == GT:
+                result = left_value > right_value
+            elif opcode == GTE:
+                result = left_value >= right_value
+            elif opcode == EQ:
+                result = left_value == right_value
+            else:
+                result = left_value != right_value
+            push((result, boolean))
+
+        elif opcode == DIVIDE:
+            right_value, right_type = pop()
+            left_value, left_type = pop()
+            if left_type is not right_type or type(left_type) not in ARITHMETIC_TYPES:
+                fail_arithmetic("Divide", "divide", "by", left_type, right_type)
+            if right_value == 0:
+                fail_divide_by_zero()
+            if type(left_type) is Integer:
+                push((left_value // right_value, left_type))
+            else:
+                push((left_value / right_value, left_type))
+
+        elif opcode == AND or opcode == OR:
+            right_value, right_type = pop()
+            left_value, left_type = pop()
+            if type(left_type) is not Boolean or type(right_type) is not Boolean:
+                if opcode == AND:
+                    fail_logical("And", "and", left_type, right_type)
+                fail_logical("Or", "or", left_type, right_type)
+            if opcode == AND:
+                push((left_value and right_value, left_type))
+            else:
+                push((left_value or right_value, left_type))
+
+        elif opcode == NOT:
+            value, value_type = pop()
+            if type(value_type) is not Boolean:
+                fail_not()
+            push((not value, value_type))
+
+        elif opcode == PRINT:
+            emit(*stack[-1])
+
+        else:
+            fail_unhandled()
+
+    value, value_type = pop()
+    return (value, value_type, bound_state(state, names, initial, slots))
+
+
+def bound_state(state: State, names: List[str], initial: List[Optional[Tuple[Any, Type]]],
+                slots: List[Optional[Tuple[Any, Type]]]) -> State:
+    """
+    `state` with the variables whose slots were assigned bound to their
+    values: the state that the machine hands back.
+    """
+    for slot, variable_name in enumerate(names):
+        if slots[slot] is not initial[slot]:
+            state = state.set_value(variable_name, *slots[slot])
+    return state
+
+
+"""
+Bytecode is cached per program object, weakly, just like the closures
+built by `stimpl.compile`.
+"""
+compiled_bytecode: 'WeakKeyDictionary[Expr, Bytecode]' = WeakKeyDictionary()
+
+
+def bytecode_for(program: Expr) -> Bytecode:
+    bytecode = compiled_bytecode.get(program)
+    if bytecode is None:
+        bytecode = compile_bytecode(program)
+        compiled_bytecode[program] = bytecode
+    return bytecode
+
+
+def evaluate_vm(expression: Expr, state: State) -> Tuple[Optional[Any], Type, State]:
+    return execute(bytecode_for(expression), state)
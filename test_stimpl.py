@@ -1,9 +1,62 @@
 from stimpl.expression import BooleanLiteral
 from stimpl.robustness import run_stimpl_robustness_tests
 from stimpl.test import run_stimpl_sanity_tests
-from stimpl.test_state import test_state_implementation
+from stimpl.test_state import test_state_implementation, test_persistent_state_implementation, test_state_compaction
+from stimpl.test_compile import test_closure_engine, test_counted_loops
+from stimpl.test_codegen import test_python_engine
+from stimpl.test_vm import test_vm_engine
+from stimpl.test_typecheck import test_typecheck
+from stimpl.test_types import test_type_singletons
+from stimpl.test_table import test_slotted_expressions, test_program_table
+from stimpl.test_optimize import test_optimize
+from stimpl.test_iterative import test_iterative_engine
+from stimpl.test_hashcons import test_hash_consing
+from stimpl.test_batch import test_batch
+from stimpl.test_parallel import test_run_stimpl_many
+from stimpl.test_serialize import test_serialize
+from stimpl.test_parse import test_parse
+from stimpl.test_output import test_output
+from stimpl.test_profile import test_profile
+from stimpl.test_hooks import test_hooks
+from stimpl.test_bench import test_bench
+from stimpl.test_limits import test_resource_limits
+from stimpl.test_rope import test_ropes
+from stimpl.test_incremental import test_incremental_runner
+from stimpl.test_snapshot import test_snapshots
+from stimpl.test_asynchronous import test_run_stimpl_async
 
 if __name__=='__main__':
   test_state_implementation()
+  test_persistent_state_implementation()
+  test_state_compaction()
   run_stimpl_sanity_tests()
-  run_stimpl_robustness_tests()
\ No newline at end of file
+  run_stimpl_robustness_tests()
+  test_closure_engine()
+  test_counted_loops()
+  test_python_engine()
+  test_vm_engine()
+  test_typecheck()
+  test_type_singletons()
+  test_slotted_expressions()
+  test_program_table()
+  test_optimize()
+  test_iterative_engine()
+  test_hash_consing()
+  try:
+    import numpy
+  except ImportError:
+    print("Skipping test_batch: batch execution requires NumPy.")
+  else:
+    test_batch()
+  test_run_stimpl_many()
+  test_serialize()
+  test_parse()
+  test_output()
+  test_profile()
+  test_hooks()
+  test_bench()
+  test_resource_limits()
+  test_ropes()
+  test_incremental_runner()
+  test_snapshots()
+  test_run_stimpl_async()